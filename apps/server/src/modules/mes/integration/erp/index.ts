@@ -126,6 +126,14 @@ export const syncErpRoutes = async (
 	return routesFullSyncPipeline(db, options);
 };
 
+// Re-export push ingest (external sync scripts -> MES)
+export {
+	ERP_INGEST_ENTITIES,
+	type ErpIngestResult,
+	ingestErpEnvelope,
+	parseErpIngestBody,
+	verifyErpIngestToken,
+} from "./ingest";
 // Re-export pull functions for direct use if needed
 export { pullRoutes, pullRoutesPaginated } from "./pull-routes";
 // Re-export types
@@ -0,0 +1,201 @@
+import { timingSafeEqual } from "node:crypto";
+import { gunzipSync } from "node:zlib";
+import type { Prisma, PrismaClient } from "@better-app/db";
+import type { ServiceResult } from "../../../../types/service-result";
+import type { IntegrationEnvelope } from "../sync-pipeline";
+import { hashPayload, toJsonValue } from "../utils";
+import { applyBoms } from "./apply-boms";
+import { applyMaterials } from "./apply-materials";
+import { applyWorkCenters } from "./apply-work-centers";
+import { applyWorkOrders } from "./apply-work-orders";
+import type { ErpBomItem, ErpMaterial, ErpWorkCenter, ErpWorkOrder } from "./types";
+
+// ==========================================
+// Push Ingest (ERP -> MES)
+// ==========================================
+//
+// Receives IntegrationEnvelope batches pushed by the external Kingdee sync scripts
+// (domain_docs/external_erp/mes_sink.py) instead of pulling from Kingdee. Items only carry
+// the fields the script fetched; the apply functions treat missing fields as unchanged.
+
+type IngestTarget = {
+	entityType: string;
+	apply: (tx: Prisma.TransactionClient, items: unknown[], dedupeKey: string) => Promise<void>;
+	applyBatchSize?: number;
+};
+
+const INGEST_TARGETS: Record<string, IngestTarget> = {
+	materials: {
+		entityType: "MATERIAL",
+		apply: (tx, items, dedupeKey) => applyMaterials(tx, items as ErpMaterial[], dedupeKey),
+	},
+	boms: {
+		entityType: "BOM",
+		apply: (tx, items, dedupeKey) => applyBoms(tx, items as ErpBomItem[], dedupeKey),
+	},
+	"work-centers": {
+		entityType: "WORK_CENTER",
+		apply: (tx, items, dedupeKey) => applyWorkCenters(tx, items as ErpWorkCenter[], dedupeKey),
+	},
+	"work-orders": {
+		entityType: "WORK_ORDER",
+		apply: (tx, items, dedupeKey) => applyWorkOrders(tx, items as ErpWorkOrder[], dedupeKey),
+		applyBatchSize: 50,
+	},
+};
+
+export const ERP_INGEST_ENTITIES = Object.keys(INGEST_TARGETS);
+
+export type ErpIngestResult = {
+	messageId: string;
+	entityType: string;
+	dedupeKey: string;
+	received: number;
+	duplicate: boolean;
+};
+
+/**
+ * Service-token check for the ingest route only: the sync scripts send
+ * "Authorization: Bearer <MES_INGEST_TOKEN>". Ingest is disabled while the token is unset.
+ */
+export const verifyErpIngestToken = (authorization?: string | null): ServiceResult<null> => {
+	const expected = process.env.MES_INGEST_TOKEN?.trim();
+	if (!expected) {
+		return {
+			success: false,
+			code: "ERP_INGEST_DISABLED",
+			message: "ERP ingest is disabled (MES_INGEST_TOKEN is not set)",
+			status: 503,
+		};
+	}
+
+	const provided = Buffer.from(/^Bearer\s+(.+)$/i.exec(authorization ?? "")?.[1]?.trim() ?? "");
+	const token = Buffer.from(expected);
+	if (provided.length !== token.length || !timingSafeEqual(provided, token)) {
+		return {
+			success: false,
+			code: "UNAUTHORIZED",
+			message: "Invalid or missing ingest token",
+			status: 401,
+		};
+	}
+	return { success: true, data: null };
+};
+
+/**
+ * Body parser for ingest requests: the sync scripts send gzip-compressed JSON
+ * (Content-Encoding: gzip). Uncompressed bodies fall through to the default JSON parser.
+ */
+export const parseErpIngestBody = async ({ request }: { request: Request }) => {
+	if (request.headers.get("content-encoding")?.toLowerCase() !== "gzip") return;
+	const compressed = new Uint8Array(await request.arrayBuffer());
+	return JSON.parse(gunzipSync(compressed).toString("utf8"));
+};
+
+/**
+ * Apply one pushed envelope.
+ * Deduplicates on the Idempotency-Key header (falls back to the payload hash, like the
+ * pull pipeline), so retried or re-run batches are acknowledged without re-applying.
+ */
+export const ingestErpEnvelope = async (
+	db: PrismaClient,
+	entity: string,
+	envelope: IntegrationEnvelope<unknown>,
+	idempotencyKey?: string | null,
+): Promise<ServiceResult<ErpIngestResult>> => {
+	const target = INGEST_TARGETS[entity];
+	if (!target) {
+		return {
+			success: false,
+			code: "ERP_INGEST_ENTITY_UNSUPPORTED",
+			message: `Unsupported ERP ingest entity: ${entity} (supported: ${ERP_INGEST_ENTITIES.join(
+				", ",
+			)})`,
+			status: 404,
+		};
+	}
+
+	const { sourceSystem, entityType, items } = envelope;
+	if (entityType !== target.entityType) {
+		return {
+			success: false,
+			code: "ERP_INGEST_ENTITY_MISMATCH",
+			message: `Envelope entityType ${entityType} does not match ${entity} (${target.entityType})`,
+			status: 400,
+		};
+	}
+
+	const dedupeKey = idempotencyKey || `${sourceSystem}:${entityType}:${hashPayload(envelope)}`;
+	const nextSyncAt = envelope.cursor?.nextSyncAt ?? "NONE";
+	const businessKey = `${sourceSystem}:${entityType}:ingest:${nextSyncAt}`;
+
+	const duplicate = await db.integrationMessage.findFirst({
+		where: { direction: "IN", system: sourceSystem, entityType, dedupeKey, status: "SUCCESS" },
+		orderBy: { createdAt: "desc" },
+		select: { id: true },
+	});
+	if (duplicate) {
+		return {
+			success: true,
+			data: {
+				messageId: duplicate.id,
+				entityType,
+				dedupeKey,
+				received: items.length,
+				duplicate: true,
+			},
+		};
+	}
+
+	const batchSize = target.applyBatchSize ?? items.length;
+	try {
+		for (let i = 0; i < items.length; i += Math.max(batchSize, 1)) {
+			const batch = items.slice(i, i + Math.max(batchSize, 1));
+			await db.$transaction(
+				async (tx: Prisma.TransactionClient) => {
+					await target.apply(tx, batch, dedupeKey);
+				},
+				{ timeout: 60000 },
+			);
+		}
+	} catch (error) {
+		const message = error instanceof Error ? error.message : String(error);
+		await db.integrationMessage.create({
+			data: {
+				direction: "IN",
+				system: sourceSystem,
+				entityType,
+				businessKey,
+				dedupeKey,
+				status: "FAILED",
+				payload: toJsonValue({ cursor: envelope.cursor, received: items.length }),
+				error: message,
+			},
+		});
+		return { success: false, code: "ERP_INGEST_APPLY_FAILED", message, status: 422 };
+	}
+
+	const created = await db.integrationMessage.create({
+		data: {
+			direction: "IN",
+			system: sourceSystem,
+			entityType,
+			businessKey,
+			dedupeKey,
+			status: "SUCCESS",
+			payload: toJsonValue(envelope),
+		},
+		select: { id: true },
+	});
+
+	return {
+		success: true,
+		data: {
+			messageId: created.id,
+			entityType,
+			dedupeKey,
+			received: items.length,
+			duplicate: false,
+		},
+	};
+};
@@ -14,11 +14,14 @@ import {
 } from "./device-data-schema";
 import { receiveDeviceData } from "./device-data-service";
 import {
+	ingestErpEnvelope,
+	parseErpIngestBody,
 	syncErpBoms,
 	syncErpMaterials,
 	syncErpRoutes,
 	syncErpWorkCenters,
 	syncErpWorkOrders,
+	verifyErpIngestToken,
 } from "./erp";
 import {
 	inspectionResultReceiveSchema,
@@ -62,6 +65,9 @@ import {
 import { enqueueRunCompletionOutboundFeedback } from "./outbound-feedback-service";
 import {
 	erpBomPullResponseSchema,
+	erpIngestBodySchema,
+	erpIngestParamsSchema,
+	erpIngestResponseSchema,
 	erpMasterSyncQuerySchema,
 	erpMaterialPullResponseSchema,
 	erpRoutePullResponseSchema,
@@ -732,6 +738,77 @@ export const integrationModule = new Elysia({
 			detail: { tags: ["MES - Integration"] },
 		},
 	)
+	.post(
+		"/erp/:entity/ingest",
+		async ({ params, body, headers, set, db, request }) => {
+			// Service token scoped to this route; no user session, audited as SYSTEM
+			const auth = verifyErpIngestToken(headers.authorization);
+			if (!auth.success) {
+				set.status = auth.status ?? 401;
+				return { ok: false, error: { code: auth.code, message: auth.message } };
+			}
+			const actor = buildAuditActor();
+			const requestMeta = buildAuditRequestMeta(request);
+			const idempotencyKey = headers["idempotency-key"] ?? null;
+			const result = await ingestErpEnvelope(db, params.entity, body, idempotencyKey);
+			if (!result.success) {
+				await recordAuditEvent(db, {
+					entityType: AuditEntityType.INTEGRATION,
+					entityId: `ERP:${body.entityType}`,
+					entityDisplay: `ERP ${body.entityType} INGEST`,
+					action: "ERP_INGEST",
+					actor,
+					status: "FAIL",
+					errorCode: result.code,
+					errorMessage: result.message,
+					request: requestMeta,
+					payload: {
+						sourceSystem: body.sourceSystem,
+						entityType: body.entityType,
+						entity: params.entity,
+						idempotencyKey,
+						received: body.items.length,
+					},
+				});
+				set.status = result.status ?? 400;
+				return { ok: false, error: { code: result.code, message: result.message } };
+			}
+			await recordAuditEvent(db, {
+				entityType: AuditEntityType.INTEGRATION,
+				entityId: result.data.messageId,
+				entityDisplay: `ERP ${result.data.entityType} INGEST`,
+				action: "ERP_INGEST",
+				actor,
+				status: "SUCCESS",
+				request: requestMeta,
+				payload: {
+					sourceSystem: body.sourceSystem,
+					entityType: result.data.entityType,
+					entity: params.entity,
+					dedupeKey: result.data.dedupeKey,
+					received: result.data.received,
+					duplicate: result.data.duplicate,
+					cursor: body.cursor,
+				},
+			});
+			return { ok: true, data: result.data };
+		},
+		{
+			// Sync scripts send gzip-compressed envelopes (Content-Encoding: gzip)
+			parse: parseErpIngestBody,
+			params: erpIngestParamsSchema,
+			body: erpIngestBodySchema,
+			response: {
+				200: erpIngestResponseSchema,
+				400: integrationErrorResponseSchema,
+				401: integrationErrorResponseSchema,
+				404: integrationErrorResponseSchema,
+				422: integrationErrorResponseSchema,
+				503: integrationErrorResponseSchema,
+			},
+			detail: { tags: ["MES - Integration"] },
+		},
+	)
 	.post(
 		"/tpm/equipment/sync",
 		async ({ query, set, db, user, request }) => {
@@ -237,6 +237,32 @@ export const integrationStatusResponseSchema = t.Object({
 	}),
 });
 
+export const erpIngestParamsSchema = t.Object({
+	entity: t.String(),
+});
+
+export const erpIngestBodySchema = t.Object({
+	sourceSystem: t.String(),
+	entityType: t.String(),
+	cursor: t.Object({
+		// Kingdee FModifyDate (local time, no offset), so not validated as date-time
+		nextSyncAt: t.Optional(t.String()),
+		hasMore: t.Boolean(),
+	}),
+	items: t.Array(t.Record(t.String(), t.Any())),
+});
+
+export const erpIngestResponseSchema = t.Object({
+	ok: t.Boolean(),
+	data: t.Object({
+		messageId: t.String(),
+		entityType: t.String(),
+		dedupeKey: t.String(),
+		received: t.Number(),
+		duplicate: t.Boolean(),
+	}),
+});
+
 export const integrationErrorResponseSchema = t.Object({
 	ok: t.Boolean(),
 	error: t.Object({
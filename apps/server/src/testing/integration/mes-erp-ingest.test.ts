@@ -0,0 +1,201 @@
+import { afterAll, beforeAll, describe, expect, test } from "bun:test";
+import { gzipSync } from "node:zlib";
+import { startTestServer, type TestAppHandle } from "../helpers/test-app";
+import { setupTestDb, type TestDbHandle } from "../helpers/test-db";
+
+type IngestResponse = {
+	ok: boolean;
+	data?: {
+		messageId: string;
+		entityType: string;
+		dedupeKey: string;
+		received: number;
+		duplicate: boolean;
+	};
+	error?: { code: string; message: string };
+};
+
+const INGEST_TOKEN = `ingest-test-${Date.now()}`;
+
+class IngestClient {
+	constructor(
+		private readonly baseUrl: string,
+		private readonly token: string,
+	) {}
+
+	/** Same wire format as mes_sink.py: gzip JSON + Idempotency-Key + Bearer service token */
+	async ingest(
+		entity: string,
+		envelope: unknown,
+		options: { idempotencyKey?: string; token?: string | null } = {},
+	): Promise<{ res: Response; data: IngestResponse | null }> {
+		const token = options.token === undefined ? this.token : options.token;
+		const headers: Record<string, string> = {
+			"Content-Type": "application/json",
+			"Content-Encoding": "gzip",
+		};
+		if (token) headers.Authorization = `Bearer ${token}`;
+		if (options.idempotencyKey) headers["Idempotency-Key"] = options.idempotencyKey;
+
+		const res = await fetch(`${this.baseUrl}/api/integration/erp/${entity}/ingest`, {
+			method: "POST",
+			headers,
+			body: gzipSync(JSON.stringify(envelope)),
+		});
+		const text = await res.text();
+		return { res, data: text.length > 0 ? (JSON.parse(text) as IngestResponse) : null };
+	}
+}
+
+describe("integration: erp push ingest", () => {
+	let db: TestDbHandle;
+	let app: TestAppHandle;
+	let dbModule: typeof import("@better-app/db");
+	let client: IngestClient;
+
+	beforeAll(async () => {
+		db = await setupTestDb({ prefix: "integration", seed: true });
+		process.env.DATABASE_URL = db.databaseUrl;
+		dbModule = await import("@better-app/db");
+		process.env.MES_INGEST_TOKEN = INGEST_TOKEN;
+		app = await startTestServer(db);
+		client = new IngestClient(app.baseUrl, INGEST_TOKEN);
+	});
+
+	afterAll(async () => {
+		await dbModule?.default?.$disconnect();
+		await app?.stop();
+		await db?.cleanup();
+	});
+
+	test("POST /api/integration/erp/materials/ingest applies gzip envelope and dedupes", async () => {
+		const uniq = `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+		const materialCode = `MAT-INGEST-${uniq}`;
+		const envelope = {
+			sourceSystem: "ERP",
+			entityType: "MATERIAL",
+			cursor: { hasMore: false, nextSyncAt: "2026-01-01T00:00:00" },
+			items: [
+				{
+					materialCode,
+					name: "Ingested material",
+					category: "Raw",
+					unit: "PCS",
+					updatedAt: "2026-01-01T00:00:00",
+				},
+			],
+		};
+		const idempotencyKey = `ERP:MATERIAL:${uniq}`;
+
+		const first = await client.ingest("materials", envelope, { idempotencyKey });
+		expect(first.res.status).toBe(200);
+		expect(first.data?.ok).toBe(true);
+		expect(first.data?.data?.duplicate).toBe(false);
+		expect(first.data?.data?.received).toBe(1);
+
+		const dbClient = dbModule.createDbClient();
+		try {
+			const material = await dbClient.material.findUnique({ where: { code: materialCode } });
+			expect(material?.name).toBe("Ingested material");
+			expect(material?.unit).toBe("PCS");
+
+			const second = await client.ingest("materials", envelope, { idempotencyKey });
+			expect(second.res.status).toBe(200);
+			expect(second.data?.data?.duplicate).toBe(true);
+			expect(second.data?.data?.messageId).toBe(first.data?.data?.messageId);
+
+			const messages = await dbClient.integrationMessage.count({
+				where: { system: "ERP", entityType: "MATERIAL", dedupeKey: idempotencyKey },
+			});
+			expect(messages).toBe(1);
+		} finally {
+			await dbClient.$disconnect();
+		}
+	});
+
+	test("POST /api/integration/erp/boms/ingest applies edges", async () => {
+		const uniq = `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+		const parentCode = `BOM-P-${uniq}`;
+		const envelope = {
+			sourceSystem: "ERP",
+			entityType: "BOM",
+			cursor: { hasMore: false },
+			items: [
+				{ parentCode, childCode: `BOM-C1-${uniq}`, qty: 2 },
+				{ parentCode, childCode: `BOM-C2-${uniq}`, qty: 1 },
+			],
+		};
+
+		const result = await client.ingest("boms", envelope);
+		expect(result.res.status).toBe(200);
+		expect(result.data?.data?.received).toBe(2);
+
+		const dbClient = dbModule.createDbClient();
+		try {
+			const items = await dbClient.bomItem.findMany({ where: { parentCode } });
+			expect(items.length).toBe(2);
+		} finally {
+			await dbClient.$disconnect();
+		}
+	});
+
+	test("rejects unsupported entities and mismatched envelopes", async () => {
+		const envelope = {
+			sourceSystem: "ERP",
+			entityType: "CUSTOMER",
+			cursor: { hasMore: false },
+			items: [],
+		};
+
+		const unsupported = await client.ingest("customers", envelope);
+		expect(unsupported.res.status).toBe(404);
+		expect(unsupported.data?.error?.code).toBe("ERP_INGEST_ENTITY_UNSUPPORTED");
+
+		const mismatch = await client.ingest("materials", envelope);
+		expect(mismatch.res.status).toBe(400);
+		expect(mismatch.data?.error?.code).toBe("ERP_INGEST_ENTITY_MISMATCH");
+	});
+
+	test("requires the ingest service token", async () => {
+		const envelope = {
+			sourceSystem: "ERP",
+			entityType: "MATERIAL",
+			cursor: { hasMore: false },
+			items: [],
+		};
+
+		const missing = await client.ingest("materials", envelope, { token: null });
+		expect(missing.res.status).toBe(401);
+		expect(missing.data?.error?.code).toBe("UNAUTHORIZED");
+
+		const wrong = await client.ingest("materials", envelope, { token: `${INGEST_TOKEN}-x` });
+		expect(wrong.res.status).toBe(401);
+	});
+
+	test("a user session does not authenticate ingest", async () => {
+		const login = await fetch(`${app.baseUrl}/api/auth/sign-in/email`, {
+			method: "POST",
+			headers: { "Content-Type": "application/json" },
+			body: JSON.stringify({
+				email: process.env.SEED_ADMIN_EMAIL || "admin@example.com",
+				password: process.env.SEED_ADMIN_PASSWORD || "ChangeMe123!",
+			}),
+		});
+		expect(login.ok).toBe(true);
+		// bearer() is not enabled globally, so sign-in does not hand out a bearer token
+		expect(login.headers.get("set-auth-token")).toBeNull();
+
+		const cookie = (login.headers.get("set-cookie") || "").split(";")[0] || "";
+		const res = await fetch(`${app.baseUrl}/api/integration/erp/materials/ingest`, {
+			method: "POST",
+			headers: { "Content-Type": "application/json", Cookie: cookie },
+			body: JSON.stringify({
+				sourceSystem: "ERP",
+				entityType: "MATERIAL",
+				cursor: { hasMore: false },
+				items: [],
+			}),
+		});
+		expect(res.status).toBe(401);
+	});
+});
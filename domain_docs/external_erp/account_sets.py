@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+金蝶账套（DBID）及其登录凭据
+
+单账套时沿用 config_sso 的 BASE_URL / DBID / USERNAME / APPID / APP_SECRET / LCID（default_account()）；
+多工厂时每个工厂一个账套，由 load_account_sets() 从 JSON 文件读取:
+
+[
+  {"name": "plant-sz", "dbid": "6512a0b3e6f1c2", "username": "mes_api", "appid": "...", "app_secret_env": "KD_SECRET_SZ"},
+  {"name": "plant-wx", "dbid": "6512a0b3e6f1c3", "base_url": "http://erp-wx/k3cloud"}
+]
+
+未写的字段取 config_sso 的值；密钥可用 app_secret 直接写，也可用 app_secret_env 指定环境变量名，
+避免把密钥写进文件。name 用作输出分区（库文件、日志、缓存目录）的名字，只能是字母、数字、_ 和 -。
+"""
+
+import json
+import os
+import re
+from typing import Optional
+
+from config_sso import BASE_URL, DBID, USERNAME, APPID, APP_SECRET, LCID
+
+
+_NAME = re.compile(r'^[\w-]+$', re.ASCII)
+FIELDS = ('base_url', 'dbid', 'username', 'appid', 'app_secret', 'lcid')
+
+
+class AccountSet:
+    """一个金蝶账套的连接参数"""
+
+    __slots__ = ('name',) + FIELDS
+
+    def __init__(self, name: str, dbid: str, base_url: str = BASE_URL, username: str = USERNAME,
+                 appid: str = APPID, app_secret: str = APP_SECRET, lcid: int = LCID):
+        self.name = name
+        self.base_url = base_url
+        self.dbid = dbid
+        self.username = username
+        self.appid = appid
+        self.app_secret = app_secret
+        self.lcid = lcid
+
+
+def default_account() -> AccountSet:
+    """config_sso 里配置的账套"""
+    return AccountSet('default', DBID)
+
+
+def _account_from_dict(entry, index: int) -> AccountSet:
+    if not isinstance(entry, dict):
+        raise ValueError(f"第 {index + 1} 个账套不是对象")
+    name = entry.get('name')
+    if not isinstance(name, str) or not _NAME.match(name):
+        raise ValueError(f"第 {index + 1} 个账套的 name 无效（只能是字母、数字、_ 和 -）: {name!r}")
+    if not entry.get('dbid'):
+        raise ValueError(f"账套 {name} 缺少 dbid")
+    unknown = set(entry) - set(FIELDS) - {'name', 'app_secret_env'}
+    if unknown:
+        raise ValueError(f"账套 {name} 有未知字段: {', '.join(sorted(unknown))}")
+
+    options = {field: entry[field] for field in FIELDS if field in entry}
+    secret_env = entry.get('app_secret_env')
+    if secret_env:
+        if secret_env not in os.environ:
+            raise ValueError(f"账套 {name} 的密钥环境变量 {secret_env} 未设置")
+        options['app_secret'] = os.environ[secret_env]
+    return AccountSet(name, **options)
+
+
+def load_account_sets(path: str, only: Optional[list] = None) -> list:
+    """读取账套列表；only 为要保留的账套名。格式或取值不对时抛 ValueError"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"无法读取账套文件 {path}: {e}") from e
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"账套文件 {path} 应为非空的 JSON 数组")
+
+    accounts = [_account_from_dict(entry, i) for i, entry in enumerate(entries)]
+    names = [account.name for account in accounts]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"账套 name 重复: {', '.join(duplicates)}")
+    if only:
+        unknown = [name for name in only if name not in names]
+        if unknown:
+            raise ValueError(f"账套文件里没有: {', '.join(unknown)}")
+        accounts = [account for account in accounts if account.name in only]
+    return accounts
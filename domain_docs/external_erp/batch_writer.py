@@ -0,0 +1,668 @@
+# -*- coding: utf-8 -*-
+"""
+批量写入（替代逐行 upsert_* / cursor.execute）
+
+每个 BatchWriter 持有一个连接，攒够 batch_size 行后用 executemany 写入，
+一批一个事务。列顺序以 TABLE_SCHEMAS 为准，add() 传入的元组需与之一致。
+
+写入前按内容哈希去重：每行规范化字段的 sha256 存在 sync_row_hash 表里，
+哈希没变的行直接跳过，不再重写目标表（与 MES 端 hashPayload 的做法一致）。
+
+派生列（DERIVED_COLUMNS，如库存可用数量、客户权重）在同一个写事务里按主键只对
+新增/变化的行重算；enhance_existing_data 用同样的语句回填历史行，由部分索引支撑。
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from sync_state import connect
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+# 不参与内容哈希的列（每次写入都会变）
+VOLATILE_COLUMNS = ('updated_at',)
+
+# SQLite 单条语句的参数上限较低，按块查询已存哈希
+HASH_LOOKUP_CHUNK = 500
+
+# 表名 -> (主键列, 写入列)；列名与 database.upsert_* 写入的字段一致
+TABLE_SCHEMAS = {
+    'materials': (
+        ('material_id',),
+        ('material_id', 'material_name', 'category', 'unit'),
+    ),
+    'customers': (
+        ('customer_id',),
+        ('customer_id', 'customer_name', 'tier'),
+    ),
+    'manufacturing_orders': (
+        ('mo_no',),
+        ('mo_no', 'so_no', 'material_id', 'customer_id', 'qty_plan', 'status', 'promise_date'),
+    ),
+    'inventory': (
+        ('material_id',),
+        ('material_id', 'qty_on_hand'),
+    ),
+    'purchase_orders': (
+        ('po_no', 'po_line_no'),
+        ('po_no', 'po_line_no', 'material_id', 'qty_ordered', 'qty_remaining', 'promised_date', 'is_confirmed'),
+    ),
+    'bom': (
+        ('parent_id', 'child_id'),
+        ('parent_id', 'child_id', 'qty'),
+    ),
+    'sales_orders': (
+        ('so_no', 'so_line_no'),
+        ('so_no', 'so_line_no', 'customer_id', 'customer_name', 'material_id', 'material_name',
+         'qty_ordered', 'qty_remaining', 'unit_price', 'revenue', 'promise_date', 'updated_at'),
+    ),
+    'suppliers': (
+        ('supplier_id',),
+        ('supplier_id', 'supplier_name', 'lead_time_days', 'otd_rate_3m', 'otd_rate_12m',
+         'expedite_premium', 'updated_at'),
+    ),
+    'workcenters': (
+        ('workcenter_id',),
+        ('workcenter_id', 'workcenter_name', 'workcenter_type', 'daily_capacity_hours',
+         'shift_count', 'oee_avg', 'rty_avg', 'updated_at'),
+    ),
+    'inventory_by_warehouse': (
+        ('material_id', 'stock_id'),
+        ('material_id', 'stock_id', 'qty_on_hand'),
+    ),
+}
+
+# database.init_db 之外、由同步首次写入时自行创建的表
+EXTRA_TABLES = {
+    'inventory_by_warehouse': '''
+        CREATE TABLE IF NOT EXISTS inventory_by_warehouse (
+            material_id TEXT NOT NULL,
+            stock_id TEXT NOT NULL,
+            qty_on_hand REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (material_id, stock_id)
+        )
+    ''',
+}
+
+
+# 表名 -> [(SET 子句, 批内重算条件, 回填条件)]
+# 批内条件为 None 表示变化行总是重算；回填条件同时用作部分索引的 WHERE
+DERIVED_COLUMNS = {
+    'purchase_orders': (
+        # 暂时设置默认供应商，实际应该从金蝶重新查询
+        ("supplier_id = 'DEFAULT_SUPPLIER', supplier_name = '默认供应商', is_confirmed = 1",
+         "supplier_id IS NULL OR supplier_id = ''",
+         "supplier_id IS NULL OR supplier_id = ''"),
+        ("unit_price = CASE WHEN qty_ordered > 0 THEN amount / qty_ordered ELSE 0 END",
+         None,
+         "unit_price IS NULL AND amount IS NOT NULL"),
+    ),
+    'inventory': (
+        # 可用数量为 0 是真实值（如全部已分配），变化行已在批内重算，回填只补 NULL
+        ("qty_available = qty_on_hand - COALESCE(qty_allocated, 0)",
+         None,
+         "qty_available IS NULL"),
+    ),
+    'customers': (
+        ("tier_weight = CASE WHEN tier = 'Tier 1' THEN 1.5 WHEN tier = 'Tier 2' THEN 1.2 ELSE 1.0 END",
+         None,
+         "tier_weight IS NULL OR tier_weight = 0"),
+    ),
+    'materials': (
+        ("lead_time_days = 30",
+         "lead_time_days IS NULL OR lead_time_days = 0",
+         "lead_time_days IS NULL OR lead_time_days = 0"),
+    ),
+}
+
+
+def build_derive_sql(table: str) -> list:
+    """按主键重算派生列的 UPDATE 语句（参数为主键值）"""
+    key_columns, _ = TABLE_SCHEMAS[table]
+    key_match = ' AND '.join(f"{col} = ?" for col in key_columns)
+    statements = []
+    for assignments, condition, _ in DERIVED_COLUMNS.get(table, ()):
+        where = f"{key_match} AND ({condition})" if condition else key_match
+        statements.append(f"UPDATE {table} SET {assignments} WHERE {where}")
+    return statements
+
+
+def build_upsert_sql(table: str) -> str:
+    """INSERT ... ON CONFLICT DO UPDATE，只覆盖写入列，保留表中其他列（如 qty_allocated）"""
+    key_columns, columns = TABLE_SCHEMAS[table]
+    updates = ', '.join(f"{col} = excluded.{col}" for col in columns if col not in key_columns)
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+        f"ON CONFLICT({', '.join(key_columns)}) DO UPDATE SET {updates}"
+    )
+
+
+def content_hash(values) -> str:
+    """规范化字段的稳定哈希：紧凑 JSON（同 JSON.stringify）后取 sha256"""
+    payload = json.dumps(list(values), ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _ensure_hash_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_row_hash (
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            PRIMARY KEY (table_name, row_key)
+        )
+    ''')
+
+
+def _ensure_target_table(conn, table: str):
+    if table in EXTRA_TABLES:
+        conn.execute(EXTRA_TABLES[table])
+
+
+class BatchWriter:
+    """按批写入一张表，只写新增和内容有变化的行
+
+    用法:
+        with BatchWriter('materials', batch_size=1000, lock=db_lock) as writer:
+            for ...:
+                writer.add((material_id, name, category, unit))
+        print(writer.written, writer.summary())
+
+    written 为实际落库的行数（含内容未变的行；批内重复的主键只算一行，写入失败的行不算）。
+    stats 统计 inserted / updated / unchanged；track_missing=True（全量拉取）时
+    另外给出 missing：本次没有出现、但之前同步过的行数。
+    传入 metrics（sync_metrics.EntityMetrics）时累计 write / commit 耗时。
+    db_path 为 None 时写 database.get_db 的默认库，否则写该路径的库（见 sync_state.connect）。
+    on_commit(conn, rows) 在每批提交前、同一个事务里调用（如写断点），整批没有变化时也会调用。
+    """
+
+    def __init__(self, table: str, batch_size: int = DEFAULT_BATCH_SIZE, lock=None,
+                 track_missing: bool = False, metrics=None, db_path: str = None):
+        key_columns, columns = TABLE_SCHEMAS[table]
+        self.table = table
+        self.db_path = db_path
+        self.batch_size = max(batch_size, 1)
+        self.lock = lock
+        self.track_missing = track_missing
+        self.metrics = metrics
+        self.sql = build_upsert_sql(table)
+        self.derive_sql = build_derive_sql(table)
+        self.key_index = tuple(columns.index(col) for col in key_columns)
+        self.hash_index = tuple(i for i, col in enumerate(columns) if col not in VOLATILE_COLUMNS)
+        self.pending = []
+        self.written = 0
+        self.stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        self.known_before = None
+        self.on_commit = None
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def add(self, row: tuple):
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        """写入当前批次，返回落库的行数（含未变化被跳过的行，不含批内重复主键和写入失败的行）"""
+        if not self.pending:
+            return 0
+
+        batch, self.pending = self.pending, []
+        if self.lock is not None:
+            with self.lock:
+                written = self._write(batch)
+        else:
+            written = self._write(batch)
+        self.written += written
+        return written
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = connect(self.db_path)
+            _ensure_hash_table(self.conn)
+            _ensure_target_table(self.conn, self.table)
+            if self.track_missing:
+                self.known_before = self.conn.execute(
+                    'SELECT COUNT(*) FROM sync_row_hash WHERE table_name = ?', (self.table,)
+                ).fetchone()[0]
+            self.conn.commit()
+        return self.conn
+
+    def _row_key(self, row: tuple) -> str:
+        return '\x1f'.join(str(row[i]) for i in self.key_index)
+
+    def _load_hashes(self, keys: list) -> dict:
+        stored = {}
+        for start in range(0, len(keys), HASH_LOOKUP_CHUNK):
+            chunk = keys[start:start + HASH_LOOKUP_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            stored.update(self.conn.execute(
+                f'SELECT row_key, content_hash FROM sync_row_hash '
+                f'WHERE table_name = ? AND row_key IN ({placeholders})',
+                [self.table, *chunk],
+            ).fetchall())
+        return stored
+
+    def _write(self, batch: list) -> int:
+        started = time.perf_counter()
+        self._connect()
+
+        # 同一批内同一主键以后到的行为准
+        keyed = {}
+        for row in batch:
+            keyed[self._row_key(row)] = row
+        stored = self._load_hashes(list(keyed))
+
+        changed = []
+        for key, row in keyed.items():
+            digest = content_hash(row[i] for i in self.hash_index)
+            previous = stored.get(key)
+            if previous == digest:
+                self.stats['unchanged'] += 1
+            else:
+                changed.append((key, row, digest, 'inserted' if previous is None else 'updated'))
+
+        accepted = len(keyed)
+        if changed:
+            commit_seconds, accepted = self._apply(changed, accepted)
+        elif self.on_commit is not None:
+            self.on_commit(self.conn, accepted)
+            started_commit = time.perf_counter()
+            self.conn.commit()
+            commit_seconds = time.perf_counter() - started_commit
+        else:
+            commit_seconds = 0.0
+        if self.metrics is not None:
+            self.metrics.add('write', time.perf_counter() - started - commit_seconds)
+            self.metrics.add('commit', commit_seconds)
+        return accepted
+
+    def _apply(self, changed: list, rows: int) -> tuple:
+        """目标表和哈希表在同一个事务里写入，返回 (提交耗时, 落库行数)"""
+        hash_sql = '''
+            INSERT INTO sync_row_hash (table_name, row_key, content_hash) VALUES (?, ?, ?)
+            ON CONFLICT(table_name, row_key) DO UPDATE SET content_hash = excluded.content_hash
+        '''
+        try:
+            self.conn.executemany(self.sql, [row for _, row, _, _ in changed])
+            self.conn.executemany(hash_sql, [(self.table, key, digest) for key, _, digest, _ in changed])
+            self._derive([row for _, row, _, _ in changed])
+            if self.on_commit is not None:
+                self.on_commit(self.conn, rows)
+            started = time.perf_counter()
+            self.conn.commit()
+            commit_seconds = time.perf_counter() - started
+            for _, _, _, kind in changed:
+                self.stats[kind] += 1
+            return commit_seconds, rows
+        except sqlite3.Error as e:
+            # 批内有坏行时回退为逐行写入，跳过坏行
+            self.conn.rollback()
+            print(f"  ⚠️  批量写入 {self.table} 失败，改为逐行写入: {e}")
+
+        for key, row, digest, kind in changed:
+            try:
+                self.conn.execute(self.sql, row)
+                self.conn.execute(hash_sql, (self.table, key, digest))
+                self.stats[kind] += 1
+            except sqlite3.Error as e:
+                print(f"  ⚠️  处理行失败: {e}")
+                rows -= 1
+                if self.metrics is not None:
+                    self.metrics.count('errors')
+        self._derive([row for _, row, _, _ in changed])
+        if self.on_commit is not None:
+            self.on_commit(self.conn, rows)
+        started = time.perf_counter()
+        self.conn.commit()
+        return time.perf_counter() - started, rows
+
+    def _derive(self, rows: list):
+        """在当前事务里重算变化行的派生列"""
+        if not self.derive_sql:
+            return
+        keys = [tuple(row[i] for i in self.key_index) for row in rows]
+        try:
+            for sql in self.derive_sql:
+                self.conn.executemany(sql, keys)
+        except sqlite3.OperationalError as e:
+            # 老库可能还没有派生列，派生失败不影响同步本身
+            print(f"  ⚠️  {self.table} 派生列重算失败，本次不再重算: {e}")
+            self.derive_sql = []
+
+    def result(self) -> dict:
+        """写入统计；missing 仅在 track_missing 时给出"""
+        stats = dict(self.stats)
+        if self.track_missing and self.known_before is not None:
+            seen = stats['updated'] + stats['unchanged']
+            stats['missing'] = max(self.known_before - seen, 0)
+        return stats
+
+    def summary(self) -> str:
+        stats = self.result()
+        text = f"新增 {stats['inserted']} / 更新 {stats['updated']} / 未变 {stats['unchanged']}"
+        if 'missing' in stats:
+            text += f" / 缺失 {stats['missing']}"
+        return text
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+def tune_for_bulk_load(conn):
+    """批量装载用的连接设置
+
+    WAL：写事务进行中读者继续读提交前的快照，不会被合并阻塞，也看不到半截数据；
+    synchronous=NORMAL：WAL 下只在检查点 fsync，断电最多丢最后一个事务，不会损坏库。
+    """
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-65536')  # 64MB 页缓存
+
+
+class StagingWriter(BatchWriter):
+    """批量装载模式：先写临时暂存表，结束时一次性合并进目标表
+
+    暂存表在 temp 库里，装载过程中不持有主库写锁；close() 时在一个 IMMEDIATE 事务里：
+    按内容哈希分出新增/更新/未变 -> INSERT ... SELECT ... ON CONFLICT DO UPDATE 合并变化行 ->
+    重算派生列 -> delete_missing 时集合式删除本次快照里已消失的行（仅限同步写入过的行）。
+    拉取中途出错时丢弃暂存数据，目标表保持原样。
+    """
+
+    def __init__(self, table: str, batch_size: int = DEFAULT_BATCH_SIZE, lock=None,
+                 track_missing: bool = False, metrics=None, delete_missing: bool = None, db_path: str = None):
+        super().__init__(table, batch_size, lock, track_missing, metrics, db_path)
+        # 只有完整快照（无过滤的全量拉取）才能据此判断哪些行已被删除
+        self.delete_missing = track_missing if delete_missing is None else delete_missing
+        self.stage = f"stage_{table}"
+        self.stats['deleted'] = 0
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = connect(self.db_path)
+            tune_for_bulk_load(self.conn)
+            _ensure_hash_table(self.conn)
+            _ensure_target_table(self.conn, self.table)
+            _, columns = TABLE_SCHEMAS[self.table]
+            self.conn.execute(f'DROP TABLE IF EXISTS temp.{self.stage}')
+            self.conn.execute(
+                f"CREATE TEMP TABLE {self.stage} ({', '.join(columns)}, row_key, content_hash, change)"
+            )
+            self.conn.commit()
+        return self.conn
+
+    def flush(self) -> int:
+        """把当前批次写进暂存表（只写 temp 库，不需要 db_lock）"""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        started = time.perf_counter()
+        self._connect()
+        placeholders = ', '.join('?' * (len(batch[0]) + 2))
+        self.conn.executemany(
+            f"INSERT INTO temp.{self.stage} VALUES ({placeholders}, NULL)",
+            [(*row, self._row_key(row), content_hash(row[i] for i in self.hash_index)) for row in batch],
+        )
+        self.conn.commit()
+        if self.metrics is not None:
+            self.metrics.add('write', time.perf_counter() - started)
+        self.written += len(batch)
+        return len(batch)
+
+    def _row_key_sql(self, alias: str) -> str:
+        """与 _row_key 一致的 SQL 表达式"""
+        key_columns, _ = TABLE_SCHEMAS[self.table]
+        return " || char(31) || ".join(f"CAST({alias}.{col} AS TEXT)" for col in key_columns)
+
+    def merge(self):
+        """把暂存表合并进目标表（一个事务）"""
+        self._connect()
+        key_columns, columns = TABLE_SCHEMAS[self.table]
+        stage = f"temp.{self.stage}"
+        keys = ', '.join(key_columns)
+        key_tuple = keys if len(key_columns) == 1 else f"({keys})"
+        updates = ', '.join(f"{col} = excluded.{col}" for col in columns if col not in key_columns)
+
+        started = time.perf_counter()
+        conn = self.conn
+        conn.execute(f"CREATE INDEX IF NOT EXISTS temp.{self.stage}_key ON {self.stage} (row_key)")
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 同一主键以后到的行为准
+            conn.execute(
+                f"DELETE FROM {stage} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {stage} GROUP BY row_key)"
+            )
+            conn.execute(f'''
+                UPDATE {stage} SET change = COALESCE((
+                    SELECT CASE WHEN h.content_hash = {stage}.content_hash THEN 'unchanged' ELSE 'updated' END
+                    FROM sync_row_hash h WHERE h.table_name = ? AND h.row_key = {stage}.row_key
+                ), 'inserted')
+            ''', (self.table,))
+            # 去重后才是实际合并的行数
+            self.written = 0
+            for change, count in conn.execute(f"SELECT change, COUNT(*) FROM {stage} GROUP BY change"):
+                self.stats[change] += count
+                self.written += count
+
+            # WHERE 不能省：否则 ON CONFLICT 会被解析成 JOIN 的一部分
+            conn.execute(f'''
+                INSERT INTO main.{self.table} ({', '.join(columns)})
+                SELECT {', '.join(columns)} FROM {stage} WHERE change != 'unchanged'
+                ON CONFLICT({keys}) DO UPDATE SET {updates}
+            ''')
+            conn.execute(f'''
+                INSERT INTO sync_row_hash (table_name, row_key, content_hash)
+                SELECT ?, row_key, content_hash FROM {stage} WHERE change != 'unchanged'
+                ON CONFLICT(table_name, row_key) DO UPDATE SET content_hash = excluded.content_hash
+            ''', (self.table,))
+
+            changed_keys = f"SELECT {keys} FROM {stage} WHERE change != 'unchanged'"
+            try:
+                for assignments, condition, _ in DERIVED_COLUMNS.get(self.table, ()):
+                    where = f"{key_tuple} IN ({changed_keys})"
+                    if condition:
+                        where += f" AND ({condition})"
+                    conn.execute(f"UPDATE main.{self.table} SET {assignments} WHERE {where}")
+            except sqlite3.OperationalError as e:
+                print(f"  ⚠️  {self.table} 派生列重算失败: {e}")
+
+            if self.delete_missing and not self.written:
+                print(f"  ⚠️  {self.table} 本次快照为空，跳过删除")
+            elif self.delete_missing:
+                gone = f'''
+                    SELECT h.row_key FROM sync_row_hash h
+                    WHERE h.table_name = ? AND NOT EXISTS (SELECT 1 FROM {stage} s WHERE s.row_key = h.row_key)
+                '''
+                cursor = conn.execute(
+                    f"DELETE FROM main.{self.table} AS t WHERE {self._row_key_sql('t')} IN ({gone})",
+                    (self.table,),
+                )
+                self.stats['deleted'] = max(cursor.rowcount, 0)
+                conn.execute(f'''
+                    DELETE FROM sync_row_hash WHERE table_name = ?
+                    AND NOT EXISTS (SELECT 1 FROM {stage} s WHERE s.row_key = sync_row_hash.row_key)
+                ''', (self.table,))
+
+            merged = time.perf_counter()
+            conn.commit()
+            if self.metrics is not None:
+                self.metrics.add('write', merged - started)
+                self.metrics.add('commit', time.perf_counter() - merged)
+        except Exception:
+            conn.rollback()
+            raise
+
+    def result(self) -> dict:
+        stats = dict(self.stats)
+        if not self.delete_missing:
+            stats.pop('deleted')
+        return stats
+
+    def summary(self) -> str:
+        stats = self.result()
+        text = f"新增 {stats['inserted']} / 更新 {stats['updated']} / 未变 {stats['unchanged']}"
+        if 'deleted' in stats:
+            text += f" / 删除 {stats['deleted']}"
+        return text
+
+    def close(self):
+        try:
+            self.flush()
+            if self.lock is not None:
+                with self.lock:
+                    self.merge()
+            else:
+                self.merge()
+        finally:
+            self.discard()
+
+    def discard(self):
+        """丢弃暂存数据并关闭连接"""
+        self.pending = []
+        if self.conn is not None:
+            try:
+                self.conn.execute(f'DROP TABLE IF EXISTS temp.{self.stage}')
+            finally:
+                self.conn.close()
+                self.conn = None
+
+
+def sorted_key_diff(source, target) -> tuple:
+    """两组升序且无重复的主键归并比对，返回 (只在 source 中的键, 只在 target 中的键)"""
+    added, removed = [], []
+    source, target = iter(source), iter(target)
+    s, t = next(source, None), next(target, None)
+    while s is not None and t is not None:
+        if s == t:
+            s, t = next(source, None), next(target, None)
+        elif s < t:
+            added.append(s)
+            s = next(source, None)
+        else:
+            removed.append(t)
+            t = next(target, None)
+    while s is not None:
+        added.append(s)
+        s = next(source, None)
+    while t is not None:
+        removed.append(t)
+        t = next(target, None)
+    return added, removed
+
+
+def delete_missing_lines(table: str, group_column: str, source_keys, lock=None, metrics=None,
+                         db_path: str = None) -> int:
+    """按单据删除本地多出的分录，返回删除行数
+
+    source_keys 是本次从金蝶拿到的主键（每张出现过的单据都是全部分录）；
+    只比对这些单据在本地的主键，排序后归并，本地有而金蝶没有的行连同其内容哈希一并删除。
+    """
+    source = sorted(set(source_keys))
+    if not source:
+        return 0
+
+    def apply():
+        started = time.perf_counter()
+        conn = connect(db_path)
+        try:
+            _ensure_hash_table(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            removed = delete_missing_lines_in(conn, table, group_column, source)
+            conn.commit()
+            if metrics is not None:
+                metrics.add('write', time.perf_counter() - started)
+            return removed
+        finally:
+            conn.close()
+
+    if lock is not None:
+        with lock:
+            return apply()
+    return apply()
+
+
+def delete_missing_lines_in(conn, table: str, group_column: str, source_keys) -> int:
+    """delete_missing_lines 的核心：在调用方已开启的事务里比对并删除，不提交"""
+    key_columns, _ = TABLE_SCHEMAS[table]
+    group_index = key_columns.index(group_column)
+    source = sorted(set(source_keys))
+    groups = sorted({key[group_index] for key in source})
+    local = []
+    for start in range(0, len(groups), HASH_LOOKUP_CHUNK):
+        chunk = groups[start:start + HASH_LOOKUP_CHUNK]
+        local.extend(conn.execute(
+            f"SELECT {', '.join(key_columns)} FROM {table} "
+            f"WHERE {group_column} IN ({', '.join('?' * len(chunk))})",
+            chunk,
+        ).fetchall())
+    local.sort()
+    _, removed = sorted_key_diff(source, local)
+    _delete_rows(conn, table, removed)
+    return len(removed)
+
+
+def delete_missing_rows(table: str, source_keys, lock=None, metrics=None, db_path: str = None) -> int:
+    """全量快照同步后删除本次没有出现的行（连同内容哈希），返回删除行数
+
+    source_keys 须是一次完整快照的全部主键；为空时视为快照异常，不删除任何行。
+    """
+    source = sorted(set(source_keys))
+    if not source:
+        print(f"  ⚠️  {table} 本次快照为空，跳过删除")
+        return 0
+    key_columns, _ = TABLE_SCHEMAS[table]
+
+    def apply():
+        started = time.perf_counter()
+        conn = connect(db_path)
+        try:
+            _ensure_hash_table(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            local = sorted(conn.execute(f"SELECT {', '.join(key_columns)} FROM {table}").fetchall())
+            _, removed = sorted_key_diff(source, local)
+            _delete_rows(conn, table, removed)
+            conn.commit()
+            if metrics is not None:
+                metrics.add('write', time.perf_counter() - started)
+            return len(removed)
+        finally:
+            conn.close()
+
+    if lock is not None:
+        with lock:
+            return apply()
+    return apply()
+
+
+def _delete_rows(conn, table: str, keys: list):
+    """按主键删除目标表的行和对应的内容哈希（在调用方的事务里）"""
+    if not keys:
+        return
+    key_columns, _ = TABLE_SCHEMAS[table]
+    key_match = ' AND '.join(f"{col} = ?" for col in key_columns)
+    conn.executemany(f"DELETE FROM {table} WHERE {key_match}", keys)
+    conn.executemany(
+        'DELETE FROM sync_row_hash WHERE table_name = ? AND row_key = ?',
+        [(table, '\x1f'.join(str(value) for value in key)) for key in keys]
+    )
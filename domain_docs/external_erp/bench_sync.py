@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+同步吞吐压测：本地金蝶替身 + 临时 SQLite 库，端到端跑 KingdeeSync / KingdeeEnhancedSync
+
+每个实体报告：行数、行/秒、页延迟 p50/p99（请求发出到收到响应头）、峰值内存（tracemalloc）。
+替身在独立进程里运行，不和同步代码争 GIL。
+
+使用方法:
+python bench_sync.py                                  # 每个表单 10000 行
+python bench_sync.py --rows 50000 --latency 0.05 --fan-out 4
+python bench_sync.py --output baseline.json           # 保存结果作为基线
+python bench_sync.py --compare baseline.json          # 行/秒比基线下降超过 --tolerance 时退出码为 1
+
+注意：压测只写临时库（路径显式传给客户端，见 sync_state.connect），不会写入真实数据库；
+临时库的表结构取自默认库（sync_state.prepare_database）。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from batch_writer import DEFAULT_BATCH_SIZE
+from fake_kingdee import add_server_arguments, server_from_args
+from sync_state import prepare_database
+
+
+def _serve(args, ready):
+    server = server_from_args(args)
+    ready.put(server.url)
+    server.serve_forever()
+
+
+def start_server(args):
+    """在子进程里启动替身，返回 (进程, URL)"""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(args, ready), name='fake-kingdee', daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def track_page_latency(session, latencies: dict):
+    """requests 响应钩子：按 FormId 记录每次查询的耗时"""
+    from kingdee_api import QUERY_PATH
+
+    def hook(response, *args, **kwargs):
+        if not response.url.endswith(QUERY_PATH):
+            return
+        body = response.request.body or b'{}'
+        try:
+            form_id = json.loads(body)['data']['FormId']
+        except (ValueError, KeyError, TypeError):
+            return
+        latencies[form_id].append(response.elapsed.total_seconds())
+
+    session.hooks['response'].append(hook)
+
+
+def run_benchmark(args, url: str, db_path: str) -> list:
+    from entity_specs import ENTITY_SPECS
+    from sync_kingdee import KingdeeSync
+    from sync_kingdee_enhanced import KingdeeEnhancedSync
+
+    latencies = defaultdict(list)
+    syncer = KingdeeSync(fan_out=args.fan_out, full=True, batch_size=args.batch_size, db_path=db_path)
+    enhanced = KingdeeEnhancedSync(full=True, batch_size=args.batch_size, db_path=db_path)
+    tasks = [
+        ('materials', syncer.sync_materials),
+        ('customers', syncer.sync_customers),
+        ('manufacturing_orders', syncer.sync_manufacturing_orders),
+        ('inventory', syncer.sync_inventory),
+        ('purchase_orders', syncer.sync_purchase_orders),
+        ('bom', syncer.sync_bom),
+    ]
+    if not args.skip_enhanced:
+        tasks += [
+            ('sales_orders_enhanced', enhanced.sync_sales_orders_enhanced),
+            ('suppliers_enhanced', enhanced.sync_suppliers_enhanced),
+            ('workcenters_enhanced', enhanced.sync_workcenters_enhanced),
+        ]
+    if args.entity:
+        tasks = [task for task in tasks if task[0] in args.entity]
+
+    for client in (syncer, enhanced):
+        client.base_url = url
+        client._mount_adapter(args.fan_out)
+        track_page_latency(client.session, latencies)
+        if not client.login():
+            raise RuntimeError(f"无法登录金蝶替身: {url}")
+
+    results = []
+    for name, func in tasks:
+        form_id = ENTITY_SPECS[name].form_id
+        latencies[form_id].clear()
+        if args.memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        count = func()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if args.memory else 0
+        if args.memory:
+            tracemalloc.stop()
+
+        pages = latencies[form_id]
+        results.append({
+            'entity': name,
+            'rows': count,
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(count / elapsed, 1) if elapsed > 0 else 0.0,
+            'pages': len(pages),
+            'p50_ms': round(percentile(pages, 50) * 1000, 1),
+            'p99_ms': round(percentile(pages, 99) * 1000, 1),
+            'peak_mb': round(peak / (1024 * 1024), 2),
+        })
+    return results
+
+
+def print_report(results: list):
+    print("\n" + "=" * 78)
+    print(f"{'实体':<24}{'行数':>8}{'行/秒':>11}{'页数':>6}{'p50 ms':>9}{'p99 ms':>9}{'峰值 MB':>9}")
+    print("-" * 78)
+    for r in results:
+        print(f"{r['entity']:<24}{r['rows']:>8}{r['rows_per_sec']:>11.1f}{r['pages']:>6}"
+              f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['peak_mb']:>9.2f}")
+    print("=" * 78)
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> bool:
+    """与基线对比行/秒，返回是否全部在容差内"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {r['entity']: r for r in json.load(f)['results']}
+
+    ok = True
+    print(f"\n📈 与基线对比（容差 {tolerance:.0%}）: {baseline_path}")
+    for r in results:
+        base = baseline.get(r['entity'])
+        if not base or not base['rows_per_sec']:
+            continue
+        change = r['rows_per_sec'] / base['rows_per_sec'] - 1
+        regressed = change < -tolerance
+        ok = ok and not regressed
+        mark = '❌' if regressed else '✅'
+        print(f"   {mark} {r['entity']:<24} {base['rows_per_sec']:>10.1f} -> {r['rows_per_sec']:>10.1f} 行/秒 ({change:+.1%})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='金蝶同步吞吐压测')
+    add_server_arguments(parser)
+    parser.add_argument('--fan-out', type=int, default=1, metavar='N', help='单个表单并发拉取的页数')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, metavar='N', help='每批写入行数')
+    parser.add_argument('--entity', action='append', metavar='NAME', help='只压测指定实体，可重复')
+    parser.add_argument('--skip-enhanced', action='store_true', help='不跑增强同步的实体')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='不统计峰值内存（tracemalloc 会拖慢吞吐）')
+    parser.add_argument('--output', metavar='FILE', help='把结果写成 JSON')
+    parser.add_argument('--compare', metavar='FILE', help='与基线 JSON 对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的行/秒下降比例（默认 0.2）')
+    args = parser.parse_args()
+
+    process, url = start_server(args)
+    print(f"🧪 金蝶替身: {url}")
+    try:
+        with tempfile.TemporaryDirectory(prefix='kingdee-bench-') as tmp:
+            results = run_benchmark(args, url, prepare_database(os.path.join(tmp, 'bench.db')))
+    finally:
+        process.terminate()
+        process.join()
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已写入 {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
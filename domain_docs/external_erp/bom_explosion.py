@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+多层 BOM 展开表（由 bom 单层边物化而来）
+
+- bom_explosion(root_id, component_id, qty, depth)：root 每 1 个单位需要的 component 总量
+  （沿所有路径的用量乘积之和），depth 为 component 在 root 下出现的最深层级（同 MRP 低层码）
+- bom_explosion_edge：上次展开时的 bom 快照，用于找出本次变化的边
+- bom_cycle：检测到的循环引用（展开时会断开成环的那条边）
+
+增量维护：与快照比对找出变化（新增/修改/删除）的父项，沿新旧两张图向上找出其全部祖先，
+只重新展开这些根；没有变化时不做任何展开。
+
+使用方法:
+python bom_explosion.py              # 增量刷新
+python bom_explosion.py --rebuild    # 全量重建
+python bom_explosion.py --explain A  # 查看 A 的全部下层物料
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+from sync_state import connect
+
+
+def _ensure_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bom_explosion (
+            root_id TEXT NOT NULL,
+            component_id TEXT NOT NULL,
+            qty REAL NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (root_id, component_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bom_explosion_component ON bom_explosion (component_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bom_explosion_edge (
+            parent_id TEXT NOT NULL,
+            child_id TEXT NOT NULL,
+            qty REAL,
+            PRIMARY KEY (parent_id, child_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bom_cycle (
+            parent_id TEXT NOT NULL,
+            child_id TEXT NOT NULL,
+            path TEXT NOT NULL,
+            detected_at TIMESTAMP,
+            PRIMARY KEY (parent_id, child_id)
+        )
+    ''')
+
+
+def _load_graph(conn, table: str) -> dict:
+    """parent -> [(child, qty)]，子项按编号排序保证结果确定"""
+    graph = defaultdict(list)
+    for parent_id, child_id, qty in conn.execute(f'SELECT parent_id, child_id, qty FROM {table}'):
+        graph[parent_id].append((child_id, qty if qty is not None else 1.0))
+    for children in graph.values():
+        children.sort()
+    return graph
+
+
+def find_cycle_edges(graph: dict) -> dict:
+    """深度优先找回边，返回 {(parent, child): 环路径}；去掉这些边后图无环"""
+    WHITE, GREY, BLACK = 0, 1, 2
+    color = defaultdict(int)
+    back_edges = {}
+
+    for start in sorted(graph):
+        if color[start] != WHITE:
+            continue
+        path = [start]
+        stack = [iter(graph.get(start, ()))]
+        color[start] = GREY
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                color[path.pop()] = BLACK
+                continue
+            child_id = child[0]
+            if color[child_id] == GREY:
+                cycle = path[path.index(child_id):] + [child_id]
+                back_edges[(path[-1], child_id)] = ' -> '.join(cycle)
+            elif color[child_id] == WHITE:
+                color[child_id] = GREY
+                path.append(child_id)
+                stack.append(iter(graph.get(child_id, ())))
+    return back_edges
+
+
+class _Exploder:
+    """在去掉回边的图上做带记忆的展开：explode(x) = {component: (qty, depth)}
+
+    用显式栈代替递归，BOM 层级再深也不会超出 Python 的递归上限。
+    """
+
+    def __init__(self, graph: dict, cut_edges):
+        self.graph = graph
+        self.cut = set(cut_edges)
+        self.memo = {}
+
+    def _frame(self, node: str) -> list:
+        """栈帧 [节点, 子项, 下一个要累加的子项下标, 部分结果]"""
+        children = [(child_id, qty) for child_id, qty in self.graph.get(node, ()) if (node, child_id) not in self.cut]
+        return [node, children, 0, {}]
+
+    def explode(self, node: str) -> dict:
+        result = self.memo.get(node)
+        if result is not None:
+            return result
+        stack = [self._frame(node)]
+        while stack:
+            frame = stack[-1]
+            current, children, index, result = frame
+            while index < len(children):
+                child_id, qty = children[index]
+                sub = self.memo.get(child_id)
+                if sub is None:
+                    break
+                self._add(result, child_id, qty, 1)
+                for component_id, (sub_qty, depth) in sub.items():
+                    self._add(result, component_id, qty * sub_qty, depth + 1)
+                index += 1
+            frame[2] = index
+            if index < len(children):
+                # 子项还没展开：先压栈展开它，回来后从同一个子项继续
+                stack.append(self._frame(children[index][0]))
+                continue
+            self.memo[current] = result
+            stack.pop()
+        return self.memo[node]
+
+    @staticmethod
+    def _add(result: dict, component_id: str, qty: float, depth: int):
+        previous = result.get(component_id)
+        if previous is None:
+            result[component_id] = (qty, depth)
+        else:
+            result[component_id] = (previous[0] + qty, max(previous[1], depth))
+
+
+def _ancestors(nodes, *graphs) -> set:
+    """nodes 及其在任一张图里的全部上层物料"""
+    parents_of = defaultdict(set)
+    for graph in graphs:
+        for parent_id, children in graph.items():
+            for child_id, _ in children:
+                parents_of[child_id].add(parent_id)
+
+    seen = set(nodes)
+    pending = list(nodes)
+    while pending:
+        for parent_id in parents_of.get(pending.pop(), ()):
+            if parent_id not in seen:
+                seen.add(parent_id)
+                pending.append(parent_id)
+    return seen
+
+
+def _changed_parents(conn) -> set:
+    """与上次快照相比，边有新增、修改或删除的父项"""
+    rows = conn.execute('''
+        SELECT parent_id FROM (
+            SELECT parent_id, child_id, qty FROM bom
+            EXCEPT
+            SELECT parent_id, child_id, qty FROM bom_explosion_edge
+        )
+        UNION
+        SELECT parent_id FROM (
+            SELECT parent_id, child_id, qty FROM bom_explosion_edge
+            EXCEPT
+            SELECT parent_id, child_id, qty FROM bom
+        )
+    ''').fetchall()
+    return {row[0] for row in rows}
+
+
+def refresh_bom_explosion(rebuild: bool = False, db_path: Optional[str] = None) -> dict:
+    """刷新多层展开表，返回 {'roots': 重新展开的根数, 'rows': 写入行数, 'cycles': 环数}
+
+    调用方负责串行化写入（同步脚本里在 db_lock 内调用）；db_path 为 None 时用默认库。
+    """
+    conn = connect(db_path)
+    try:
+        _ensure_tables(conn)
+        conn.commit()
+
+        if not rebuild:
+            rebuild = conn.execute('SELECT COUNT(*) FROM bom_explosion_edge').fetchone()[0] == 0
+        changed = None if rebuild else _changed_parents(conn)
+        if changed is not None and not changed:
+            return {'roots': 0, 'rows': 0, 'cycles': 0}
+
+        graph = _load_graph(conn, 'bom')
+        cycles = find_cycle_edges(graph)
+        exploder = _Exploder(graph, cycles)
+
+        if rebuild:
+            roots = set(graph)
+        else:
+            old_graph = _load_graph(conn, 'bom_explosion_edge')
+            roots = _ancestors(changed, graph, old_graph)
+
+        rows = []
+        for root_id in sorted(roots):
+            for component_id, (qty, depth) in exploder.explode(root_id).items():
+                rows.append((root_id, component_id, qty, depth))
+
+        conn.execute('BEGIN IMMEDIATE')
+        if rebuild:
+            conn.execute('DELETE FROM bom_explosion')
+        else:
+            conn.executemany('DELETE FROM bom_explosion WHERE root_id = ?', [(root,) for root in roots])
+        conn.executemany(
+            'INSERT INTO bom_explosion (root_id, component_id, qty, depth) VALUES (?, ?, ?, ?)', rows
+        )
+        conn.execute('DELETE FROM bom_explosion_edge')
+        conn.execute('INSERT INTO bom_explosion_edge (parent_id, child_id, qty) SELECT parent_id, child_id, qty FROM bom')
+        conn.execute('DELETE FROM bom_cycle')
+        now = datetime.now()
+        conn.executemany(
+            'INSERT INTO bom_cycle (parent_id, child_id, path, detected_at) VALUES (?, ?, ?, ?)',
+            [(parent_id, child_id, path, now) for (parent_id, child_id), path in cycles.items()]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    for path in list(cycles.values())[:5]:
+        if len(path) > 200:
+            path = f"{path[:200]} ..."
+        print(f"  ⚠️  BOM 循环引用（已断开）: {path}")
+    if len(cycles) > 5:
+        print(f"  ⚠️  ... 还有 {len(cycles) - 5} 个循环引用")
+    return {'roots': len(roots), 'rows': len(rows), 'cycles': len(cycles)}
+
+
+def component_requirements(material_id: str, qty: float = 1.0, db_path: Optional[str] = None) -> list:
+    """material_id 生产 qty 个时需要的全部下层物料 [(component_id, 需求量, 层级)]"""
+    conn = connect(db_path)
+    try:
+        _ensure_tables(conn)
+        return [
+            (component_id, unit_qty * qty, depth)
+            for component_id, unit_qty, depth in conn.execute(
+                'SELECT component_id, qty, depth FROM bom_explosion WHERE root_id = ? ORDER BY depth, component_id',
+                (material_id,)
+            )
+        ]
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多层 BOM 展开表')
+    parser.add_argument('--rebuild', action='store_true', help='全量重建')
+    parser.add_argument('--explain', metavar='MATERIAL', help='列出某物料的全部下层物料')
+    args = parser.parse_args()
+
+    if args.explain:
+        for component_id, qty, depth in component_requirements(args.explain):
+            print(f"{'  ' * (depth - 1)}{component_id}  x{qty:g}")
+        return
+
+    print("🔧 刷新多层 BOM 展开表...")
+    result = refresh_bom_explosion(rebuild=args.rebuild)
+    print(f"✅ 重新展开 {result['roots']} 个父项，写入 {result['rows']} 行，循环引用 {result['cycles']} 个")
+
+
+if __name__ == '__main__':
+    main()
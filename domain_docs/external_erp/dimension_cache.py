@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+维度名称的本地缓存（物料、客户、供应商的编码 -> 名称）
+
+单据查询不再拉取 FCustId.FName、FMaterialId.FName 这类关联字段（金蝶要在服务端联表，
+同一个名称在响应里重复成千上万次），只取 FNumber，名称在本地按编码解析：
+1. 内存缓存：每个维度一个按最近使用淘汰的有界表（max_entries 条，条目 ttl 秒后过期），
+   物料、客户、供应商同步写入的每一行都会顺手填进去
+2. 本地库：未命中的编码按块查 materials / customers / suppliers 表（由主数据同步维护）
+3. 金蝶：仍未命中的编码按块用 "FNumber IN (...)" 批量查询主数据表单，只取 FNumber、FName
+金蝶也查不到的编码记为空名称（同样 ttl 后过期），写入时取字段默认值。
+
+prefetch() 在解码前按块预读金蝶行，一次解析块内全部未缓存的编码，逐行解码时只查内存；
+预读在拉取线程里进行（金蝶请求都由它发出），解码时不再访问金蝶。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+from sync_state import connect
+
+
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_TTL = 3600
+# 本地库 IN 查询的参数个数（SQLite 单条语句参数上限较低）
+LOCAL_CHUNK = 500
+# 金蝶 FilterString 里一次 IN 的编码个数
+REMOTE_CHUNK = 200
+REMOTE_FIELD_KEYS = "FNumber,FName"
+
+
+class Dimension:
+    """一个维度：金蝶主数据表单，以及本地表的编码列和名称列"""
+
+    __slots__ = ('name', 'form_id', 'table', 'key_column', 'name_column')
+
+    def __init__(self, name: str, form_id: str, table: str, key_column: str, name_column: str):
+        self.name = name
+        self.form_id = form_id
+        self.table = table
+        self.key_column = key_column
+        self.name_column = name_column
+
+
+DIMENSIONS = {dimension.name: dimension for dimension in (
+    Dimension('materials', 'BD_Material', 'materials', 'material_id', 'material_name'),
+    Dimension('customers', 'BD_Customer', 'customers', 'customer_id', 'customer_name'),
+    Dimension('suppliers', 'BD_Supplier', 'suppliers', 'supplier_id', 'supplier_name'),
+)}
+
+
+def _quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class DimensionCache:
+    """按维度分开的有界 LRU，多个同步线程（和两个客户端）共用一个实例
+
+    fetch(form_id, field_keys, filter_string, limit, metrics=None) 为金蝶查询（客户端的 query_entity），
+    metrics 为发起解析的实体的指标（查主数据的请求计入该实体），
+    为 None 时只查本地库；本地库为 db_path 处的库（None 时为 database.get_db 的默认库）。
+    """
+
+    def __init__(self, fetch: Optional[Callable] = None, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttl: int = DEFAULT_TTL, db_path: Optional[str] = None):
+        self.fetch = fetch
+        self.db_path = db_path
+        self.max_entries = max(max_entries, REMOTE_CHUNK)
+        self.ttl = ttl
+        self._entries = {name: OrderedDict() for name in DIMENSIONS}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'local': 0, 'remote': 0, 'remote_queries': 0, 'unresolved': 0, 'evicted': 0}
+
+    def bind(self, fetch: Callable):
+        """客户端登记自己的查询函数（已登记的不覆盖，共用缓存时以第一个客户端为准）"""
+        if self.fetch is None:
+            self.fetch = fetch
+
+    def get(self, dimension: str, key) -> Optional[str]:
+        """缓存的名称（查不到的编码为 ''）；未缓存或已过期返回 None"""
+        entries = self._entries[dimension]
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and entry[1] < time.monotonic():
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, dimension: str, key, name: str):
+        entries = self._entries[dimension]
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            entries[key] = (name or '', expires)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def _count(self, stat: str, n: int):
+        with self._lock:
+            self.stats[stat] += n
+
+    def _load_local(self, dimension: Dimension, keys: list) -> dict:
+        names = {}
+        conn = connect(self.db_path)
+        try:
+            for i in range(0, len(keys), LOCAL_CHUNK):
+                chunk = keys[i:i + LOCAL_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                for key, name in conn.execute(
+                    f"SELECT {dimension.key_column}, {dimension.name_column} FROM {dimension.table} "
+                    f"WHERE {dimension.key_column} IN ({placeholders})", chunk
+                ):
+                    if name:
+                        names[key] = name
+        finally:
+            conn.close()
+        return names
+
+    def _load_remote(self, dimension: Dimension, keys: list, metrics=None) -> dict:
+        names = {}
+        for i in range(0, len(keys), REMOTE_CHUNK):
+            chunk = keys[i:i + REMOTE_CHUNK]
+            filter_string = f"FNumber IN ({','.join(_quote(key) for key in chunk)})"
+            # 多组织下同一编码可能有多行（各使用组织一份），取第一个非空名称
+            for row in self.fetch(dimension.form_id, REMOTE_FIELD_KEYS, filter_string, 0, metrics=metrics):
+                if isinstance(row, list) and len(row) >= 2 and row[1] and row[0] not in names:
+                    names[row[0]] = row[1]
+            self._count('remote_queries', 1)
+        return names
+
+    def resolve(self, dimension: str, keys: Iterable, remote: bool = True, metrics=None) -> dict:
+        """批量解析编码 -> 名称：内存 -> 本地库 -> 金蝶（remote 时），结果（含查不到的空名称）写回内存缓存
+
+        metrics（sync_metrics.EntityMetrics）为发起解析的实体，查金蝶的请求计入它。
+        """
+        names, missing = {}, []
+        for key in keys:
+            name = self.get(dimension, key)
+            if name is None:
+                missing.append(key)
+            else:
+                names[key] = name
+        self._count('hits', len(names))
+        if not missing:
+            return names
+
+        spec = DIMENSIONS[dimension]
+        for source in ('local', 'remote'):
+            if not missing or (source == 'remote' and (not remote or self.fetch is None)):
+                continue
+            if source == 'local':
+                found = self._load_local(spec, missing)
+            else:
+                found = self._load_remote(spec, missing, metrics)
+            self._count(source, len(found))
+            for key, name in found.items():
+                self.put(dimension, key, name)
+                names[key] = name
+            missing = [key for key in missing if key not in found]
+
+        self._count('unresolved', len(missing))
+        for key in missing:
+            self.put(dimension, key, '')
+            names[key] = ''
+        return names
+
+    def converter(self, dimension: str) -> Callable:
+        """解码用的转换函数：(编码, 默认值) -> 名称"""
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"未知维度: {dimension}")
+
+        def convert(value, default):
+            if not value:
+                return default
+            name = self.get(dimension, value)
+            if name is None:
+                # 预读后又被淘汰（在途块的编码数超过缓存上限）时只补查本地库：
+                # 解码在流水线的转换线程里，金蝶请求只能由拉取线程发出
+                name = self.resolve(dimension, (value,), remote=False)[value]
+            return name or default
+
+        return convert
+
+    def prefetch(self, rows: Iterable, lookups, chunk: int, metrics=None):
+        """逐块（chunk 行）预读金蝶行，先批量解析块内未缓存的编码再原样产出
+
+        lookups 为 [(维度, 编码在金蝶行里的下标)]；为空时直接产出 rows。
+        metrics 为当前同步实体的指标，解析名称时查金蝶的请求计入它。
+        """
+        if not lookups:
+            yield from rows
+            return
+        chunk = max(chunk, 1)
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunk:
+                self._resolve_rows(buffer, lookups, metrics)
+                yield from buffer
+                buffer = []
+        if buffer:
+            self._resolve_rows(buffer, lookups, metrics)
+            yield from buffer
+
+    def _resolve_rows(self, rows: list, lookups, metrics=None):
+        for dimension, index in lookups:
+            keys = {row[index] for row in rows if isinstance(row, list) and len(row) > index and row[index]}
+            if keys:
+                self.resolve(dimension, keys, metrics=metrics)
+
+    def filler(self, table: str, column_order) -> Optional[Callable]:
+        """主数据实体的写入回调 fill(values)：把同步到的名称顺手填进缓存；不是维度表时返回 None"""
+        for dimension in DIMENSIONS.values():
+            if dimension.table == table:
+                break
+        else:
+            return None
+        name = dimension.name
+        key_pos = column_order.index(dimension.key_column)
+        name_pos = column_order.index(dimension.name_column)
+
+        def fill(values):
+            self.put(name, values[key_pos], values[name_pos])
+
+        return fill
+
+    def summary(self) -> str:
+        with self._lock:
+            s = dict(self.stats)
+            cached = sum(len(entries) for entries in self._entries.values())
+        text = (f"名称缓存: 命中 {s['hits']}，本地库 {s['local']}，金蝶 {s['remote']}（{s['remote_queries']} 次查询），"
+                f"未找到 {s['unresolved']}；缓存 {cached} 条")
+        if s['evicted']:
+            text += f"，淘汰 {s['evicted']}"
+        return text
+
+
+def add_dimension_arguments(parser):
+    """同步脚本共用的名称缓存参数"""
+    parser.add_argument('--dimension-cache', type=int, default=DEFAULT_MAX_ENTRIES, metavar='N',
+                        help=f'每个维度（物料/客户/供应商）内存缓存的名称条数（默认 {DEFAULT_MAX_ENTRIES}）')
+
+
+def dimension_cache_from_args(args, db_path: Optional[str] = None) -> DimensionCache:
+    return DimensionCache(max_entries=args.dimension_cache, db_path=db_path)
@@ -0,0 +1,564 @@
+# -*- coding: utf-8 -*-
+"""
+同步实体声明表
+
+每个实体一条 EntitySpec：金蝶表单、字段及类型转换、默认值、目标表（主键和列顺序取自
+batch_writer.TABLE_SCHEMAS）、过滤条件和水位。compile_decoder() 把字段声明预编译成
+(下标, 转换函数, 默认值) 元组，热循环里每行只做一次列表推导，不再手写 row[6]、float()。
+
+sync_entity() 是通用的同步流程（增量过滤 -> 分页拉取 -> [预读解析名称] -> 解码 -> [按主键汇总] -> 批量写入（连同断点） -> 分录差集删除 -> 日志和水位，
+拉取、转换、写入三段经有界队列流水执行），
+sync_kingdee / sync_kingdee_enhanced 的 sync_* 方法都只是调用它。新增实体只需在这里加一条声明。
+
+物料、客户、供应商名称用 Lookup 声明：只拉取编码（FNumber），名称由 dimension_cache 在本地解析。
+"""
+
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from batch_writer import (
+    DEFAULT_BATCH_SIZE, TABLE_SCHEMAS, BatchWriter, StagingWriter, delete_missing_lines, delete_missing_lines_in,
+    delete_missing_rows
+)
+from dimension_cache import DIMENSIONS, DimensionCache
+from pipeline import DEFAULT_DEPTH, Pipeline
+from sync_state import (
+    CHECKPOINT_DONE, WATERMARK_ORDER, Checkpoint, delta_filter, load_checkpoint, log_sync_result,
+    save_checkpoint, save_watermark
+)
+
+
+WATERMARK_FIELD = "FModifyDate"
+
+
+# ---- 转换函数：(原始值, 默认值) -> 写入值 ----
+
+def text(value, default):
+    return value or default
+
+
+def number(value, default):
+    return float(value) if value else default
+
+
+def integer(value, default):
+    return int(value) if value not in (None, '') else default
+
+
+def flag(value, default):
+    return 1 if value else 0
+
+
+def constant(value, default):
+    return default
+
+
+def now(value, default):
+    return datetime.now()
+
+
+def mapped(mapping: dict) -> Callable:
+    """按字典映射（如单据状态 A/B/C），未知值取默认值"""
+    def convert(value, default):
+        return mapping.get(value, default)
+    return convert
+
+
+class Field:
+    """一个写入列：key 为金蝶字段（None 表示不取金蝶值，只用 convert/default 生成）"""
+
+    __slots__ = ('key', 'convert', 'default')
+
+    def __init__(self, key: Optional[str] = None, convert: Callable = text, default=''):
+        self.key = key
+        self.convert = convert if key is not None or convert is not text else constant
+        self.default = default
+
+
+class Lookup(Field):
+    """名称列：key 为同一行的编码字段（如 FCustId.FNumber），名称按 dimension 查本地维度缓存，
+    不再让金蝶联表返回 FCustId.FName"""
+
+    __slots__ = ('dimension',)
+
+    def __init__(self, key: str, dimension: str, default=''):
+        super().__init__(key, text, default)
+        self.dimension = dimension
+
+
+class EntitySpec:
+    """一个同步实体的声明"""
+
+    def __init__(self, name: str, form_id: str, table: str, columns: dict, label: str, icon: str = '📦',
+                 recent_days: Optional[int] = None, watermark: bool = True, page_size: int = 500,
+                 group_key: Optional[str] = None, alternate_forms: tuple = (), sum_columns: tuple = (),
+                 breakdowns: Optional[dict] = None, delete_missing: bool = False):
+        self.name = name                # 日志和水位用的实体名
+        self.form_id = form_id          # 金蝶表单 ID（元数据校验后可能换成备选表单）
+        self.form_candidates = (form_id,) + tuple(alternate_forms)
+        self.table = table              # 目标表
+        self.columns = columns          # 列名 -> Field
+        self.label = label
+        self.icon = icon
+        self.recent_days = recent_days  # 只取最近 N 天（FDate）的单据
+        self.watermark = watermark      # 是否按 FModifyDate 增量同步
+        self.page_size = page_size
+        # 单据分录类实体的单号列：金蝶返回某张单据时总是带全部分录，
+        # 同步后删除这些单据在本地多出的分录（主键须是 单号 + 分录内码 这样稳定的键）
+        self.group_key = group_key
+        # 没有稳定单据分组的实体（如 BOM 边）：只在全量快照（无水位、从头拉取）后删除本次没有出现的行
+        self.delete_missing = delete_missing
+        # 汇总实体：金蝶一行是主键的一部分（如库存按仓库/仓位/批次各一行），
+        # 拉完后按主键把 sum_columns 相加，每个主键只写一行
+        self.sum_columns = tuple(sum_columns)
+        # 可选的明细汇总表：表名 -> {附加分组列: Field}，按 主键 + 附加列 汇总 sum_columns
+        self.breakdowns = breakdowns or {}
+
+        self.key_columns, self.column_order = TABLE_SCHEMAS[table]
+        missing = [col for col in self.column_order if col not in columns]
+        unknown = [col for col in columns if col not in self.column_order]
+        if missing or unknown:
+            raise ValueError(f"{name}: 列与 {table} 表结构不一致（缺少 {missing}，多出 {unknown}）")
+        if group_key is not None and group_key not in self.key_columns:
+            raise ValueError(f"{name}: group_key {group_key} 不是 {table} 的主键列")
+        if group_key is not None and delete_missing:
+            raise ValueError(f"{name}: group_key 与 delete_missing 只能声明一个")
+        if self.sum_columns and watermark:
+            raise ValueError(f"{name}: 汇总实体须全量拉取（watermark=False），增量结果无法求和")
+        unsummable = [col for col in self.sum_columns if col not in self.column_order or col in self.key_columns]
+        if unsummable:
+            raise ValueError(f"{name}: sum_columns {unsummable} 不是 {table} 的非主键列")
+        unknown = [f.dimension for f in columns.values() if isinstance(f, Lookup) and f.dimension not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"{name}: Lookup 列的维度 {unknown} 不在 dimension_cache.DIMENSIONS 中")
+        for breakdown_table, extra in self.breakdowns.items():
+            expected = (self.key_columns + tuple(extra), self.key_columns + tuple(extra) + self.sum_columns)
+            if not self.sum_columns or TABLE_SCHEMAS.get(breakdown_table) != expected:
+                raise ValueError(f"{name}: 明细表 {breakdown_table} 的结构应为 {expected}")
+
+        keys = []
+        for col in self.column_order:
+            key = columns[col].key
+            if key is not None and key not in keys:
+                keys.append(key)
+        # 明细列总是一并拉取（只多一列），是否写明细表由调用方决定
+        for extra in self.breakdowns.values():
+            for field in extra.values():
+                if field.key is not None and field.key not in keys:
+                    keys.append(field.key)
+        if watermark:
+            keys.append(WATERMARK_FIELD)
+        self.field_keys_list = keys
+
+    @property
+    def lookups(self) -> list:
+        """[(维度, 编码在金蝶行里的下标)]，去重"""
+        pairs = []
+        for field in self.columns.values():
+            if isinstance(field, Lookup):
+                pair = (field.dimension, self.field_keys_list.index(field.key))
+                if pair not in pairs:
+                    pairs.append(pair)
+        return pairs
+
+    @property
+    def field_keys(self) -> str:
+        return ",".join(self.field_keys_list)
+
+    def base_filter(self) -> str:
+        if not self.recent_days:
+            return ""
+        since = (datetime.now() - timedelta(days=self.recent_days)).strftime('%Y-%m-%d')
+        return f"FDate >= '{since}'"
+
+
+def compile_decoder(spec: EntitySpec, lookups: Optional[DimensionCache] = None) -> Callable:
+    """金蝶行（字段值数组）-> 按表列顺序的写入元组；形状不对、转换失败或主键为空时返回 None
+
+    Lookup 列按 lookups（dimension_cache.DimensionCache）把编码转换为名称。
+    """
+    index = {key: i for i, key in enumerate(spec.field_keys_list)}
+    plan = []
+    for field in (spec.columns[col] for col in spec.column_order):
+        convert = field.convert
+        if isinstance(field, Lookup):
+            if lookups is None:
+                raise ValueError(f"{spec.name}: 有名称列需要维度缓存")
+            convert = lookups.converter(field.dimension)
+        plan.append((index[field.key] if field.key is not None else 0, convert, field.default))
+    plan = tuple(plan)
+    key_positions = tuple(spec.column_order.index(col) for col in spec.key_columns)
+    width = len(spec.field_keys_list)
+
+    def decode(row):
+        if not isinstance(row, list) or len(row) < width:
+            return None
+        try:
+            values = tuple([convert(row[i], default) for i, convert, default in plan])
+        except (TypeError, ValueError):
+            return None
+        for pos in key_positions:
+            if values[pos] in (None, ''):
+                return None
+        return values
+
+    return decode
+
+
+class Aggregator:
+    """按主键累加 sum_columns（其余列取该主键第一行的值），可选同时按明细表的分组累加
+
+    整个结果集都在内存里，只用于库存这类主键数远小于行数的实体。
+    """
+
+    def __init__(self, spec: EntitySpec, breakdowns: bool = False):
+        self.key_positions = tuple(spec.column_order.index(col) for col in spec.key_columns)
+        self.sum_positions = tuple(spec.column_order.index(col) for col in spec.sum_columns)
+        self.totals = {}
+        self.lines = 0
+        self.details = {}
+        index = {key: i for i, key in enumerate(spec.field_keys_list)}
+        for table, extra in (spec.breakdowns.items() if breakdowns else ()):
+            plan = tuple((index[f.key] if f.key is not None else 0, f.convert, f.default) for f in extra.values())
+            self.details[table] = (plan, {})
+
+    def __len__(self) -> int:
+        return len(self.totals)
+
+    def add(self, values: tuple, row: list):
+        self.lines += 1
+        key = tuple([values[pos] for pos in self.key_positions])
+        current = self.totals.get(key)
+        if current is None:
+            self.totals[key] = list(values)
+        else:
+            for pos in self.sum_positions:
+                current[pos] += values[pos]
+        for plan, totals in self.details.values():
+            try:
+                detail_key = key + tuple([convert(row[i], default) for i, convert, default in plan])
+            except (TypeError, ValueError):
+                continue
+            sums = totals.get(detail_key)
+            if sums is None:
+                totals[detail_key] = [values[pos] for pos in self.sum_positions]
+            else:
+                for n, pos in enumerate(self.sum_positions):
+                    sums[n] += values[pos]
+
+    def rows(self):
+        return (tuple(values) for values in self.totals.values())
+
+    def detail_rows(self) -> dict:
+        """明细表名 -> [主键 + 附加列 + 汇总列]"""
+        return {table: [key + tuple(sums) for key, sums in totals.items()]
+                for table, (_, totals) in self.details.items()}
+
+
+def sync_entity(spec: EntitySpec, iter_rows: Callable, lock, full: bool = False,
+                batch_size: int = DEFAULT_BATCH_SIZE, page_size: Optional[int] = None,
+                transform: Optional[Callable] = None, metrics=None, bulk_load: bool = False, sink=None,
+                breakdowns: bool = False, run_id: Optional[str] = None, resume: bool = False,
+                lookups: Optional[DimensionCache] = None, pipeline_depth: int = DEFAULT_DEPTH,
+                db_path: Optional[str] = None) -> int:
+    """按声明同步一个实体，返回写入条数
+
+    iter_rows(form_id, field_keys, filter_string, page_size, order_string, start_row) 逐行产出金蝶数据；
+    transform(values) 可在写入前改写解码结果（如按单据补行号）；
+    metrics（sync_metrics.EntityMetrics）累计 transform 耗时，并随日志明细一起落库；
+    bulk_load 时先写暂存表再一次性合并（StagingWriter），全量快照下同时删除已消失的行；
+    声明了 group_key 的实体，按单据比对金蝶与本地的主键集合，删除金蝶已删掉的分录；
+    声明了 delete_missing 的实体，全量快照（无水位过滤、从头拉取）成功后删除本次没有出现的行；
+    sink（mes_sink.MesSink）同时把每行推送给 MES，全部推送成功后才推进水位；
+    声明了 sum_columns 的实体先在内存里按主键汇总全部分页，再一次写入（每个主键一行），
+    breakdowns 时同时写声明的明细汇总表（如按仓库的库存）；
+    给了 run_id 时每批数据和断点（sync_state.Checkpoint）在同一个事务里提交，
+    resume 时该运行里已完成的实体直接跳过，中断的实体沿用原过滤条件从断点继续。
+    汇总、批量装载和推送 MES 的实体只能整体重做（已提交的部分不可续），断点只记过滤条件和完成状态。
+    lookups（dimension_cache.DimensionCache）按块预读解析 Lookup 列的名称（未给时只查本地库），
+    物料、客户、供应商实体写入的名称同时填进该缓存。
+    拉取（含名称预读）、解码转换、写入分三个线程流水执行（pipeline.Pipeline，每段最多 pipeline_depth 块在途），
+    写入和断点始终在调用线程；pipeline_depth 为 0 时三段在调用线程里依次执行。
+    数据、水位、断点和日志都写 db_path 处的本地库（None 时为 database.get_db 的默认库）。
+    """
+    print(f"\n{spec.icon} 开始同步{spec.label}...")
+
+    aggregator = Aggregator(spec, breakdowns) if spec.sum_columns else None
+    push = sink.writer(spec) if sink is not None else None
+    resumable = aggregator is None and not bulk_load and push is None
+    page_size = page_size or spec.page_size
+
+    previous = load_checkpoint(spec.name, db_path) if run_id and resume else None
+    if previous is not None and previous.run_id != run_id:
+        previous = None
+    if previous is not None and previous.done:
+        if push is not None:
+            sink.discard(spec)
+        print(f"⏭️  {spec.label}在运行 {run_id} 中已完成（{previous.row_count} 条），跳过")
+        return previous.row_count
+
+    if previous is not None:
+        # 沿用中断时的查询条件；不可续的实体从头重做
+        filter_string, order_string = previous.filter_string, previous.order_string
+        if not resumable:
+            previous = None
+    elif spec.watermark:
+        filter_string, order_string = delta_filter(spec.name, spec.base_filter(), full, db_path), WATERMARK_ORDER
+    else:
+        filter_string, order_string = spec.base_filter(), ""
+    watermark_index = len(spec.field_keys_list) - 1 if spec.watermark else None
+
+    checkpoint = None
+    if run_id:
+        checkpoint = previous or Checkpoint(spec.name, run_id, filter_string, order_string, page_size)
+        if previous is not None:
+            print(f"  ⏯️  从断点继续: StartRow={previous.start_row}（第 {previous.page + 1} 页），"
+                  f"此前已提交 {previous.row_count} 条")
+        else:
+            with lock:
+                save_checkpoint(checkpoint, db_path)
+    start_row = previous.start_row if previous is not None else 0
+    base_count = previous.row_count if previous is not None else 0
+
+    lookups = lookups or DimensionCache(db_path=db_path)
+    decode = compile_decoder(spec, lookups)
+    fill = lookups.filler(spec.table, spec.column_order)
+    key_positions = tuple(spec.column_order.index(col) for col in spec.key_columns)
+    seen_keys = [] if spec.group_key else None
+    # 批量装载由 StagingWriter 自己按快照删除
+    snapshot = spec.delete_missing and not bulk_load and not start_row and filter_string == spec.base_filter()
+    snapshot_keys = [] if snapshot else None
+    group_position = spec.column_order.index(spec.group_key) if spec.group_key else None
+    rows = iter_rows(spec.form_id, spec.field_keys, filter_string, page_size, order_string, start_row)
+    rows = lookups.prefetch(rows, spec.lookups, page_size, metrics)
+
+    high_water = previous.high_water if previous is not None else ''
+    skipped = 0
+    transform_seconds = 0.0
+    clock = time.perf_counter
+    # next_row：下一行的源行号；group_start：当前（可能还没拉完的）单据第一行的源行号
+    next_row = group_start = start_row
+    current_group = None
+    removed = 0
+    writer_class = StagingWriter if bulk_load else BatchWriter
+    breakdown_results = {}
+
+    def commit_checkpoint(conn, batch_rows):
+        """随数据批次一起提交断点；分录实体的断点落在未拉完单据的第一行，已拉完的单据在同一事务里做分录差集"""
+        nonlocal removed
+        checkpoint.start_row = next_row
+        pending_lines = 0
+        if seen_keys:
+            complete = [key for key in seen_keys if key[group_position] != current_group]
+            if complete:
+                removed += delete_missing_lines_in(conn, spec.table, spec.group_key, complete)
+                seen_keys[:] = [key for key in seen_keys if key[group_position] == current_group]
+            # 续传时这张单据会从第一行重新拉取
+            checkpoint.start_row = group_start
+            pending_lines = len(seen_keys)
+        checkpoint.high_water = high_water
+        checkpoint.row_count = base_count + writer.written + batch_rows - pending_lines
+        checkpoint.save(conn)
+
+    def prepare(chunk):
+        """转换阶段：一块金蝶行 -> [(写入元组或 None, FModifyDate)]；汇总实体的有效行直接累加，不再下传"""
+        nonlocal transform_seconds
+        started = clock()
+        prepared = []
+        for row in chunk:
+            values = decode(row)
+            if values is None:
+                prepared.append((None, ''))
+                continue
+            if transform:
+                values = transform(values)
+            if aggregator is not None:
+                aggregator.add(values, row)
+                continue
+            prepared.append((values, row[watermark_index] if watermark_index is not None else ''))
+        transform_seconds += clock() - started
+        return prepared
+
+    pipeline = Pipeline(rows, prepare, depth=pipeline_depth, name=spec.name)
+    try:
+        with writer_class(spec.table, batch_size, lock, track_missing=not filter_string and not start_row,
+                          metrics=metrics, db_path=db_path) as writer:
+            if checkpoint is not None and resumable:
+                writer.on_commit = commit_checkpoint
+            add = writer.add
+            with pipeline as chunks:
+                for prepared in chunks:
+                    for values, modify_date in prepared:
+                        next_row += 1
+                        if values is None:
+                            skipped += 1
+                            continue
+                        if modify_date and modify_date > high_water:
+                            high_water = modify_date
+                        if seen_keys is not None:
+                            if values[group_position] != current_group:
+                                current_group, group_start = values[group_position], next_row - 1
+                            seen_keys.append(tuple([values[pos] for pos in key_positions]))
+                        elif snapshot_keys is not None:
+                            snapshot_keys.append(tuple([values[pos] for pos in key_positions]))
+                        add(values)
+                        if fill is not None:
+                            fill(values)
+                        if push is not None:
+                            push(values, modify_date)
+            if aggregator is not None:
+                # 汇总结果一个事务写完
+                writer.batch_size = max(len(aggregator), 1)
+                for values in aggregator.rows():
+                    add(values)
+                    if push is not None:
+                        push(values)
+        if aggregator is not None:
+            for table, detail in aggregator.detail_rows().items():
+                with writer_class(table, max(len(detail), 1), lock, track_missing=not filter_string,
+                                  metrics=metrics, db_path=db_path) as detail_writer:
+                    for values in detail:
+                        detail_writer.add(values)
+                breakdown_results[table] = detail_writer
+        pushed = sink.flush(spec) if push is not None else 0
+    except Exception:
+        if push is not None:
+            sink.discard(spec)
+        raise
+    count = base_count + writer.written
+
+    details = writer.result()
+    if push is not None:
+        details['pushed'] = pushed
+    if seen_keys:
+        removed += delete_missing_lines(spec.table, spec.group_key, seen_keys, lock, metrics, db_path)
+    if snapshot_keys is not None:
+        removed += delete_missing_rows(spec.table, snapshot_keys, lock, metrics, db_path)
+    if removed:
+        details['deleted'] = details.get('deleted', 0) + removed
+    if skipped:
+        details['skipped'] = skipped
+    if aggregator is not None:
+        details['lines'] = aggregator.lines
+    for table, detail_writer in breakdown_results.items():
+        details.setdefault('breakdowns', {})[table] = detail_writer.result()
+    if start_row:
+        details['resumed_from'] = start_row
+    if pipeline_depth > 0:
+        details['pipeline'] = pipeline.summary()
+    if metrics is not None:
+        metrics.add('transform', transform_seconds)
+        metrics.count('changed', details['inserted'] + details['updated'] + details.get('deleted', 0))
+        metrics.finish('success')
+        details['metrics'] = metrics.as_dict()
+    with lock:
+        log_sync_result(spec.name, count, 'success', details, db_path)
+        if spec.watermark:
+            save_watermark(spec.name, high_water, db_path)
+        if checkpoint is not None:
+            checkpoint.start_row = next_row
+            checkpoint.high_water = high_water
+            checkpoint.row_count = count
+            checkpoint.status = CHECKPOINT_DONE
+            save_checkpoint(checkpoint, db_path)
+    print(f"✅ {spec.label}同步完成: {count} 条")
+    summary = writer.summary() + (f" / 删除分录 {removed}" if removed else "")
+    print(f"   {summary}" + (f"，跳过无效行 {skipped}" if skipped else ""))
+    if aggregator is not None:
+        print(f"   🧮 {aggregator.lines} 行明细按 {', '.join(spec.key_columns)} 汇总为 {count} 行")
+    for table, detail_writer in breakdown_results.items():
+        print(f"   🧮 {table}: {detail_writer.written} 行，{detail_writer.summary()}")
+    if push is not None:
+        print(f"   📤 已推送 MES: {pushed} 条")
+    if metrics is not None:
+        print(f"   ⏱️  {metrics.summary()}")
+    return count
+
+
+MO_STATUS = {'A': 'Plan', 'B': 'Released', 'C': 'InProgress', 'D': 'Completed', 'Z': 'Closed'}
+
+ENTITY_SPECS = {spec.name: spec for spec in (
+    EntitySpec('materials', 'BD_Material', 'materials', label='物料主数据', icon='📦', columns={
+        'material_id': Field('FNumber'),
+        'material_name': Field('FName', default='未知物料'),
+        'category': Field('FCategoryID.FName', default='未分类'),
+        'unit': Field('FBaseUnitId.FName', default='PCS'),
+    }),
+    EntitySpec('customers', 'BD_Customer', 'customers', label='客户主数据', icon='👥', columns={
+        'customer_id': Field('FNumber'),
+        'customer_name': Field('FName', default='未知客户'),
+        'tier': Field(default='Tier 2'),
+    }),
+    EntitySpec('manufacturing_orders', 'PRD_MO', 'manufacturing_orders', label='工单', icon='🏭',
+               recent_days=90, columns={
+        'mo_no': Field('FBillNo'),
+        'so_no': Field('FSrcBillNo'),
+        'material_id': Field('FMaterialId.FNumber'),
+        'customer_id': Field(),  # 需要从销售订单关联
+        'qty_plan': Field('FQty', number, 0),
+        'status': Field('FDocumentStatus', mapped(MO_STATUS), 'Plan'),
+        'promise_date': Field('FPlanFinishDate'),
+    }),
+    # 金蝶按 仓库 + 仓位 + 批次 各返回一行，按物料合计；可选按仓库的明细表
+    EntitySpec('inventory', 'STK_Inventory', 'inventory', label='库存', icon='📊', watermark=False,
+               sum_columns=('qty_on_hand',), breakdowns={
+        'inventory_by_warehouse': {'stock_id': Field('FStockId.FNumber')},
+    }, columns={
+        'material_id': Field('FMaterialId.FNumber'),
+        'qty_on_hand': Field('FBaseQty', number, 0),
+    }),
+    EntitySpec('purchase_orders', 'PUR_PurchaseOrder', 'purchase_orders', label='采购订单', icon='🛒',
+               recent_days=90, group_key='po_no', columns={
+        'po_no': Field('FBillNo'),
+        'po_line_no': Field('FPOOrderEntry_FEntryID', integer, None),  # 分录内码，同一单据的多行不再互相覆盖
+        'material_id': Field('FMaterialId.FNumber'),
+        'qty_ordered': Field('FQty', number, 0),
+        'qty_remaining': Field('FQty', number, 0),
+        'promised_date': Field('FDeliveryDate'),
+        'is_confirmed': Field('FConfirmDate', flag),
+    }),
+    # 同一父项的子项边来自多张不相邻的用料清单，增量只拉修改过的单据，按父项比对会误删；
+    # 金蝶删掉的边只在全量快照后删除（--full 或尚无水位时）
+    EntitySpec('bom', 'PRD_PPBOM', 'bom', label='BOM', icon='🔧', page_size=1000, delete_missing=True, columns={
+        'parent_id': Field('FMaterialId.FNumber'),
+        'child_id': Field('FChildMaterialId.FNumber'),
+        'qty': Field('FBOMChildQty', number, 1.0),
+    }),
+    EntitySpec('sales_orders_enhanced', 'SAL_SaleOrder', 'sales_orders', label='销售订单（增强版）', icon='💰',
+               recent_days=90, page_size=2000, group_key='so_no', columns={
+        'so_no': Field('FBillNo'),
+        'so_line_no': Field('FSaleOrderEntry_FEntryID', integer, None),  # 分录内码，不随返回顺序变化
+        'customer_id': Field('FCustId.FNumber'),
+        'customer_name': Lookup('FCustId.FNumber', 'customers'),
+        'material_id': Field('FMaterialId.FNumber'),
+        'material_name': Lookup('FMaterialId.FNumber', 'materials'),
+        'qty_ordered': Field('FQty', number, 0),
+        'qty_remaining': Field('FQty', number, 0),
+        'unit_price': Field('FPrice', number, 0),
+        'revenue': Field('FAmount', number, 0),
+        'promise_date': Field('FDeliveryDate'),
+        'updated_at': Field(convert=now),
+    }),
+    EntitySpec('suppliers_enhanced', 'BD_Supplier', 'suppliers', label='供应商（增强版）', icon='🏢', columns={
+        'supplier_id': Field('FNumber'),
+        'supplier_name': Field('FName', default='未知供应商'),
+        'lead_time_days': Field(default=30),       # 默认提前期
+        'otd_rate_3m': Field(default=0.95),        # 默认 OTD
+        'otd_rate_12m': Field(default=0.95),
+        'expedite_premium': Field(default=0.15),   # 默认加急溢价 15%
+        'updated_at': Field(convert=now),
+    }),
+    # 不同版本的金蝶分别是 BD_WorkCenter 或 PRD_WorkCenter，由 form_metadata 按元数据选定
+    EntitySpec('workcenters_enhanced', 'BD_WorkCenter', 'workcenters', label='工作中心（增强版）', icon='🏭',
+               alternate_forms=('PRD_WorkCenter',), columns={
+        'workcenter_id': Field('FNumber'),
+        'workcenter_name': Field('FName', default='未知工作中心'),
+        'workcenter_type': Field(default='General'),
+        'daily_capacity_hours': Field(default=160),  # 2班制*8小时*10人
+        'shift_count': Field(default=2),
+        'oee_avg': Field(default=0.85),
+        'rty_avg': Field(default=0.92),
+        'updated_at': Field(convert=now),
+    }),
+)}
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+本地金蝶 WebAPI 替身（只用于压测和调试，不连生产 ERP）
+
+实现 LoginByAppSecret、ExecuteBillQuery 和 QueryBusinessInfo（表单元数据）：
+- 会话 cookie（kdservice-sessionid），未登录或会话失效时返回 MsgCode=1
+- StartRow/Limit 分页；FilterString 支持 `字段 >= '值'` 这类简单比较和 `字段 IN ('a','b')`，用 AND 连接
+- 关联的名称字段（FMaterialId.FName、FCustId.FName 等）与对应主数据表单的 FName 一致
+- 可配置的延迟、抖动，以及按概率注入 503 和会话过期
+- 可选的容量（--capacity）：同时在途的查询超过容量时延迟按比例变长，超过两倍容量返回 429，
+  用来观察 rate_control 的自适应并发
+- 合成数据按下标确定性生成，同一配置每次结果一致；FModifyDate 随下标单调不减，
+  因此自然顺序即 "FModifyDate ASC,FID ASC"，OrderString 不另行处理
+
+用法:
+python fake_kingdee.py --port 18080 --rows 50000 --latency 0.05
+python fake_kingdee.py --size PRD_PPBOM=200000 --fail-rate 0.02 --expire-rate 0.01
+
+代码中可直接 FakeKingdeeServer(...).start()，在后台线程提供服务。
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from kingdee_api import LOGIN_PATH, METADATA_PATH, QUERY_PATH, SESSION_LOST_MSG_CODE
+
+
+SESSION_COOKIE = 'kdservice-sessionid'
+DEFAULT_ROWS = 10000
+
+# 单据类表单每张单据的分录行数（同一单号连续出现）
+LINES_PER_BILL = {
+    'SAL_SaleOrder': 3,
+    'PUR_PurchaseOrder': 2,
+    'PRD_PPBOM': 8,
+}
+
+# QueryBusinessInfo 返回的元数据：表单 -> {实体（表头/分录）标识: 字段}
+_MASTER = ('FNumber', 'FName', 'FDocumentStatus', 'FForbidStatus', 'FModifyDate')
+_BILL = ('FBillNo', 'FDate', 'FDocumentStatus', 'FModifyDate')
+FORM_FIELDS = {
+    'BD_Material': {'FBillHead': _MASTER + ('FCategoryID', 'FBaseUnitId', 'FSpecification')},
+    'BD_Customer': {'FBillHead': _MASTER},
+    'BD_Supplier': {'FBillHead': _MASTER},
+    'BD_WorkCenter': {'FBillHead': _MASTER + ('FDeptID',)},
+    'PRD_WorkCenter': {'FBillHead': _MASTER + ('FDeptID',)},
+    'PRD_MO': {'FBillHead': _BILL, 'FTreeEntity': ('FMaterialId', 'FQty', 'FPlanFinishDate', 'FSrcBillNo', 'FStatus')},
+    'PRD_PPBOM': {'FBillHead': _BILL + ('FMaterialId',), 'FEntity': ('FChildMaterialId', 'FBOMChildQty')},
+    'STK_Inventory': {'FBillHead': ('FMaterialId', 'FStockId', 'FBaseQty', 'FLot')},
+    'PUR_PurchaseOrder': {'FBillHead': _BILL + ('FSupplierId', 'FConfirmDate'),
+                          'FPOOrderEntry': ('FMaterialId', 'FQty', 'FDeliveryDate')},
+    'SAL_SaleOrder': {'FBillHead': _BILL + ('FCustId',),
+                      'FSaleOrderEntry': ('FMaterialId', 'FQty', 'FPrice', 'FAmount', 'FDeliveryDate')},
+}
+FORMS = tuple(FORM_FIELDS)
+
+# 合成日期的起点；FModifyDate 每张单据递增 1 分钟（同一单据的分录相同，同金蝶表头字段），FDate 落在最近 60 天内
+EPOCH = datetime(2026, 1, 1)
+
+_CONDITION = re.compile(r"^\s*([\w.]+)\s*(>=|<=|<>|=|>|<)\s*(?:'([^']*)'|([-\d.]+))\s*$")
+_IN_CONDITION = re.compile(r"^\s*([\w.]+)\s+IN\s*\((.*)\)\s*$", re.IGNORECASE)
+_IN_ITEM = re.compile(r"'((?:[^']|'')*)'")
+_TRAILING_NUMBER = re.compile(r'(\d+)$')
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}T')
+
+# 关联字段 -> 主数据表单（关联的 .FName 取该表单同编号行的 FName）
+MASTER_REFS = {
+    'FMaterialId': 'BD_Material', 'FChildMaterialId': 'BD_Material',
+    'FCustId': 'BD_Customer', 'FSupplierId': 'BD_Supplier',
+}
+
+
+def _date(dt: datetime) -> str:
+    return dt.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def field_value(form_id: str, key: str, i: int, size: int):
+    """第 i 行的 key 字段值（确定性）"""
+    bill = i // LINES_PER_BILL.get(form_id, 1)
+    materials = max(size // 10, 1)
+    if key == 'FModifyDate':
+        return _date(EPOCH + timedelta(minutes=bill))
+    if key in ('FDate', 'FPlanFinishDate', 'FDeliveryDate', 'FConfirmDate'):
+        offset = {'FDate': -60, 'FPlanFinishDate': 14, 'FDeliveryDate': 21, 'FConfirmDate': -30}[key]
+        day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return _date(day + timedelta(days=offset + bill % 30))
+    if key in ('FID', 'FEntryID') or key.endswith('_FEntryID') or key.endswith('_FEntryId'):
+        return i + 1
+    if key in ('FBillNo', 'FNumber'):
+        return f"{form_id.split('_')[-1].upper()}{bill:08d}"
+    if key == 'FSrcBillNo':
+        return f"SALSALEORDER{bill:08d}"
+    if key == 'FMaterialId.FNumber':
+        return f"MATERIAL{(bill if form_id == 'PRD_PPBOM' else i) % materials:08d}"
+    if key == 'FChildMaterialId.FNumber':
+        # 子项编号总是大于父项，不会成环
+        return f"MATERIAL{bill % materials + 1 + i % 7:08d}"
+    if key == 'FCustId.FNumber':
+        return f"CUSTOMER{bill % 500:08d}"
+    if key == 'FDocumentStatus':
+        return 'ABCDZ'[bill % 5]
+    if 'Qty' in key:
+        return float(i % 50 + 1)
+    if key in ('FPrice', 'FTaxPrice'):
+        return round(10 + (i % 97) * 1.5, 2)
+    if key in ('FAmount', 'FAllAmount'):
+        return round((i % 50 + 1) * (10 + (i % 97) * 1.5), 2)
+    if key.endswith('.FNumber'):
+        return f"{key.split('.')[0][1:].upper()}{i % 200:04d}"
+    if key.endswith('.FName') and key.split('.')[0] in MASTER_REFS:
+        # 主数据第 n 行的编号以 n 结尾、FName 为 FName-n
+        number = field_value(form_id, key.split('.')[0] + '.FNumber', i, size)
+        return f"FName-{int(_TRAILING_NUMBER.search(number).group(1))}"
+    return f"{key.split('.')[0]}-{i}"
+
+
+def _parse_filter(filter_string: str):
+    """'A >= 'x' AND B = 1' -> [(字段, 运算符, 值)]；不支持的语法抛 ValueError"""
+    if not filter_string or not filter_string.strip():
+        return []
+    conditions = []
+    for part in re.split(r'\s+AND\s+', filter_string.strip(), flags=re.IGNORECASE):
+        match = _IN_CONDITION.match(part)
+        if match:
+            values = frozenset(value.replace("''", "'") for value in _IN_ITEM.findall(match.group(2)))
+            conditions.append((match.group(1), 'IN', values))
+            continue
+        match = _CONDITION.match(part)
+        if not match:
+            raise ValueError(f"不支持的过滤条件: {part}")
+        key, op, text, num = match.groups()
+        conditions.append((key, op, text if text is not None else float(num)))
+    return conditions
+
+
+_OPS = {
+    '>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b, '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b, '=': lambda a, b: a == b, '<>': lambda a, b: a != b,
+    'IN': lambda a, b: a in b,
+}
+
+
+def _normalize(value):
+    # 金蝶日期带 T，过滤条件里通常写空格
+    return value.replace('T', ' ', 1) if isinstance(value, str) and _DATE.match(value) else value
+
+
+def business_info_response(form_id: str) -> dict:
+    return {"Result": {"ResponseStatus": {"IsSuccess": True}, "NeedReturnData": {
+        "Id": form_id,
+        "Entrys": [
+            {"Key": entry, "Fields": [{"Key": key} for key in fields]}
+            for entry, fields in FORM_FIELDS[form_id].items()
+        ],
+    }}}
+
+
+def error_response(message: str, msg_code: int = 0) -> list:
+    return [[{"Result": {"ResponseStatus": {
+        "IsSuccess": False, "MsgCode": msg_code, "Errors": [{"Message": message}]
+    }}}]]
+
+
+class FakeKingdeeServer:
+    """金蝶 WebAPI 替身"""
+
+    def __init__(self, sizes: dict = None, default_rows: int = DEFAULT_ROWS, latency: float = 0.0,
+                 jitter: float = 0.0, fail_rate: float = 0.0, expire_rate: float = 0.0,
+                 host: str = '127.0.0.1', port: int = 0, seed: int = 0, hidden_forms=(), capacity: int = 0):
+        self.sizes = dict(sizes or {})
+        # 模拟没有这些表单的金蝶版本（如只有 PRD_WorkCenter）
+        self.hidden_forms = set(hidden_forms or ())
+        self.default_rows = default_rows
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.expire_rate = expire_rate
+        self.capacity = capacity
+        self.active = 0
+        self.random = random.Random(seed)
+        self.sessions = set()
+        self.lock = threading.Lock()
+        self.stats = {'login': 0, 'query': 0, 'rows': 0, 'failed': 0, 'expired': 0, 'metadata': 0,
+                      'throttled': 0, 'peak_active': 0}
+        # (表单, 过滤) -> 命中的行下标；过滤条件通常固定，分页时不必每页全表扫描
+        self._matches = {}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/k3cloud"
+
+    def size(self, form_id: str) -> int:
+        return self.sizes.get(form_id, self.default_rows)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-kingdee', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _count(self, key: str, n: int = 1):
+        with self.lock:
+            self.stats[key] += n
+
+    def _chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def login(self) -> str:
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions.add(session_id)
+        self._count('login')
+        return session_id
+
+    def _matching(self, form_id: str, conditions: list, filter_string: str) -> list:
+        cache_key = (form_id, filter_string)
+        with self.lock:
+            matches = self._matches.get(cache_key)
+        if matches is not None:
+            return matches
+        size = self.size(form_id)
+        if not conditions:
+            matches = range(size)
+        else:
+            matches = [
+                i for i in range(size)
+                if all(_OPS[op](_normalize(field_value(form_id, key, i, size)), value)
+                       for key, op, value in conditions)
+            ]
+        with self.lock:
+            if len(self._matches) > 64:
+                self._matches.clear()
+            self._matches[cache_key] = matches
+        return matches
+
+    def _session_valid(self, session_id: str) -> bool:
+        with self.lock:
+            valid = session_id in self.sessions
+        if not valid:
+            self._count('expired')
+        return valid
+
+    def business_info(self, session_id: str, data: dict):
+        """QueryBusinessInfo -> (HTTP 状态码, 响应体)"""
+        self._count('metadata')
+        if not self._session_valid(session_id):
+            return 200, error_response("会话信息已丢失，请重新登录", SESSION_LOST_MSG_CODE)[0][0]
+        form_id = data.get('FormId', '')
+        if form_id not in FORMS or form_id in self.hidden_forms:
+            return 200, error_response(f"业务对象 {form_id} 不存在")[0][0]
+        return 200, business_info_response(form_id)
+
+    def query(self, session_id: str, data: dict):
+        """ExecuteBillQuery -> (HTTP 状态码, 响应体)"""
+        with self.lock:
+            self.active += 1
+            active = self.active
+            self.stats['peak_active'] = max(self.stats['peak_active'], active)
+        try:
+            return self._query(session_id, data, active)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def _query(self, session_id: str, data: dict, active: int):
+        self._count('query')
+        if self.capacity and active > 2 * self.capacity:
+            self._count('throttled')
+            return 429, None
+        if self.latency or self.jitter:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if self.capacity and active > self.capacity:
+                delay *= active / self.capacity
+            time.sleep(delay)
+
+        if self._chance(self.fail_rate):
+            self._count('failed')
+            return 503, None
+        if self._chance(self.expire_rate):
+            with self.lock:
+                self.sessions.discard(session_id)
+        if not self._session_valid(session_id):
+            return 200, error_response("会话信息已丢失，请重新登录", SESSION_LOST_MSG_CODE)
+
+        form_id = data.get('FormId', '')
+        if form_id not in FORMS or form_id in self.hidden_forms:
+            return 200, error_response(f"业务对象 {form_id} 不存在")
+        keys = [key.strip() for key in (data.get('FieldKeys') or '').split(',') if key.strip()]
+        try:
+            conditions = _parse_filter(data.get('FilterString') or '')
+        except ValueError as e:
+            return 200, error_response(str(e))
+
+        size = self.size(form_id)
+        matches = self._matching(form_id, conditions, data.get('FilterString') or '')
+        start = int(data.get('StartRow') or 0)
+        limit = int(data.get('Limit') or 0) or len(matches)
+        rows = [[field_value(form_id, key, i, size) for key in keys] for i in matches[start:start + limit]]
+        self._count('rows', len(rows))
+        return 200, rows
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _session_id(self) -> str:
+                for part in (self.headers.get('Cookie') or '').split(';'):
+                    name, _, value = part.strip().partition('=')
+                    if name == SESSION_COOKIE:
+                        return value
+                return ''
+
+            def _send(self, status: int, body=None, cookie: str = None):
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                if cookie:
+                    self.send_header('Set-Cookie', f"{SESSION_COOKIE}={cookie}; Path=/")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self._send(400, {"Message": "请求体不是合法 JSON"})
+                    return
+
+                if self.path.endswith(LOGIN_PATH):
+                    session_id = server.login()
+                    self._send(200, {"LoginResultType": 1, "Message": "",
+                                     "Context": {"UserName": "fake", "SessionId": session_id}}, session_id)
+                elif self.path.endswith(QUERY_PATH):
+                    data = body.get('data') or {}
+                    if isinstance(data, str):
+                        data = json.loads(data)
+                    status, result = server.query(self._session_id(), data)
+                    self._send(status, result)
+                elif self.path.endswith(METADATA_PATH):
+                    data = body.get('data') or {}
+                    if isinstance(data, str):
+                        data = json.loads(data)
+                    status, result = server.business_info(self._session_id(), data)
+                    self._send(status, result)
+                else:
+                    self._send(404, {"Message": f"未实现的接口: {self.path}"})
+
+        return Handler
+
+
+def parse_sizes(items) -> dict:
+    """['PRD_PPBOM=200000', ...] -> {'PRD_PPBOM': 200000}"""
+    sizes = {}
+    for item in items or []:
+        form_id, _, count = item.partition('=')
+        if form_id not in FORMS or not count.isdigit():
+            raise argparse.ArgumentTypeError(f"无效的 --size: {item}（可选表单: {', '.join(FORMS)}）")
+        sizes[form_id] = int(count)
+    return sizes
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    """fake_kingdee 和压测脚本共用的参数"""
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, metavar='N', help=f'每个表单的默认行数（默认 {DEFAULT_ROWS}）')
+    parser.add_argument('--size', action='append', metavar='FORM=N', help='单独指定某个表单的行数，可重复')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS', help='每次查询的固定延迟')
+    parser.add_argument('--jitter', type=float, default=0.0, metavar='SECONDS', help='在固定延迟上叠加 0~N 秒随机延迟')
+    parser.add_argument('--fail-rate', type=float, default=0.0, metavar='P', help='返回 503 的概率')
+    parser.add_argument('--expire-rate', type=float, default=0.0, metavar='P', help='会话失效（MsgCode=1）的概率')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--hide-form', action='append', metavar='FORM', help='模拟金蝶没有该表单（如 BD_WorkCenter），可重复')
+    parser.add_argument('--capacity', type=int, default=0, metavar='N', help='同时在途查询超过 N 时变慢，超过 2N 返回 429（默认不限）')
+
+
+def server_from_args(args, host: str = '127.0.0.1', port: int = 0) -> FakeKingdeeServer:
+    return FakeKingdeeServer(parse_sizes(args.size), args.rows, args.latency, args.jitter,
+                             args.fail_rate, args.expire_rate, host, port, args.seed, args.hide_form,
+                             args.capacity)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地金蝶 WebAPI 替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, args.host, args.port)
+    print(f"🧪 金蝶替身已启动: {server.url}")
+    print("   把 config_sso.BASE_URL 指向该地址即可；Ctrl+C 退出")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"\n📊 {server.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+本地 MES ingest 接口替身（只用于调试 mes_sink，不连真实 MES）
+真实接口见 apps/server 的 integration/erp/ingest.ts，这里不校验令牌、也不应用数据
+
+- POST /api/integration/erp/<实体>/ingest：接收 gzip 压缩的 IntegrationEnvelope
+- 按 Idempotency-Key 判重：重复的批次返回 200 和 duplicate=true，不重复计数
+- 可配置的延迟，以及按概率注入 503（验证 mes_sink 的重试和幂等）
+- GET /stats 返回已接收的批次数、记录数（按 entityType）和重复批次数
+
+用法:
+python fake_mes.py --port 18090
+python sync_kingdee.py --all --mes-url http://127.0.0.1:18090
+"""
+
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+_INGEST = re.compile(r'^/api/integration/erp/([\w-]+)/ingest$')
+
+
+class FakeMesServer:
+    """MES ingest 接口替身"""
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, host: str = '127.0.0.1',
+                 port: int = 0, seed: int = 0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.keys = set()
+        self.records = defaultdict(int)
+        self.stats = {'batches': 0, 'duplicates': 0, 'failed': 0, 'bytes': 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-mes', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.stats, records=dict(self.records))
+
+    def ingest(self, key: str, envelope: dict, size: int) -> bool:
+        """记录一个批次，返回是否为重复批次"""
+        with self.lock:
+            if key in self.keys:
+                self.stats['duplicates'] += 1
+                return True
+            self.keys.add(key)
+            self.stats['batches'] += 1
+            self.stats['bytes'] += size
+            self.records[envelope['entityType']] += len(envelope['items'])
+            return False
+
+    def _fail(self) -> bool:
+        if self.fail_rate <= 0:
+            return False
+        with self.lock:
+            failed = self.random.random() < self.fail_rate
+            self.stats['failed'] += failed
+        return failed
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, payload: dict):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _error(self, status: int, code: str, message: str):
+                self._reply(status, {'ok': False, 'error': {'code': code, 'message': message}})
+
+            def do_GET(self):
+                if self.path == '/stats':
+                    self._reply(200, server.snapshot())
+                else:
+                    self._error(404, 'NOT_FOUND', self.path)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if not _INGEST.match(self.path):
+                    self._error(404, 'NOT_FOUND', self.path)
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._fail():
+                    self._error(503, 'UNAVAILABLE', 'injected failure')
+                    return
+
+                key = self.headers.get('Idempotency-Key')
+                if not key:
+                    self._error(400, 'IDEMPOTENCY_KEY_REQUIRED', 'Idempotency-Key header is required')
+                    return
+                try:
+                    raw = gzip.decompress(body) if self.headers.get('Content-Encoding') == 'gzip' else body
+                    envelope = json.loads(raw)
+                    items = envelope['items']
+                    if not isinstance(items, list) or not envelope['entityType']:
+                        raise ValueError('items must be a list and entityType non-empty')
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    self._error(400, 'BAD_ENVELOPE', str(e))
+                    return
+
+                duplicate = server.ingest(key, envelope, len(body))
+                self._reply(200, {'ok': True, 'data': {'received': len(items), 'duplicate': duplicate}})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 MES ingest 接口替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18090)
+    parser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS', help='每个批次的固定延迟')
+    parser.add_argument('--fail-rate', type=float, default=0.0, metavar='P', help='返回 503 的概率')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    server = FakeMesServer(args.latency, args.fail_rate, args.host, args.port, args.seed)
+    print(f"🧪 MES 替身已启动: {server.url}（统计: {server.url}/stats）；Ctrl+C 退出")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"📊 {server.snapshot()}")
+
+
+if __name__ == '__main__':
+    main()
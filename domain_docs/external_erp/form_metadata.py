@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+金蝶表单元数据（QueryBusinessInfo）探测、磁盘缓存和实体声明校验
+
+同步前对每个实体：
+1. 依次探测 form_id 及其备选表单（如工作中心的 BD_WorkCenter / PRD_WorkCenter），
+   取第一个存在且字段齐全的表单
+2. 校验 FieldKeys 和过滤用到的字段（FDate、FModifyDate）都在该表单的元数据里：
+   "FMaterialId.FNumber" 校验 FMaterialId，"FSaleOrderEntry_FEntryID" 校验分录 FSaleOrderEntry
+3. 有任何实体校验失败就抛 MetadataError，列出全部问题，不发起任何数据查询
+
+探测结果按 (BASE_URL, DBID) 缓存在 .kingdee_cache/metadata.json，带格式版本和 TTL；
+过期、版本不符或 --refresh-metadata 时重新探测。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from kingdee_api import (
+    METADATA_PATH, SESSION_ATTEMPTS, KingdeeApiError, KingdeeSessionExpired,
+    business_info_payload, raise_for_response_status
+)
+from response_cache import DEFAULT_CACHE_DIR
+
+
+METADATA_VERSION = 1
+METADATA_FILE = 'metadata.json'
+DEFAULT_METADATA_TTL = 7 * 24 * 3600
+
+# 所有表单都有的内置字段
+BUILTIN_FIELDS = ('FID',)
+# 分录内码和行号：<分录标识>_FEntryID / <分录标识>_FSeq
+ENTRY_SUFFIXES = ('_FEntryID', '_FEntryId', '_FSeq')
+
+
+class MetadataError(KingdeeApiError):
+    """表单元数据探测失败，或实体声明与元数据不符"""
+
+
+def parse_business_info(result) -> dict:
+    """QueryBusinessInfo 响应 -> {'entries': [...], 'fields': [...]}；报错响应抛 KingdeeApiError"""
+    if isinstance(result, list) and result and isinstance(result[0], list) and result[0]:
+        result = result[0][0]
+    data = None
+    if isinstance(result, dict):
+        inner = result.get('Result')
+        if isinstance(inner, dict):
+            status = inner.get('ResponseStatus') or {}
+            if status.get('IsSuccess') is False:
+                raise_for_response_status(result)
+            data = inner.get('NeedReturnData')
+    if not isinstance(data, dict) or not isinstance(data.get('Entrys'), list):
+        raise_for_response_status(result)
+
+    entries, fields = [], set(BUILTIN_FIELDS)
+    for entry in data['Entrys']:
+        if not isinstance(entry, dict):
+            continue
+        if entry.get('Key'):
+            entries.append(entry['Key'])
+        for field in entry.get('Fields') or ():
+            if isinstance(field, dict) and field.get('Key'):
+                fields.add(field['Key'])
+    return {'entries': entries, 'fields': sorted(fields)}
+
+
+def fetch_business_info(client, form_id: str) -> Optional[dict]:
+    """用已登录客户端的会话探测表单；表单不存在（接口返回业务错误）时返回 None
+
+    会话过期时重新登录后重试；网络错误抛 MetadataError。
+    """
+    url = f"{client.base_url}{METADATA_PATH}"
+    headers = {"Content-Type": "application/json"}
+    for attempt in range(SESSION_ATTEMPTS):
+        generation = client.login_generation
+        try:
+            response = client.session.post(url, headers=headers, data=json.dumps(business_info_payload(form_id)),
+                                           timeout=60)
+            response.raise_for_status()
+            return parse_business_info(response.json())
+        except KingdeeSessionExpired:
+            if attempt == SESSION_ATTEMPTS - 1:
+                raise MetadataError(f"探测表单 {form_id} 时会话反复过期")
+            client._relogin(generation)
+        except KingdeeApiError as e:
+            print(f"  ⚠️  表单 {form_id} 不可用: {e}")
+            return None
+        except Exception as e:
+            raise MetadataError(f"探测表单 {form_id} 失败: {e}") from e
+
+
+def required_fields(spec) -> list:
+    """实体用到的全部字段：FieldKeys，加上 recent_days 过滤用的 FDate"""
+    keys = list(spec.field_keys_list)
+    if spec.recent_days and 'FDate' not in keys:
+        keys.append('FDate')
+    return keys
+
+
+def missing_field_keys(spec, form: dict) -> list:
+    fields = set(form['fields'])
+    entries = set(form['entries'])
+    missing = []
+    for key in required_fields(spec):
+        base = key.split('.', 1)[0]
+        for suffix in ENTRY_SUFFIXES:
+            if base.endswith(suffix) and base[:-len(suffix)] in entries:
+                break
+        else:
+            if base not in fields:
+                missing.append(key)
+    return missing
+
+
+class MetadataCache:
+    """表单元数据的磁盘缓存：{version, scopes: {scope: {form_id: {fetched_at, form}}}}"""
+
+    def __init__(self, path: str = os.path.join(DEFAULT_CACHE_DIR, METADATA_FILE),
+                 ttl: int = DEFAULT_METADATA_TTL, refresh: bool = False):
+        self.path = path
+        self.ttl = ttl
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {'version': METADATA_VERSION, 'scopes': {}}
+        if not isinstance(data, dict) or data.get('version') != METADATA_VERSION:
+            print(f"  ♻️  元数据缓存版本不符，重新探测: {self.path}")
+            return {'version': METADATA_VERSION, 'scopes': {}}
+        return data
+
+    def get(self, scope: str, form_id: str):
+        """返回 (命中, 元数据或 None)；None 表示缓存的结论是表单不存在"""
+        if self.refresh:
+            return False, None
+        with self._lock:
+            entry = self._data['scopes'].get(scope, {}).get(form_id)
+        if entry is None or (self.ttl and time.time() - entry['fetched_at'] > self.ttl):
+            return False, None
+        return True, entry['form']
+
+    def put(self, scope: str, form_id: str, form: Optional[dict]):
+        with self._lock:
+            self._data['scopes'].setdefault(scope, {})[form_id] = {'fetched_at': time.time(), 'form': form}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            content = json.dumps(self._data, ensure_ascii=False, indent=1)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+
+def resolve_specs(client, specs, cache: MetadataCache, scope: str) -> dict:
+    """探测并校验实体声明，返回 {实体名: 实际表单}，并把结果写回 spec.form_id
+
+    任一实体没有可用表单或缺字段时抛 MetadataError（列出全部问题），此时不修改任何 spec。
+    """
+    forms = {}
+
+    def lookup(form_id):
+        if form_id not in forms:
+            hit, form = cache.get(scope, form_id)
+            if not hit:
+                form = fetch_business_info(client, form_id)
+                cache.put(scope, form_id, form)
+            forms[form_id] = form
+        return forms[form_id]
+
+    resolved, problems = {}, []
+    try:
+        for spec in specs:
+            reasons = []
+            for form_id in spec.form_candidates:
+                form = lookup(form_id)
+                if form is None:
+                    reasons.append(f"{form_id} 不存在或无权限")
+                    continue
+                missing = missing_field_keys(spec, form)
+                if missing:
+                    reasons.append(f"{form_id} 缺少字段 {', '.join(missing)}")
+                    continue
+                resolved[spec.name] = form_id
+                break
+            else:
+                problems.append(f"{spec.name}: " + "；".join(reasons))
+    finally:
+        cache.save()
+
+    if problems:
+        raise MetadataError("实体声明与金蝶元数据不符（元数据有变化时加 --refresh-metadata 重新探测）:\n  "
+                            + "\n  ".join(problems))
+    for spec in specs:
+        if spec.form_id != resolved[spec.name]:
+            print(f"  🔀 {spec.label}使用表单 {resolved[spec.name]}（而非 {spec.form_id}）")
+            spec.form_id = resolved[spec.name]
+    return resolved
+
+
+def add_metadata_arguments(parser):
+    """同步脚本共用的元数据参数（缓存文件放在 --cache-dir 下）"""
+    parser.add_argument('--refresh-metadata', action='store_true', help='忽略元数据缓存，重新探测表单')
+    parser.add_argument('--metadata-ttl', type=int, default=DEFAULT_METADATA_TTL, metavar='SECONDS',
+                        help='元数据缓存有效期，0 表示不过期')
+    parser.add_argument('--no-metadata-check', action='store_true', help='跳过表单元数据校验')
+
+
+def metadata_from_args(args) -> Optional[MetadataCache]:
+    if args.no_metadata_check:
+        return None
+    return MetadataCache(os.path.join(args.cache_dir, METADATA_FILE), args.metadata_ttl, args.refresh_metadata)
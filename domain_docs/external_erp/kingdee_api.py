@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+金蝶 WebAPI 公共部分：接口路径、登录/查询请求体、响应解析、错误类型和重试策略
+
+同步客户端（sync_kingdee / sync_kingdee_enhanced）和异步客户端（kingdee_async）共用。
+查询失败一律抛 KingdeeApiError，不再返回 [] 被当成“同步了 0 条”。
+"""
+
+import json
+import random
+
+from urllib3.util.retry import Retry
+
+
+LOGIN_PATH = "/Kingdee.BOS.WebApi.ServicesStub.AuthService.LoginByAppSecret.common.kdsvc"
+QUERY_PATH = "/Kingdee.BOS.WebApi.ServicesStub.DynamicFormService.ExecuteBillQuery.common.kdsvc"
+METADATA_PATH = "/Kingdee.BOS.WebApi.ServicesStub.DynamicFormService.QueryBusinessInfo.common.kdsvc"
+
+# 需要退避重试的 HTTP 状态码（429 为网关限流，urllib3 会遵守 Retry-After）
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# ResponseStatus.MsgCode = 1 表示会话信息已丢失，需要重新登录
+SESSION_LOST_MSG_CODE = 1
+
+# 单个请求最多尝试的次数（含会话过期后重新登录的重试）。
+# 并发时别的线程刚换上的新会话也可能随即过期，只重试一次不够
+SESSION_ATTEMPTS = 3
+
+
+class KingdeeApiError(Exception):
+    """金蝶接口返回错误或请求失败"""
+
+
+class KingdeeSessionExpired(KingdeeApiError):
+    """会话过期，重新登录后可重试"""
+
+
+def login_payload(dbid, username, appid, app_secret, lcid) -> dict:
+    """LoginByAppSecret 请求体"""
+    return {
+        "format": 1,
+        "useragent": "ApiClient",
+        "rid": "1",
+        "parameters": json.dumps([dbid, username, appid, app_secret, lcid]),
+        "timestamp": "0",
+        "v": "1.0"
+    }
+
+
+def query_payload(form_id: str, field_keys: str, filter_string: str, limit: int,
+                  start_row: int, order_string: str) -> dict:
+    """ExecuteBillQuery 请求体"""
+    return {
+        "data": {
+            "FormId": form_id,
+            "FieldKeys": field_keys,
+            "FilterString": filter_string,
+            "OrderString": order_string,
+            "TopRowCount": 0,
+            "StartRow": start_row,
+            "Limit": limit,
+            "SubSystemId": ""
+        }
+    }
+
+
+def business_info_payload(form_id: str) -> dict:
+    """QueryBusinessInfo 请求体（表单元数据）"""
+    return {"data": {"FormId": form_id}}
+
+
+def is_error_row(row) -> bool:
+    """金蝶报错时返回 [[{"Result": {"ResponseStatus": ...}}]]，即首行是一个字典"""
+    return isinstance(row, list) and len(row) > 0 and isinstance(row[0], dict)
+
+
+def raise_for_response_status(obj):
+    """把 {"Result": {"ResponseStatus": ...}} 转成异常"""
+    status = {}
+    if isinstance(obj, dict):
+        result = obj.get("Result")
+        if isinstance(result, dict):
+            status = result.get("ResponseStatus") or {}
+
+    errors = status.get("Errors") or []
+    message = "; ".join(e.get("Message", "") for e in errors if isinstance(e, dict)) or str(obj)[:200]
+    if status.get("MsgCode") == SESSION_LOST_MSG_CODE:
+        raise KingdeeSessionExpired(message)
+    raise KingdeeApiError(message)
+
+
+def extract_rows(result) -> list:
+    """ExecuteBillQuery 响应 -> 行列表；报错响应抛 KingdeeApiError"""
+    if isinstance(result, list):
+        if result and is_error_row(result[0]):
+            raise_for_response_status(result[0][0])
+        return result
+    if isinstance(result, dict):
+        rows = result.get("Result")
+        if isinstance(rows, list):
+            return extract_rows(rows)
+        raise_for_response_status(result)
+    raise KingdeeApiError(f"无法识别的查询响应: {str(result)[:200]}")
+
+
+def build_retry(max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE) -> Retry:
+    """requests/urllib3 重试策略：连接失败、读超时、429 和 5xx 指数退避重试
+
+    ExecuteBillQuery 和登录都是只读调用，POST 重试是安全的。
+    """
+    return Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_base,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    )
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """第 attempt 次重试前的等待秒数（指数退避 + 全抖动）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+金蝶 WebAPI 异步客户端（asyncio + aiohttp）
+
+与同步的 requests 客户端并存，适合大量分页请求同时在途的场景：
+- 有上限的连接池（TCPConnector.limit）
+- 每个请求独立超时
+- 连接失败、超时、5xx 指数退避重试
+- 会话过期（MsgCode=1）时自动重新登录并重试，并发请求只触发一次登录
+- 可选与同步客户端共用的 rate_control.AdaptiveConcurrency（全局每秒请求数上限）和
+  response_cache.ResponseCache（回放模式只读缓存，未命中报错）
+
+用法:
+    async with AsyncKingdeeClient(max_connections=32) as client:
+        async for row in client.iter_entity("PRD_PPBOM", field_keys, page_size=2000, concurrency=16):
+            ...
+
+同步代码里用 BackgroundAsyncClient 在一个后台线程里长期持有事件循环和客户端（一次运行一个会话和连接池，
+可沿用同步客户端已登录的会话 cookie），多个实体从各自的线程逐行取回结果；
+一次性的拉取可用 iter_entity_blocking()。
+依赖可选的 aiohttp（pip install aiohttp）。
+"""
+
+import asyncio
+import json
+import queue
+import threading
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - 可选依赖
+    aiohttp = None
+
+from account_sets import AccountSet, default_account
+from rate_control import AdaptiveConcurrency
+from response_cache import ResponseCache
+from kingdee_api import (
+    LOGIN_PATH, QUERY_PATH, RETRY_STATUSES, SESSION_ATTEMPTS, MAX_RETRIES, BACKOFF_BASE,
+    KingdeeApiError, KingdeeSessionExpired, backoff_delay, extract_rows,
+    login_payload, query_payload
+)
+
+
+ASYNC_AVAILABLE = aiohttp is not None
+
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_TIMEOUT = 60
+
+
+class AsyncKingdeeClient:
+    """金蝶异步客户端"""
+
+    def __init__(self, base_url: str = None, max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 timeout: float = DEFAULT_TIMEOUT, max_retries: int = MAX_RETRIES,
+                 backoff_base: float = BACKOFF_BASE, account: AccountSet = None,
+                 limiter: AdaptiveConcurrency = None, cache: ResponseCache = None):
+        if aiohttp is None:
+            raise RuntimeError("异步客户端需要 aiohttp：pip install aiohttp")
+        # 账套（DBID 和登录凭据）；base_url 未指定时取账套的地址
+        self.account = account or default_account()
+        self.base_url = base_url or self.account.base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        # 与同步客户端共用的全局限速（在途页数由 concurrency 决定，不经 AIMD 调整）
+        self.limiter = limiter
+        # 与同步客户端共用的响应缓存，键同样按金蝶地址和账套区分
+        self.cache = cache
+        self.scope = f"{self.base_url}|{self.account.dbid}"
+        self.session = None
+        self.login_generation = 0
+        self._login_lock = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    async def open(self, cookies: dict = None):
+        """建会话和连接池；cookies 为已登录的会话 cookie 时直接沿用，过期后照常重新登录"""
+        if self.session is None:
+            self._login_lock = asyncio.Lock()
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                # 金蝶服务常以 IP 访问，默认 CookieJar 会丢弃 IP 主机的会话 cookie
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                cookies=cookies or None,
+                headers={"Content-Type": "application/json"},
+            )
+            if cookies and self.login_generation == 0:
+                self.login_generation = 1
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _post(self, path: str, body: dict):
+        """POST 并解析 JSON；连接失败、超时和 5xx 退避重试"""
+        url = f"{self.base_url}{path}"
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.session.post(url, data=json.dumps(body), timeout=timeout) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = getattr(e, 'status', None)
+                retryable = status is None or status in RETRY_STATUSES
+                if not retryable or attempt >= self.max_retries:
+                    raise KingdeeApiError(f"请求失败 ({path}): {e}") from e
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base))
+
+    async def login(self, seen_generation: int = None) -> bool:
+        """登录；seen_generation 不是当前代时说明别的请求已经重新登录过，直接返回"""
+        await self.open()
+        async with self._login_lock:
+            if seen_generation is not None and seen_generation != self.login_generation:
+                return True
+            result = await self._post(LOGIN_PATH, login_payload(
+                self.account.dbid, self.account.username, self.account.appid, self.account.app_secret, self.account.lcid
+            ))
+            if result.get("LoginResultType") != 1:
+                raise KingdeeApiError(f"登录失败: {result.get('Message', '未知错误')}")
+            self.login_generation += 1
+            return True
+
+    async def query_page(self, form_id: str, field_keys: str, filter_string: str = "", limit: int = 2000,
+                         start_row: int = 0, order_string: str = "") -> list:
+        """查询单页；会话过期时重新登录后重试（最多 SESSION_ATTEMPTS 次）"""
+        body = query_payload(form_id, field_keys, filter_string, limit, start_row, order_string)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.key(body["data"], self.scope)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+            if self.cache.replay:
+                raise KingdeeApiError(f"回放缓存未命中 ({form_id}, StartRow={start_row})")
+
+        if self.login_generation == 0:
+            await self.login(0)
+
+        for attempt in range(SESSION_ATTEMPTS):
+            generation = self.login_generation
+            if self.limiter is not None:
+                wait = self.limiter.reserve_rate()
+                if wait:
+                    await asyncio.sleep(wait)
+            try:
+                rows = extract_rows(await self._post(QUERY_PATH, body))
+            except KingdeeSessionExpired:
+                if attempt == SESSION_ATTEMPTS - 1:
+                    raise
+                await self.login(generation)
+                continue
+            if cache_key is not None:
+                self.cache.put(cache_key, rows)
+            return rows
+
+    async def iter_pages(self, form_id: str, field_keys: str, filter_string: str = "", page_size: int = 2000,
+                         order_string: str = "", concurrency: int = 8, start_row: int = 0):
+        """从 start_row 起保持 concurrency 个 StartRow 窗口在途，按顺序逐页产出，遇到短页结束"""
+        in_flight = []
+        next_start = start_row
+
+        def submit():
+            nonlocal next_start
+            in_flight.append(asyncio.ensure_future(self.query_page(
+                form_id, field_keys, filter_string, page_size, next_start, order_string
+            )))
+            next_start += page_size
+
+        for _ in range(max(concurrency, 1)):
+            submit()
+        try:
+            while in_flight:
+                rows = await in_flight.pop(0)
+                yield rows
+                if len(rows) < page_size:
+                    break
+                submit()
+        finally:
+            for task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def iter_entity(self, form_id: str, field_keys: str, filter_string: str = "", page_size: int = 2000,
+                          order_string: str = "", concurrency: int = 8):
+        """逐行产出整张表单的数据"""
+        async for rows in self.iter_pages(form_id, field_keys, filter_string, page_size, order_string, concurrency):
+            for row in rows:
+                yield row
+
+
+class BackgroundAsyncClient:
+    """在一个后台线程的事件循环里长期持有 AsyncKingdeeClient，供同步代码反复拉取
+
+    整个运行只有一个事件循环、一个 aiohttp 会话和连接池；cookies 为同步客户端已登录的会话 cookie 时不再登录。
+    iter_rows 可以从多个线程同时调用（并行同步多个实体），请求都在同一个循环里执行；用完须 close()。
+    """
+
+    def __init__(self, cookies: dict = None, **client_options):
+        self.client = AsyncKingdeeClient(**client_options)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='kingdee-async', daemon=True)
+        self.thread.start()
+        try:
+            self._call(self.client.open(cookies))
+        except BaseException:
+            self._stop()
+            raise
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def iter_rows(self, form_id: str, field_keys: str, filter_string: str = "", page_size: int = 2000,
+                  order_string: str = "", concurrency: int = 8, start_row: int = 0, max_pending_pages: int = 4):
+        """同步生成器：逐行产出，参数同 AsyncKingdeeClient.iter_pages
+
+        页面通过有界队列传递，调用方处理不过来时停止拉取；调用方提前退出时拉取任务随之取消（会话保留）。
+        """
+        pages = queue.Queue(maxsize=max(max_pending_pages, 1))
+        stop = threading.Event()
+        finished = threading.Event()
+        done = object()
+
+        async def put(item) -> bool:
+            # 不能在事件循环里阻塞等待队列，满了就让出循环稍后再试
+            while not stop.is_set():
+                try:
+                    pages.put_nowait(item)
+                    return True
+                except queue.Full:
+                    await asyncio.sleep(0.05)
+            return False
+
+        async def produce():
+            source = self.client.iter_pages(form_id, field_keys, filter_string, page_size, order_string,
+                                            concurrency, start_row)
+            try:
+                async for rows in source:
+                    if not await put(rows):
+                        return
+                await put(done)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:
+                await put(e)
+            finally:
+                await source.aclose()
+
+        async def start():
+            task = asyncio.ensure_future(produce())
+            task.add_done_callback(lambda _: finished.set())
+            return task
+
+        task = self._call(start())
+        try:
+            while True:
+                item = pages.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield from item
+        finally:
+            stop.set()
+            self.loop.call_soon_threadsafe(task.cancel)
+            finished.wait()
+
+    def close(self):
+        """关闭会话和连接池，停掉后台事件循环"""
+        if self.loop.is_closed():
+            return
+        try:
+            self._call(self.client.close())
+        finally:
+            self._stop()
+
+    def _stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def iter_entity_blocking(form_id: str, field_keys: str, filter_string: str = "", page_size: int = 2000,
+                         order_string: str = "", concurrency: int = 8, max_pending_pages: int = 4,
+                         start_row: int = 0, **client_options):
+    """同步生成器：为这一次拉取建一个 BackgroundAsyncClient，逐行交给调用方，结束时关闭
+
+    同一次运行里要拉多个表单时直接复用 BackgroundAsyncClient，不必每次重建会话和登录。
+    """
+    client = BackgroundAsyncClient(**client_options)
+    try:
+        yield from client.iter_rows(form_id, field_keys, filter_string, page_size, order_string, concurrency,
+                                    start_row, max_pending_pages)
+    finally:
+        client.close()
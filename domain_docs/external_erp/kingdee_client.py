@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+金蝶 WebAPI 同步客户端的公共部分（KingdeeSync、KingdeeEnhancedSync 共用）
+
+- 会话：连接池 + 重试策略、登录、会话过期后单次重新登录（多个线程同时发现过期时只登录一次）
+- 查询：单页查询（可经响应缓存）、流式单页、按 StartRow 分页（可并发窗口或异步客户端）；
+  异步客户端整个运行只建一个（后台事件循环 + 会话，沿用已登录的 cookie），用完 close()
+- 所有查询经同一个自适应并发控制（rate_control），分阶段指标记入 SyncMetrics
+- 实体同步：按 entity_specs 的声明执行，_run_entities 负责并发执行、捕获失败并记入 sync_log
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from account_sets import AccountSet, default_account
+from batch_writer import DEFAULT_BATCH_SIZE
+from dimension_cache import DimensionCache
+from entity_specs import ENTITY_SPECS, sync_entity
+from form_metadata import MetadataCache, MetadataError, resolve_specs
+from kingdee_api import (
+    LOGIN_PATH, QUERY_PATH, SESSION_ATTEMPTS, KingdeeApiError, KingdeeSessionExpired,
+    build_retry, extract_rows, login_payload, query_payload
+)
+from kingdee_async import ASYNC_AVAILABLE, BackgroundAsyncClient
+from mes_sink import MesSink
+from pipeline import DEFAULT_DEPTH
+from rate_control import AdaptiveConcurrency
+from response_cache import ResponseCache
+from stream_decode import STREAMING_AVAILABLE, iter_response_rows
+from sync_metrics import EntityMetrics, SyncMetrics, retries_of
+from sync_state import begin_run, log_sync_result, new_run_id
+
+
+class KingdeeClient:
+    """金蝶 WebAPI 会话、查询和实体同步的执行框架；具体实体由子类的 sync_* 方法提供"""
+    
+    def __init__(self, fan_out: int = 1, full: bool = False, batch_size: int = DEFAULT_BATCH_SIZE,
+                 cache: ResponseCache = None, use_async: bool = False, bulk_load: bool = False,
+                 sink: MesSink = None, metadata: MetadataCache = None, breakdowns: bool = False,
+                 resume: bool = False, limiter: AdaptiveConcurrency = None, lookups: DimensionCache = None,
+                 pipeline_depth: int = DEFAULT_DEPTH, account: AccountSet = None, db_path: str = None):
+        self.session = requests.Session()
+        # 账套（DBID 和登录凭据），默认为 config_sso 里配置的
+        self.account = account or default_account()
+        self.base_url = self.account.base_url
+        # 本地库路径（多账套分区库、压测临时库）；None 时用 database.get_db 的默认库
+        self.db_path = db_path
+        self.is_logged_in = False
+        # 单个表单并发拉取的 StartRow 窗口数（1 = 逐页顺序拉取）
+        self.fan_out = max(fan_out, 1)
+        # 忽略水位，强制全量拉取（完成后仍会刷新水位）
+        self.full = full
+        # 每个写事务提交的行数
+        self.batch_size = batch_size
+        # 批量装载：先写暂存表，结束时一次性合并（全量时同时删除金蝶已删除的行）
+        self.bulk_load = bulk_load
+        # 可选的原始响应缓存（cache.replay 时完全不访问网络）
+        self.cache = cache
+        # 本次运行各实体的分阶段耗时和计数
+        self.metrics = SyncMetrics()
+        # 可选的 MES 推送（同一次拉取同时写本地库和 MES）
+        self.sink = sink
+        # 表单元数据缓存（None 表示不校验实体声明）
+        self.metadata = metadata
+        # 汇总实体同时写明细汇总表（如按仓库的库存 inventory_by_warehouse）
+        self.breakdowns = breakdowns
+        # 拉取、转换、写入流水线每段的队列块数（0 = 依次执行）
+        self.pipeline_depth = pipeline_depth
+        # 断点随数据批次提交；resume 时由 start_run 换成中断运行的 ID
+        self.run_id = new_run_id()
+        self.resume = resume
+        # 查询的在途上限按延迟和限流自适应（最多 parallel × fan_out），可选全局每秒请求数上限
+        self.limiter = limiter or AdaptiveConcurrency()
+        # 与别的客户端共用时不缩小已有的上限
+        self.limiter.set_max(max(self.fan_out, self.limiter.max_limit))
+        self.metrics.concurrency = self.limiter
+        # 单据的物料/客户名称在本地按编码解析，未命中时用本客户端批量查询主数据（共用时以第一个客户端为准）
+        self.lookups = lookups or DimensionCache(db_path=db_path)
+        self.lookups.bind(self.query_entity)
+        # 用异步客户端（aiohttp）拉取，fan_out 为同时在途的页数（不经 AIMD 调整，但共用全局限速和缓存）
+        self.use_async = use_async and ASYNC_AVAILABLE
+        if use_async and not ASYNC_AVAILABLE:
+            print("⚠️  未安装 aiohttp，回退为同步客户端")
+        # 首次异步拉取时创建，之后各实体共用（见 async_client）
+        self._async_client = None
+        self._async_lock = threading.Lock()
+        # 并行同步时串行化数据库写入（SQLite 同一时刻只允许一个写事务）
+        self.db_lock = threading.Lock()
+        # 会话过期时只让一个线程重新登录
+        self.login_lock = threading.Lock()
+        self.login_generation = 0
+        self._mount_adapter(self.fan_out)
+    
+    def _mount_adapter(self, pool_size: int = 10):
+        """HTTP 连接池 + 重试策略（连接失败、读超时、5xx 指数退避）"""
+        self.session.mount(self.base_url, HTTPAdapter(
+            pool_connections=max(pool_size, 10), pool_maxsize=max(pool_size, 10), max_retries=build_retry()
+        ))
+    
+    def login(self) -> bool:
+        """WebAPI 登录"""
+        if self.is_logged_in:
+            return True
+        
+        if self.cache is not None and self.cache.replay:
+            print("✅ 回放模式 - 跳过登录，只读本地缓存")
+            self.is_logged_in = True
+            return True
+        
+        login_url = f"{self.base_url}{LOGIN_PATH}"
+        
+        account = self.account
+        login_body = login_payload(account.dbid, account.username, account.appid, account.app_secret, account.lcid)
+        
+        headers = {"Content-Type": "application/json"}
+        
+        try:
+            response = self.session.post(login_url, headers=headers, data=json.dumps(login_body), timeout=30)
+            response.raise_for_status()
+            
+            result = response.json()
+            if result.get("LoginResultType") == 1:
+                self.is_logged_in = True
+                self.login_generation += 1
+                print(f"✅ 登录成功 - 用户: {result.get('Context', {}).get('UserName')}")
+                return True
+            else:
+                print(f"❌ 登录失败: {result.get('Message', '未知错误')}")
+                return False
+        except Exception as e:
+            print(f"❌ 登录异常: {e}")
+            return False
+    
+    def async_client(self) -> BackgroundAsyncClient:
+        """本客户端共用的异步客户端：一个后台事件循环、一个会话和连接池，沿用当前已登录会话的 cookie"""
+        with self._async_lock:
+            if self._async_client is None:
+                self._async_client = BackgroundAsyncClient(
+                    cookies=self.session.cookies.get_dict(), base_url=self.base_url, account=self.account,
+                    limiter=self.limiter, cache=self.cache
+                )
+            return self._async_client
+    
+    def close(self):
+        """关闭异步客户端和 HTTP 会话"""
+        with self._async_lock:
+            if self._async_client is not None:
+                self._async_client.close()
+                self._async_client = None
+        self.session.close()
+    
+    def _relogin(self, seen_generation: int):
+        """会话过期后重新登录；多个线程同时发现过期时只登录一次"""
+        with self.login_lock:
+            if seen_generation != self.login_generation:
+                return
+            print("⚠️  会话已过期，重新登录...")
+            self.is_logged_in = False
+            if not self.login():
+                raise KingdeeApiError("会话过期后重新登录失败")
+    
+    def check_metadata(self, names: list) -> bool:
+        """数据查询前探测表单元数据并校验实体声明；不符时打印全部问题并返回 False"""
+        if self.metadata is None or (self.cache is not None and self.cache.replay):
+            return True
+        try:
+            resolve_specs(self, [ENTITY_SPECS[name] for name in names], self.metadata, self.scope)
+        except MetadataError as e:
+            print(f"❌ {e}")
+            return False
+        return True
+    
+    @property
+    def scope(self) -> str:
+        """金蝶地址 + 账套，区分元数据缓存和响应缓存"""
+        return f"{self.base_url}|{self.account.dbid}"
+    
+    def start_run(self, names: list):
+        """确定本次运行 ID：--resume 且这些实体有中断的运行时沿用它"""
+        self.run_id = begin_run(names, self.resume, self.db_path)
+    
+    def query_entity(self, form_id: str, field_keys: str, filter_string: str = "", limit: int = 100,
+                     start_row: int = 0, order_string: str = "", metrics: EntityMetrics = None) -> list:
+        """查询实体数据（单页，从 start_row 开始最多 limit 行）
+        
+        网络错误和 5xx 由连接池重试；会话过期时重新登录后重试（最多 SESSION_ATTEMPTS 次）；
+        仍失败则抛 KingdeeApiError，由调用方记为同步失败。
+        metrics 为发起查询的实体（如解析名称时查主数据），未给时计入登记了该表单的实体。
+        """
+        query_url = f"{self.base_url}{QUERY_PATH}"
+        
+        payload = query_payload(form_id, field_keys, filter_string, limit, start_row, order_string)
+        metrics = self.metrics.for_form(form_id, metrics)
+        
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.key(payload["data"], self.scope)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.page(start_row, len(cached), 0.0, 0.0)
+                return cached
+            if self.cache.replay:
+                # 不能当作空页返回：会截断分页，全量批量装载时还会删掉本地数据
+                metrics.count('errors')
+                raise KingdeeApiError(f"回放缓存未命中 ({form_id}, StartRow={start_row})")
+        
+        headers = {"Content-Type": "application/json"}
+        
+        for attempt in range(SESSION_ATTEMPTS):
+            generation = self.login_generation
+            try:
+                with self.limiter.request() as request:
+                    started = time.perf_counter()
+                    response = self.session.post(query_url, headers=headers, data=json.dumps(payload), timeout=60)
+                    received = time.perf_counter()
+                    request.retries = retries_of(response)
+                    response.raise_for_status()
+                    rows = extract_rows(response.json())
+                metrics.page(start_row, len(rows), received - started, time.perf_counter() - received,
+                             request.retries)
+            except KingdeeSessionExpired:
+                if attempt == SESSION_ATTEMPTS - 1:
+                    metrics.count('errors')
+                    raise
+                metrics.count('relogins')
+                self._relogin(generation)
+                continue
+            except Exception as e:
+                print(f"❌ 查询失败 ({form_id}, StartRow={start_row}): {e}")
+                metrics.count('errors')
+                if isinstance(e, KingdeeApiError):
+                    raise
+                raise KingdeeApiError(f"查询失败 ({form_id}, StartRow={start_row}): {e}") from e
+            
+            if cache_key is not None:
+                self.cache.put(cache_key, rows)
+            return rows
+    
+    def stream_page(self, form_id: str, field_keys: str, filter_string: str = "", limit: int = 100,
+                    start_row: int = 0, order_string: str = ""):
+        """流式查询单页：边读响应体边解析，逐行 yield
+        
+        开启缓存（需要整页落盘）或未安装 ijson 时回退为整页 query_entity。
+        会话过期且尚未产出任何行时重新登录后重试；其他错误抛 KingdeeApiError。
+        """
+        if self.cache is not None or not STREAMING_AVAILABLE:
+            yield from self.query_entity(form_id, field_keys, filter_string, limit, start_row, order_string)
+            return
+        
+        query_url = f"{self.base_url}{QUERY_PATH}"
+        payload = query_payload(form_id, field_keys, filter_string, limit, start_row, order_string)
+        headers = {"Content-Type": "application/json"}
+        metrics = self.metrics.for_form(form_id)
+        clock = time.perf_counter
+        
+        for attempt in range(SESSION_ATTEMPTS):
+            generation = self.login_generation
+            yielded = 0
+            try:
+                # 在途名额占到整页读完；并发控制按收到响应头的耗时判断快慢
+                with self.limiter.request() as request:
+                    started = clock()
+                    with self.session.post(query_url, headers=headers, data=json.dumps(payload), timeout=60,
+                                           stream=True) as response:
+                        http_seconds = request.latency = clock() - started
+                        request.retries = retries_of(response)
+                        response.raise_for_status()
+                        # 只计解析耗时，不含调用方处理每行的时间
+                        decode_seconds = 0.0
+                        rows = iter_response_rows(response)
+                        while True:
+                            started = clock()
+                            row = next(rows, None)
+                            decode_seconds += clock() - started
+                            if row is None:
+                                break
+                            yielded += 1
+                            yield row
+                        metrics.page(start_row, yielded, http_seconds, decode_seconds, request.retries)
+                return
+            except KingdeeSessionExpired:
+                if attempt == SESSION_ATTEMPTS - 1 or yielded:
+                    metrics.count('errors')
+                    raise
+                metrics.count('relogins')
+                self._relogin(generation)
+            except Exception as e:
+                print(f"❌ 查询失败 ({form_id}, StartRow={start_row}): {e}")
+                metrics.count('errors')
+                if isinstance(e, KingdeeApiError):
+                    raise
+                raise KingdeeApiError(f"查询失败 ({form_id}, StartRow={start_row}): {e}") from e
+    
+    def iter_entity(self, form_id: str, field_keys: str, filter_string: str = "", page_size: int = 500,
+                    order_string: str = "", start_row: int = 0):
+        """分页查询实体数据
+        
+        从 start_row（断点续传时为已提交的行数）起按 StartRow 逐页推进，直到某页返回不足 page_size 行为止；
+        逐行 yield，调用方按流处理。顺序拉取时每页也是流式解析的，内存只占一行。
+        fan_out > 1 时同一表单的多个 StartRow 窗口并发拉取（整页解析），行顺序保持不变；
+        use_async 时改由异步客户端拉取，同样经过全局限速和响应缓存。
+        """
+        if self.use_async:
+            # 异步客户端内部不分阶段，等待下一行的时间都记为 http
+            metrics = self.metrics.for_form(form_id)
+            rows = self.async_client().iter_rows(form_id, field_keys, filter_string, page_size, order_string,
+                                                 concurrency=self.fan_out, start_row=start_row)
+            waited = 0.0
+            count = 0
+            try:
+                while True:
+                    started = time.perf_counter()
+                    row = next(rows, None)
+                    waited += time.perf_counter() - started
+                    if row is None:
+                        break
+                    count += 1
+                    yield row
+            finally:
+                # 提前退出时在本线程里取消拉取任务（共用的会话保留）
+                rows.close()
+                metrics.add('http', waited)
+                metrics.count('rows', count)
+            return
+        
+        if self.fan_out > 1:
+            for rows in self._iter_pages_sharded(form_id, field_keys, filter_string, page_size, order_string,
+                                                 start_row):
+                yield from rows
+            return
+        
+        while True:
+            count = 0
+            for row in self.stream_page(form_id, field_keys, filter_string, page_size, start_row, order_string):
+                count += 1
+                yield row
+            if count < page_size:
+                break
+            start_row += count
+    
+    def _iter_pages_sharded(self, form_id: str, field_keys: str, filter_string: str, page_size: int,
+                            order_string: str, start_row: int = 0):
+        """并发拉取 fan_out 个连续的 StartRow 窗口
+        
+        始终保持 fan_out 个窗口在途，按 StartRow 顺序交付；
+        任一窗口返回不足一页即视为到达末尾，取消其后尚未开始的窗口并丢弃其结果。
+        """
+        with ThreadPoolExecutor(max_workers=self.fan_out, thread_name_prefix=f'kingdee-{form_id}') as pool:
+            in_flight = deque()
+            next_start = start_row
+            
+            def submit():
+                nonlocal next_start
+                in_flight.append(pool.submit(
+                    self.query_entity, form_id, field_keys, filter_string, page_size, next_start, order_string
+                ))
+                next_start += page_size
+            
+            for _ in range(self.fan_out):
+                submit()
+            
+            try:
+                while in_flight:
+                    rows = in_flight.popleft().result()
+                    yield rows
+                    if len(rows) < page_size:
+                        break
+                    submit()
+            finally:
+                for future in in_flight:
+                    future.cancel()
+    
+    def _sync_spec(self, name: str, page_size: int = None, transform=None) -> int:
+        """按 entity_specs 中的声明同步一个实体"""
+        spec = ENTITY_SPECS[name]
+        # 备选表单（元数据校验后可能换用）的查询同样计入该实体
+        metrics = self.metrics.entity(name, spec.form_id, spec.form_candidates)
+        return sync_entity(spec, self.iter_entity, self.db_lock, self.full, self.batch_size, page_size, transform,
+                           metrics=metrics, bulk_load=self.bulk_load,
+                           sink=self.sink, breakdowns=self.breakdowns, run_id=self.run_id, resume=self.resume,
+                           lookups=self.lookups, pipeline_depth=self.pipeline_depth, db_path=self.db_path)
+    
+    def _run_entities(self, tasks: list, parallel: int = 1) -> list:
+        """执行各实体同步，返回 [(实体, 条数, 耗时秒)]
+        
+        parallel > 1 时用线程池并发执行，所有线程共用同一个已登录的 session；
+        各表写入经 db_lock 串行化。
+        """
+        def run(name, func):
+            started = time.perf_counter()
+            try:
+                count = func()
+            except Exception as e:
+                print(f"❌ {name} 同步异常: {e}")
+                count = None
+                details = {'error': str(e)}
+                metrics = self.metrics.get(name)
+                if metrics is not None:
+                    metrics.finish('failed')
+                    details['metrics'] = metrics.as_dict()
+                # 失败要留痕，不能被当成“同步了 0 条”；水位也不会推进
+                with self.db_lock:
+                    log_sync_result(name, 0, 'failed', details, self.db_path)
+            return name, count, time.perf_counter() - started
+        
+        if parallel <= 1:
+            return [run(name, func) for name, func in tasks]
+        
+        # 连接池至少容纳 parallel * fan_out 个并发请求，避免 urllib3 丢弃连接
+        self._mount_adapter(parallel * self.fan_out)
+        self.limiter.set_max(parallel * self.fan_out)
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='kingdee-sync') as pool:
+            futures = [pool.submit(run, name, func) for name, func in tasks]
+            return [future.result() for future in futures]
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+把同步到的金蝶数据推送给 MES 服务端（一次拉取，同时写本地库和 MES）
+
+- 记录按 MES 端 integration/erp/types.ts 的字段名规范化（ErpMaterial、ErpBomItem 等），
+  只带本脚本实际拉取到的字段，由服务端按部分更新处理
+- 每 batch_size 条打成一个 IntegrationEnvelope（与 sync-pipeline.ts 相同的结构），
+  gzip 压缩后 POST 到 {MES_URL}/api/integration/erp/<实体>/ingest
+- Idempotency-Key 为 "ERP:<实体类型>:<信封内容 sha256>"（同 sync-pipeline 的 dedupeKey），
+  重试或重跑同一批数据时服务端可直接判重
+- 最多 concurrency 个请求在途，排队批次也有上限，推送跟不上时拉取会等待（背压）
+- 网络错误和 5xx 由连接池按 build_retry() 指数退避重试；仍失败时该实体同步失败，水位不推进
+
+服务端接收路由为 POST /api/integration/erp/:entity/ingest（apps/server 的 integration/erp/ingest.ts），
+只认该路由专用的服务令牌：--mes-token 填服务端环境变量 MES_INGEST_TOKEN 的值，以 Bearer 发送
+（不是用户会话令牌；服务端未配置该变量时接收路由关闭，返回 503）。
+MES 只接收 MES_ENTITIES 中的实体，其余实体只写本地库，首次遇到时打印一次跳过提示。
+本地调试可用 fake_mes.py。
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from kingdee_api import build_retry
+
+
+SOURCE_SYSTEM = 'ERP'
+INGEST_PATH = '/api/integration/erp/{path}/ingest'
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_CONCURRENCY = 4
+COMPRESS_LEVEL = 6
+
+
+class MesSinkError(Exception):
+    """推送 MES 失败（重试后仍非 2xx 或连接失败）"""
+
+
+def _material(r: dict) -> dict:
+    return {'materialCode': r['material_id'], 'name': r['material_name'],
+            'category': r['category'], 'unit': r['unit']}
+
+
+def _bom_item(r: dict) -> dict:
+    return {'parentCode': r['parent_id'], 'childCode': r['child_id'], 'qty': r['qty']}
+
+
+def _work_center(r: dict) -> dict:
+    return {'workCenterCode': r['workcenter_id'], 'name': r['workcenter_name'],
+            'workCenterType': r['workcenter_type']}
+
+
+# 本地库存的是 entity_specs.MO_STATUS 映射后的名称，MES 端 mapWorkOrderStatus 按金蝶数字状态码解析
+MO_STATUS_CODES = {'Plan': '1', 'Released': '2', 'InProgress': '3', 'Completed': '4', 'Closed': '5'}
+
+
+def _work_order(r: dict) -> dict:
+    return {'woNo': r['mo_no'], 'productCode': r['material_id'], 'plannedQty': r['qty_plan'],
+            'status': MO_STATUS_CODES.get(r['status'], r['status']), 'srcBillNo': r['so_no'],
+            'planFinishDate': r['promise_date']}
+
+
+# 实体名 -> (MES entityType, 路由片段, 写入元组转换后的 dict -> MES 记录)
+MES_ENTITIES = {
+    'materials': ('MATERIAL', 'materials', _material),
+    'bom': ('BOM', 'boms', _bom_item),
+    'workcenters_enhanced': ('WORK_CENTER', 'work-centers', _work_center),
+    'manufacturing_orders': ('WORK_ORDER', 'work-orders', _work_order),
+}
+
+
+def _canonical(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def build_envelope(entity_type: str, items: list) -> dict:
+    """与 MES 端 IntegrationEnvelope 相同的结构"""
+    updated = [item['updatedAt'] for item in items if item.get('updatedAt')]
+    cursor = {'hasMore': False}
+    if updated:
+        cursor['nextSyncAt'] = max(updated)
+    return {'sourceSystem': SOURCE_SYSTEM, 'entityType': entity_type, 'cursor': cursor, 'items': items}
+
+
+def idempotency_key(envelope: dict) -> str:
+    digest = hashlib.sha256(_canonical(envelope)).hexdigest()
+    return f"{SOURCE_SYSTEM}:{envelope['entityType']}:{digest}"
+
+
+class MesSink:
+    """按实体攒批、压缩并发推送；sync_entity 通过 writer(spec) 取得逐行推送函数"""
+
+    def __init__(self, base_url: str, token: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 concurrency: int = DEFAULT_CONCURRENCY, timeout: int = 60):
+        self.base_url = base_url.rstrip('/')
+        self.batch_size = max(batch_size, 1)
+        self.concurrency = max(concurrency, 1)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount(self.base_url, HTTPAdapter(
+            pool_connections=self.concurrency, pool_maxsize=self.concurrency, max_retries=build_retry()
+        ))
+        self.headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        if token:
+            self.headers['Authorization'] = f"Bearer {token}"
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='mes-sink')
+        # 在途 + 排队的批次上限，超过时 add() 阻塞
+        self.slots = threading.BoundedSemaphore(self.concurrency * 2)
+        self.lock = threading.Lock()
+        self.buffers = {}
+        self.futures = {}
+        self.skipped = set()
+        self.stats = {'batches': 0, 'records': 0, 'raw_bytes': 0, 'sent_bytes': 0, 'duplicates': 0}
+
+    def writer(self, spec) -> Optional[Callable]:
+        """返回 push(values, updated_at)；MES 不接收的实体返回 None"""
+        mapping = MES_ENTITIES.get(spec.name)
+        if mapping is None:
+            with self.lock:
+                first = spec.name not in self.skipped
+                self.skipped.add(spec.name)
+            if first:
+                print(f"  ⏭️  MES 不接收 {spec.name}，跳过推送")
+            return None
+        entity_type, path, convert = mapping
+        columns = spec.column_order
+        name = spec.name
+        with self.lock:
+            self.buffers[name] = []
+            self.futures[name] = []
+
+        def push(values, updated_at=''):
+            item = convert(dict(zip(columns, values)))
+            if updated_at:
+                item['updatedAt'] = updated_at
+            buffer = self.buffers[name]
+            buffer.append(item)
+            if len(buffer) >= self.batch_size:
+                self._submit(name, entity_type, path)
+
+        return push
+
+    def _submit(self, name: str, entity_type: str, path: str):
+        items, self.buffers[name] = self.buffers[name], []
+        if not items:
+            return
+        self.slots.acquire()
+        future = self.pool.submit(self._post, path, build_envelope(entity_type, items))
+        future.add_done_callback(lambda _: self.slots.release())
+        with self.lock:
+            self.futures[name].append(future)
+
+    def _post(self, path: str, envelope: dict) -> int:
+        raw = _canonical(envelope)
+        body = gzip.compress(raw, COMPRESS_LEVEL)
+        headers = dict(self.headers, **{'Idempotency-Key': idempotency_key(envelope)})
+        try:
+            response = self.session.post(f"{self.base_url}{INGEST_PATH.format(path=path)}",
+                                         data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise MesSinkError(f"推送 {envelope['entityType']} 失败: {e}") from e
+        if response.status_code >= 300:
+            raise MesSinkError(f"推送 {envelope['entityType']} 失败: HTTP {response.status_code} {response.text[:200]}")
+
+        try:
+            duplicate = bool(response.json().get('data', {}).get('duplicate'))
+        except ValueError:
+            duplicate = False
+        with self.lock:
+            self.stats['batches'] += 1
+            self.stats['records'] += len(envelope['items'])
+            self.stats['raw_bytes'] += len(raw)
+            self.stats['sent_bytes'] += len(body)
+            self.stats['duplicates'] += duplicate
+        return len(envelope['items'])
+
+    def flush(self, spec) -> int:
+        """推送该实体剩余的记录并等待全部批次完成，返回推送条数；任一批失败抛 MesSinkError"""
+        mapping = MES_ENTITIES.get(spec.name)
+        if mapping is None or spec.name not in self.buffers:
+            return 0
+        entity_type, path, _ = mapping
+        self._submit(spec.name, entity_type, path)
+        with self.lock:
+            futures, self.futures[spec.name] = self.futures[spec.name], []
+        pushed = 0
+        error = None
+        for future in futures:
+            try:
+                pushed += future.result()
+            except MesSinkError as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return pushed
+
+    def discard(self, spec):
+        """实体同步失败时丢弃未推送的记录（已提交的批次仍会完成）"""
+        with self.lock:
+            self.buffers.pop(spec.name, None)
+            self.futures.pop(spec.name, None)
+
+    def summary(self) -> str:
+        stats = self.stats
+        ratio = stats['sent_bytes'] / stats['raw_bytes'] if stats['raw_bytes'] else 0
+        text = f"MES 推送: {stats['records']} 条 / {stats['batches']} 批，压缩后 {stats['sent_bytes'] / 1024:.0f} KB（{ratio:.0%}）"
+        if stats['duplicates']:
+            text += f"，重复批次 {stats['duplicates']}"
+        if self.skipped:
+            text += f"；未推送: {', '.join(sorted(self.skipped))}"
+        return text
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+
+def add_sink_arguments(parser):
+    """同步脚本共用的 MES 推送参数"""
+    parser.add_argument('--mes-url', metavar='URL', help='同时推送到 MES 服务端（如 http://localhost:3000）')
+    parser.add_argument('--mes-token', metavar='TOKEN', help='MES 接收路由的服务令牌（服务端 MES_INGEST_TOKEN）')
+    parser.add_argument('--mes-batch', type=int, default=DEFAULT_BATCH_SIZE, metavar='N', help=f'每批推送条数（默认 {DEFAULT_BATCH_SIZE}）')
+    parser.add_argument('--mes-concurrency', type=int, default=DEFAULT_CONCURRENCY, metavar='N', help=f'同时在途的推送请求数（默认 {DEFAULT_CONCURRENCY}）')
+
+
+def sink_from_args(args) -> Optional[MesSink]:
+    if not args.mes_url:
+        return None
+    return MesSink(args.mes_url, args.mes_token, args.mes_batch, args.mes_concurrency)
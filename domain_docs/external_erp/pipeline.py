@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+实体同步的三段流水线：拉取 -> 转换 -> 写入
+
+- 拉取线程：迭代金蝶行（分页/分片/流式，以及名称预读），每 chunk_size 行打成一块放进有界队列
+- 转换线程：逐块解码和转换，结果放进第二个有界队列
+- 写入在调用线程：SQLite 连接、断点和水位的状态都留在 sync_entity 里，不跨线程
+队列满时上游阻塞（背压），内存里最多 depth 块待转换、depth 块待写入；
+写入提交事务时下一页已经在路上，等金蝶响应时上一批正在落库。
+
+任一阶段抛异常：异常沿队列传到调用线程原样抛出，其余阶段随即取消；
+写入阶段出错（或调用方提前退出）时同样取消上游。拉取线程退出前在本线程关闭整条源迭代器链
+（名称预读、分页/分片/流式生成器：取消在途的分片请求、关闭流式响应、归还限流名额），
+生成器的创建和收尾都在拉取线程里。所有金蝶请求都只在拉取线程里发出。
+
+depth 为 0 时不起线程，三段在调用线程里依次执行（与流水线之前的行为一致，便于排查）。
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+
+DEFAULT_DEPTH = 4
+DEFAULT_CHUNK_SIZE = 500
+# 取消后等待阶段线程退出的秒数（拉取线程可能正卡在一次 HTTP 请求里，不无限等待）
+CANCEL_JOIN_TIMEOUT = 5.0
+_POLL = 0.1
+
+_END = object()
+
+
+class _Failure:
+    """沿队列传递的上游异常"""
+
+    __slots__ = ('error',)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def chunked(rows: Iterable, size: int):
+    """逐块产出 list，最后一块可能不满；本生成器被关闭时一并关闭 rows"""
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        _close(rows)
+
+
+def _close(iterator):
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+        close()
+
+
+class _Stage:
+    """一个后台阶段：迭代 source，逐项 func（None 表示原样）后放进有界队列；下游迭代本对象取结果"""
+
+    def __init__(self, name: str, source: Iterable, func: Optional[Callable], depth: int, cancel: threading.Event,
+                 stats: dict, blocked_stat: str, owned: Optional[Iterable] = None):
+        self.source = source
+        # 退出时在本线程关闭的源迭代器（整条生成器链），不留给别的线程或垃圾回收去收尾
+        self.owned = owned
+        self.func = func
+        self.queue = queue.Queue(max(depth, 1))
+        self.cancel = cancel
+        self.stats = stats
+        self.blocked_stat = blocked_stat
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _put(self, item) -> bool:
+        started = time.perf_counter()
+        try:
+            while not self.cancel.is_set():
+                try:
+                    self.queue.put(item, timeout=_POLL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self.stats[self.blocked_stat] += time.perf_counter() - started
+
+    def _run(self):
+        source = iter(self.source)
+        try:
+            for item in source:
+                if not self._put(self.func(item) if self.func is not None else item):
+                    return
+            self._put(_END)
+        except BaseException as e:
+            self._put(_Failure(e))
+        finally:
+            _close(source)
+            if self.owned is not None:
+                _close(self.owned)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=_POLL)
+            except queue.Empty:
+                if self.cancel.is_set():
+                    return
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+
+class Pipeline:
+    """with Pipeline(rows, transform, ...) as chunks: 逐块取转换结果
+
+    transform(list of 金蝶行) -> list，只在转换线程里调用（depth 为 0 时在调用线程）。
+    stats: fetch_blocked（拉取等转换）/ transform_blocked（转换等写入）/ write_waiting（写入等上游）秒数。
+    """
+
+    def __init__(self, rows: Iterable, transform: Callable, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 depth: int = DEFAULT_DEPTH, name: str = 'sync'):
+        self.rows = rows
+        self.transform = transform
+        self.chunk_size = max(chunk_size, 1)
+        self.depth = depth
+        self.name = name
+        self.cancel = threading.Event()
+        self.stats = {'fetch_blocked': 0.0, 'transform_blocked': 0.0, 'write_waiting': 0.0}
+        self._stages = []
+
+    def __enter__(self):
+        chunks = chunked(self.rows, self.chunk_size)
+        if self.depth <= 0:
+            return map(self.transform, chunks)
+        fetch = _Stage(f"{self.name}-fetch", chunks, None, self.depth, self.cancel,
+                       self.stats, 'fetch_blocked', owned=self.rows)
+        transform = _Stage(f"{self.name}-transform", fetch, self.transform, self.depth, self.cancel,
+                           self.stats, 'transform_blocked')
+        self._stages = [fetch, transform]
+        for stage in self._stages:
+            stage.thread.start()
+        return self._consume(transform)
+
+    def _consume(self, stage: _Stage):
+        items = iter(stage)
+        while True:
+            started = time.perf_counter()
+            item = next(items, _END)
+            self.stats['write_waiting'] += time.perf_counter() - started
+            if item is _END:
+                return
+            yield item
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._stages:
+            _close(self.rows)
+            return False
+        # 正常结束时各阶段已退出；出错或提前退出时取消上游
+        self.cancel.set()
+        timeout = None if exc_type is None else CANCEL_JOIN_TIMEOUT
+        for stage in self._stages:
+            stage.thread.join(timeout)
+        return False
+
+    def summary(self) -> dict:
+        return {key: round(seconds, 3) for key, seconds in self.stats.items()}
+
+
+def add_pipeline_arguments(parser):
+    """同步脚本共用的流水线参数"""
+    parser.add_argument('--pipeline-depth', type=int, default=DEFAULT_DEPTH, metavar='N',
+                        help=f'拉取/转换/写入流水线每段的队列块数（默认 {DEFAULT_DEPTH}，0 表示不起线程、依次执行）')
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+金蝶查询（ExecuteBillQuery）的自适应并发和全局限速
+
+- 在途请求数上限按 AIMD 调整：请求成功且耗时不超过 latency_target 时上限加 1/上限
+  （上限被用满时才加，约每轮加 1）；连接失败、超时、被限流（429/5xx，或连接池发生过重试）
+  时乘 backoff，只是变慢时乘 slow_backoff；同一轮只降一次（降速前发出的请求的反馈不再计入）
+- 上限在 [min_limit, max_limit] 之间浮动，max_limit 为 parallel × fan_out，即不限流时的在途数
+- 可选的全局每秒请求数上限（令牌桶），所有实体、所有拉取线程共用；
+  异步客户端自带在途上限，只经 reserve_rate() 取同一个桶的令牌
+- 会话过期、金蝶业务报错（字段不存在等）不代表服务端拥塞，不参与调整
+- 已占着名额的线程再发起的嵌套请求（如流式读取一页的途中按编码批量查名称）不排队，否则会自己等自己
+
+白天 ERP 繁忙时延迟升高，并发自动收缩；夜间延迟正常时逐步放开到 max_limit。
+"""
+
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from kingdee_api import RETRY_STATUSES
+
+
+DEFAULT_LATENCY_TARGET = 5.0
+DEFAULT_BACKOFF = 0.5
+DEFAULT_SLOW_BACKOFF = 0.8
+
+# 视为服务端拥塞的 HTTP 状态码（与连接池重试的状态码一致）
+THROTTLE_STATUSES = RETRY_STATUSES
+
+OK, SLOW, THROTTLED, ERROR, NEUTRAL = 'ok', 'slow', 'throttled', 'error', 'neutral'
+
+
+class TokenBucket:
+    """每秒 rate 个令牌、最多攒 burst 个；acquire() 取不到时按欠额睡眠，返回等待秒数"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """取一个令牌（不够时记欠额），返回调用方应等待的秒数，不睡眠"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 先记账再睡眠：并发的取令牌者各自排在前一个之后
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def classify(exc: Optional[BaseException], retries: int = 0) -> str:
+    """请求结果 -> 反馈类型"""
+    if exc is None:
+        return THROTTLED if retries else OK
+    if isinstance(exc, requests.HTTPError):
+        status = getattr(exc.response, 'status_code', None)
+        return THROTTLED if status in THROTTLE_STATUSES else NEUTRAL
+    if isinstance(exc, requests.exceptions.RetryError):
+        return THROTTLED
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return ERROR
+    return NEUTRAL
+
+
+class _Request:
+    """controller.request() 的上下文：进入时占一个在途名额，退出时按结果反馈
+
+    latency 默认取整个 with 块的耗时；流式读取时调用方应设为收到响应头的耗时，
+    retries 设为连接池重试次数。
+    """
+
+    __slots__ = ('controller', 'started', 'latency', 'retries', 'held')
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.latency = None
+        self.retries = 0
+
+    def __enter__(self):
+        # 记下占名额线程的嵌套计数：生成器可能在别的线程里被关闭，退出时不依赖当前线程
+        self.held = self.controller.held()
+        self.started = self.controller.acquire(self.held)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        latency = self.latency if self.latency is not None else time.monotonic() - self.started
+        self.controller.release(self.started, latency, classify(exc, self.retries), self.held)
+        return False
+
+
+class AdaptiveConcurrency:
+    """AIMD 在途请求上限 + 可选的全局限速，多个线程（和多个客户端）共用一个实例"""
+
+    def __init__(self, max_limit: int = 1, min_limit: int = 1, initial: Optional[float] = None,
+                 latency_target: float = DEFAULT_LATENCY_TARGET, max_rps: Optional[float] = None,
+                 backoff: float = DEFAULT_BACKOFF, slow_backoff: float = DEFAULT_SLOW_BACKOFF):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(initial if initial is not None else max(self.min_limit, self.max_limit // 2))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.slow_backoff = slow_backoff
+        self.bucket = TokenBucket(max_rps) if max_rps else None
+        self.max_rps = max_rps
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.stats = {'requests': 0, SLOW: 0, THROTTLED: 0, ERROR: 0, 'decreases': 0, 'peak_in_flight': 0,
+                      'queue_seconds': 0.0, 'rate_wait_seconds': 0.0}
+        # 按时间加权的上限，用于报告稳定在多少
+        self._weighted = 0.0
+        self._weighted_since = time.monotonic()
+        self._observed = 0.0
+        self._cond = threading.Condition()
+        # 每个线程占着的名额数（[n]），见 held()
+        self._held = threading.local()
+
+    def request(self) -> _Request:
+        return _Request(self)
+
+    def set_max(self, max_limit: int):
+        """并发度确定后（parallel × fan_out）调整上限；当前值超出时一并收回"""
+        with self._cond:
+            self._accumulate()
+            self.max_limit = max(max_limit, self.min_limit)
+            if self.limit > self.max_limit:
+                self.limit = float(self.max_limit)
+            elif not self.stats['decreases']:
+                # 还没遇到过拥塞：从新上限的一半起步
+                self.limit = max(self.limit, float(max(self.min_limit, self.max_limit // 2)))
+            self._cond.notify_all()
+
+    def _accumulate(self):
+        now = time.monotonic()
+        if self.in_flight:
+            self._weighted += self.limit * (now - self._weighted_since)
+            self._observed += now - self._weighted_since
+        self._weighted_since = now
+
+    def held(self) -> list:
+        """当前线程占着的名额数（[n]，可变，交给 release 原样传回）"""
+        held = getattr(self._held, 'count', None)
+        if held is None:
+            held = self._held.count = [0]
+        return held
+
+    def acquire(self, held: Optional[list] = None) -> float:
+        """等到有在途名额（再等令牌），返回开始时刻；held 为占名额线程的 held()，默认取当前线程的"""
+        queued = time.monotonic()
+        held = held if held is not None else self.held()
+        nested = held[0]
+        held[0] = nested + 1
+        with self._cond:
+            while not nested and self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self._accumulate()
+            self.in_flight += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.in_flight)
+            self.stats['queue_seconds'] += time.monotonic() - queued
+        if self.bucket is not None:
+            waited = self.bucket.acquire()
+            if waited:
+                with self._cond:
+                    self.stats['rate_wait_seconds'] += waited
+        return time.monotonic()
+
+    def reserve_rate(self) -> float:
+        """不占在途名额，只记一次请求并取全局限速的令牌，返回应等待的秒数（异步客户端用 asyncio.sleep 等）"""
+        waited = self.bucket.reserve() if self.bucket is not None else 0.0
+        with self._cond:
+            self.stats['requests'] += 1
+            self.stats['rate_wait_seconds'] += waited
+        return waited
+
+    def release(self, started: float, latency: float, outcome: str, held: Optional[list] = None):
+        """归还名额并按结果调整上限；held 为 acquire 时的计数，可以在别的线程里调用"""
+        if outcome == OK and self.latency_target and latency > self.latency_target:
+            outcome = SLOW
+        held = held if held is not None else self.held()
+        try:
+            with self._cond:
+                self._accumulate()
+                saturated = self.in_flight >= int(self.limit)
+                self.in_flight -= 1
+                self.stats['requests'] += 1
+                if outcome == OK:
+                    if saturated:
+                        self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+                elif outcome != NEUTRAL:
+                    self.stats[outcome] += 1
+                    if started >= self.last_decrease:
+                        factor = self.slow_backoff if outcome == SLOW else self.backoff
+                        self.limit = max(float(self.min_limit), self.limit * factor)
+                        self.last_decrease = time.monotonic()
+                        self.stats['decreases'] += 1
+                self._cond.notify_all()
+        finally:
+            held[0] = max(held[0] - 1, 0)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            self._accumulate()
+            average = self._weighted / self._observed if self._observed else self.limit
+            return {
+                'limit': round(self.limit, 2), 'average_limit': round(average, 2),
+                'max_limit': self.max_limit, 'max_rps': self.max_rps or 0,
+                **{key: round(value, 3) if isinstance(value, float) else value
+                   for key, value in self.stats.items()},
+            }
+
+    def summary(self) -> str:
+        s = self.snapshot()
+        text = (f"自适应并发: 当前 {int(s['limit'])} / 平均 {s['average_limit']:.1f}（上限 {s['max_limit']}，"
+                f"峰值在途 {s['peak_in_flight']}），{s['requests']} 次请求")
+        if s['decreases']:
+            text += f"，降速 {s['decreases']} 次（变慢 {s[SLOW]} / 限流 {s[THROTTLED]} / 连接错误 {s[ERROR]}）"
+        if s['max_rps']:
+            text += f"；限速 {s['max_rps']:g} 次/秒，累计等待 {s['rate_wait_seconds']:.1f} 秒"
+        return text
+
+
+def add_rate_arguments(parser):
+    """同步脚本共用的并发控制参数"""
+    parser.add_argument('--max-rps', type=float, metavar='N', help='全部查询共用的每秒请求数上限（默认不限）')
+    parser.add_argument('--latency-target', type=float, default=DEFAULT_LATENCY_TARGET, metavar='SECONDS',
+                        help=f'单次查询超过该耗时即收缩并发（默认 {DEFAULT_LATENCY_TARGET:g}，0 表示只看错误和限流）')
+
+
+def controller_from_args(args) -> AdaptiveConcurrency:
+    return AdaptiveConcurrency(latency_target=args.latency_target, max_rps=args.max_rps)
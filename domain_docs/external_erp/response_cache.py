@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+ExecuteBillQuery 原始响应的本地磁盘缓存
+
+按金蝶地址、账套和请求参数（表单、字段、过滤、排序、分页）生成键，每页响应 gzip 压缩存成一个文件。
+文件内记录写入时间，TTL 按写入时间判断，读取不会让条目“续命”；
+按总大小淘汰时最久未使用（文件 atime，命中时显式刷新）的先删。
+
+回放模式（replay）只读缓存、不访问网络，TTL 不生效，便于反复调试字段映射；
+未命中时由客户端报错，不能当作空页（否则全量批量装载会删掉本地数据）。
+注意水位和 FDate 窗口会改变 FilterString，回放时建议配合 --full 使用同一天录制的缓存。
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+DEFAULT_CACHE_DIR = '.kingdee_cache'
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ResponseCache:
+    """按页缓存查询结果"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: int = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, replay: bool = False):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def key(query_data: dict, scope: str = '') -> str:
+        """ExecuteBillQuery 的 data 参数 -> 缓存键
+
+        scope 区分金蝶地址和账套（如 "base_url|DBID"），不同账套的同一查询不会互相命中。
+        """
+        raw = json.dumps([scope, query_data], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def _entries(self):
+        """[(路径, 大小, 最近使用时间)]"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json.gz'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_atime))
+        return entries
+
+    def get(self, key: str) -> Optional[list]:
+        """命中返回行列表；未命中或已过期返回 None"""
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+            written_at, rows = entry['written_at'], entry['rows']
+        except (OSError, ValueError, TypeError, KeyError):
+            self.misses += 1
+            return None
+
+        now = time.time()
+        if not self.replay and self.ttl > 0 and now - written_at > self.ttl:
+            self._remove(path, stat.st_size)
+            self.misses += 1
+            return None
+
+        # 只刷新 atime（LRU 用），mtime 保持不变；不依赖文件系统的 atime 挂载选项
+        if not self.replay:
+            try:
+                os.utime(path, (now, stat.st_mtime))
+            except OSError:
+                pass
+        self.hits += 1
+        return rows
+
+    def put(self, key: str, rows: list):
+        if self.replay:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=5) as f:
+            json.dump({'written_at': time.time(), 'rows': rows}, f, ensure_ascii=False, separators=(',', ':'))
+        size = os.path.getsize(tmp_path)
+
+        with self._lock:
+            try:
+                self._total_bytes -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _remove(self, path: str, size: int):
+        with self._lock:
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except OSError:
+                pass
+
+    def _evict(self):
+        """删除最久未使用的文件，直到总大小降到上限的 90%（调用方持有锁）"""
+        target = self.max_bytes * 0.9
+        for path, size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except OSError:
+                pass
+
+    def summary(self) -> str:
+        return f"缓存命中 {self.hits} / 未命中 {self.misses}"
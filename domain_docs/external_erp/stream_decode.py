@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+ExecuteBillQuery 响应的流式解析
+
+response.json() 需要同时持有原始字节、解码后的文本和整页嵌套列表；
+这里边读响应体边解析，每次只产出一行（一个字段值数组），峰值内存与页大小无关。
+
+依赖可选的 ijson（pip install ijson）；未安装时 STREAMING_AVAILABLE 为 False，
+调用方回退到整页 response.json()。
+"""
+
+import io
+import json
+
+from kingdee_api import extract_rows, is_error_row
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover - 可选依赖
+    ijson = None
+
+
+STREAMING_AVAILABLE = ijson is not None
+
+# 每次从 socket 读取的字节数
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_response_rows(response):
+    """逐行 yield 查询结果
+
+    response 需以 stream=True 发出。顶层数组 [[...], [...]] 流式解析；
+    其他形态（{"Result": ...}，多为报错）整体解析。报错响应抛 KingdeeApiError。
+    """
+    raw = response.raw
+    raw.decode_content = True  # 透明解 gzip/deflate
+    raw.auto_close = False     # 读到末尾时不自动关闭，否则 BufferedReader 再读会报 closed file
+    reader = io.BufferedReader(raw, READ_CHUNK_SIZE)
+
+    head = reader.peek(64).lstrip()
+    if head[:1] != b'[':
+        yield from extract_rows(json.load(reader))
+        return
+
+    first = True
+    for row in ijson.items(reader, 'item', use_float=True, buf_size=READ_CHUNK_SIZE):
+        # 报错时首行是 [{"Result": {"ResponseStatus": ...}}]
+        if first and is_error_row(row):
+            extract_rows([row])
+        first = False
+        yield row
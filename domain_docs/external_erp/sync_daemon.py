@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+金蝶同步常驻进程：一次登录、一个连接池，按实体各自的周期增量同步
+
+- 每个实体有基准周期（库存 5 分钟、单据 10 分钟、主数据 1 小时），可用 --interval 覆盖
+- 自适应：按最近几次观察到的变化速率（新增 + 更新 + 删除 / 秒，指数平滑）调整周期，
+  使每次同步大约取到 --target-changes 行变化；没有变化时逐步放慢，周期限制在基准的 1/4 ~ 4 倍
+- 同一实体不会与自己重叠执行：上一次没结束前不会再次排队
+- 失败时按 30 秒起指数退避重试（不超过当前周期），失败记入 sync_log
+- 基础和增强实体由同一个客户端（DaemonClient）同步：一个会话、一次登录、一个连接池，
+  查询共用一个自适应并发控制（rate_control），--max-rps 限制全局每秒请求数
+- 共用一个名称缓存（dimension_cache）：物料、客户同步填入的名称直接供销售订单解析
+- SIGINT / SIGTERM：不再派发新任务，等正在执行的实体同步完成后退出；再按一次立即退出
+
+使用方法:
+python sync_daemon.py                                   # 所有实体，默认周期
+python sync_daemon.py --parallel 3 --fan-out 2
+python sync_daemon.py --only inventory --interval inventory=120
+python sync_daemon.py --no-adapt --metrics-file /var/lib/node_exporter/kingdee.prom
+"""
+
+import argparse
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from batch_writer import DEFAULT_BATCH_SIZE
+from dimension_cache import add_dimension_arguments, dimension_cache_from_args
+from form_metadata import add_metadata_arguments, metadata_from_args
+from mes_sink import add_sink_arguments, sink_from_args
+from pipeline import DEFAULT_DEPTH, add_pipeline_arguments
+from rate_control import add_rate_arguments, controller_from_args
+from response_cache import DEFAULT_CACHE_DIR
+from sync_kingdee import KingdeeSync
+from kingdee_client import KingdeeClient
+from sync_kingdee_enhanced import KingdeeEnhancedSync
+
+
+# 基准周期（秒）
+DEFAULT_CADENCE = {
+    'inventory': 300,
+    'manufacturing_orders': 600,
+    'purchase_orders': 600,
+    'sales_orders_enhanced': 600,
+    'bom': 1800,
+    'materials': 3600,
+    'customers': 3600,
+    'suppliers_enhanced': 3600,
+    'workcenters_enhanced': 3600,
+    'enhance': 3600,  # 回填派生字段
+}
+
+MIN_FACTOR = 0.25          # 周期下限 = 基准 * MIN_FACTOR
+MAX_FACTOR = 4.0           # 周期上限 = 基准 * MAX_FACTOR
+MIN_INTERVAL = 60          # 任何实体的周期都不短于 60 秒
+IDLE_BACKOFF = 1.5         # 没有变化时周期放大的倍数
+RATE_SMOOTHING = 0.5       # 变化速率的指数平滑系数
+DEFAULT_TARGET_CHANGES = 200
+FAILURE_BACKOFF = 30       # 失败后首次重试的等待秒数
+LOGIN_RETRY_CAP = 300
+
+
+def _stamp() -> str:
+    return datetime.now().strftime('%H:%M:%S')
+
+
+class EntitySchedule:
+    """一个实体的周期和自适应状态"""
+
+    def __init__(self, name: str, run, base_interval: float, adaptive: bool = True,
+                 target_changes: int = DEFAULT_TARGET_CHANGES):
+        self.name = name
+        self.run = run                      # () -> (条数或 None, 变化行数)
+        self.base_interval = base_interval
+        self.min_interval = max(base_interval * MIN_FACTOR, min(MIN_INTERVAL, base_interval))
+        self.max_interval = base_interval * MAX_FACTOR
+        self.interval = base_interval
+        self.adaptive = adaptive
+        self.target_changes = target_changes
+        self.rate = None                    # 平滑后的变化速率（行/秒）
+        self.next_run = 0.0
+        self.running = False
+        self.failures = 0
+        self.last_started = None            # 上次成功同步的开始时间（monotonic）
+
+    def succeeded(self, started: float, changed: int):
+        """按本次变化行数更新周期，返回下次执行时间"""
+        self.failures = 0
+        if self.adaptive and self.last_started is not None:
+            # 增量同步取到的是上次开始以来的变化
+            window = max(started - self.last_started, 1.0)
+            observed = changed / window
+            self.rate = observed if self.rate is None else (
+                RATE_SMOOTHING * observed + (1 - RATE_SMOOTHING) * self.rate
+            )
+            if self.rate > 0:
+                interval = self.target_changes / self.rate
+            else:
+                interval = self.interval * IDLE_BACKOFF
+            self.interval = min(max(interval, self.min_interval), self.max_interval)
+        self.last_started = started
+        self.next_run = started + self.interval
+        return self.next_run
+
+    def failed(self, finished: float):
+        self.failures += 1
+        delay = min(FAILURE_BACKOFF * 2 ** (self.failures - 1), self.interval)
+        self.next_run = finished + delay
+        return delay
+
+
+class DaemonClient(KingdeeSync, KingdeeEnhancedSync):
+    """同时提供 KingdeeSync 和 KingdeeEnhancedSync 全部实体的单个客户端（会话、写锁、并发控制和指标只有一份）"""
+
+    __init__ = KingdeeClient.__init__
+
+
+class SyncDaemon:
+    """常驻调度：所有实体经同一个 DaemonClient 同步"""
+
+    def __init__(self, parallel: int = 1, fan_out: int = 1, batch_size: int = DEFAULT_BATCH_SIZE,
+                 bulk_load: bool = False, metrics_file: str = None, sink=None, metadata=None,
+                 breakdowns: bool = False, limiter=None, lookups=None, pipeline_depth: int = DEFAULT_DEPTH):
+        self.parallel = max(parallel, 1)
+        self.metrics_file = metrics_file
+        self.sink = sink
+        self.client = DaemonClient(fan_out=fan_out, batch_size=batch_size, bulk_load=bulk_load, sink=sink,
+                                   metadata=metadata, breakdowns=breakdowns, limiter=limiter, lookups=lookups,
+                                   pipeline_depth=pipeline_depth)
+        self.limiter = self.client.limiter
+        self.limiter.set_max(self.parallel * self.client.fan_out)
+        self.client._mount_adapter(self.parallel * self.client.fan_out)
+        self.schedules = {}
+        self.stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def entity_tasks(self) -> dict:
+        """实体名 -> 同步函数"""
+        c = self.client
+        return {
+            'materials': c.sync_materials,
+            'customers': c.sync_customers,
+            'manufacturing_orders': c.sync_manufacturing_orders,
+            'inventory': c.sync_inventory,
+            'purchase_orders': c.sync_purchase_orders,
+            'bom': c.sync_bom,
+            'sales_orders_enhanced': c.sync_sales_orders_enhanced,
+            'suppliers_enhanced': c.sync_suppliers_enhanced,
+            'workcenters_enhanced': c.sync_workcenters_enhanced,
+            'enhance': lambda: c.enhance_existing_data() or 0,
+        }
+
+    def register(self, names=None, intervals: dict = None, adaptive: bool = True,
+                 target_changes: int = DEFAULT_TARGET_CHANGES):
+        tasks = self.entity_tasks()
+        intervals = intervals or {}
+        unknown = [name for name in list(names or ()) + list(intervals) if name not in tasks]
+        if unknown:
+            raise ValueError(f"未知实体: {', '.join(unknown)}（可选: {', '.join(tasks)}）")
+
+        for name in names or tasks:
+            self.schedules[name] = EntitySchedule(
+                name, self._runner(name, tasks[name]), intervals.get(name, DEFAULT_CADENCE[name]),
+                adaptive=adaptive and name != 'enhance', target_changes=target_changes,
+            )
+
+    def _runner(self, name: str, func):
+        def run():
+            # _run_entities 负责捕获异常并把失败写入 sync_log
+            _, count, _ = self.client._run_entities([(name, func)])[0]
+            metrics = self.client.metrics.get(name)
+            changed = metrics.counters['changed'] if metrics is not None and count is not None else 0
+            return count, changed
+        return run
+
+    def request_stop(self, signum=None, frame=None):
+        if self.stop_event.is_set():
+            print("\n⛔ 再次收到退出信号，立即退出")
+            os._exit(1)
+        print(f"\n🛑 [{_stamp()}] 收到退出信号，等待正在执行的同步完成...")
+        self.stop_event.set()
+        self._wake.set()
+
+    def _login(self) -> bool:
+        """登录一次，失败时退避重试直到成功或收到退出信号"""
+        delay = FAILURE_BACKOFF
+        while not self.stop_event.is_set():
+            if self.client.login():
+                return True
+            print(f"⚠️  [{_stamp()}] 登录失败，{delay} 秒后重试")
+            self.stop_event.wait(delay)
+            delay = min(delay * 2, LOGIN_RETRY_CAP)
+        return False
+
+    def _execute(self, schedule: EntitySchedule):
+        started = time.monotonic()
+        try:
+            count, changed = schedule.run()
+        except Exception as e:  # 记日志本身失败（如库被锁）也不能拖垮调度
+            print(f"❌ {schedule.name} 执行异常: {e}")
+            count, changed = None, 0
+        finished = time.monotonic()
+
+        with self._lock:
+            if count is None:
+                delay = schedule.failed(finished)
+                print(f"⏰ [{_stamp()}] {schedule.name} 失败（第 {schedule.failures} 次），{delay:.0f} 秒后重试")
+            else:
+                schedule.succeeded(started, changed)
+                rate = f"，速率 {schedule.rate * 60:.1f} 行/分" if schedule.rate is not None else ""
+                print(f"⏰ [{_stamp()}] {schedule.name} 完成（{finished - started:.1f} 秒，变化 {changed} 行{rate}），"
+                      f"下次间隔 {schedule.interval:.0f} 秒，查询并发 {int(self.limiter.limit)}")
+            schedule.running = False
+        if self.metrics_file:
+            try:
+                self.client.metrics.export(self.metrics_file)
+            except OSError as e:
+                print(f"⚠️  指标导出失败: {e}")
+        self._wake.set()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+
+        if not self._login():
+            return
+        # 启动时校验一次实体声明，不符直接退出，不必等到各实体的周期
+        names = [name for name in self.schedules if name != 'enhance']
+        if names and not self.client.check_metadata(names):
+            return
+
+        print("\n" + "=" * 60)
+        print(f"🕰️  同步守护进程启动（并发: {self.parallel}）")
+        for schedule in self.schedules.values():
+            mode = "自适应" if schedule.adaptive else "固定"
+            print(f"   {schedule.name:<24} 每 {schedule.base_interval:>5.0f} 秒（{mode}）")
+        print("=" * 60)
+
+        with ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix='kingdee-daemon') as pool:
+            while not self.stop_event.is_set():
+                now = time.monotonic()
+                with self._lock:
+                    due = [s for s in self.schedules.values() if not s.running and s.next_run <= now]
+                    for schedule in sorted(due, key=lambda s: s.next_run):
+                        schedule.running = True
+                        pool.submit(self._execute, schedule)
+                    waiting = [s.next_run for s in self.schedules.values() if not s.running]
+                timeout = max(min(waiting) - now, 0.0) if waiting else None
+                self._wake.wait(timeout)
+                self._wake.clear()
+            # 退出线程池时等待已派发的同步完成；尚未开始的直接取消
+            pool.shutdown(wait=True, cancel_futures=True)
+        self.client.close()
+        if self.sink is not None:
+            self.sink.close()
+
+        print(f"   {self.limiter.summary()}")
+        print(f"   {self.client.lookups.summary()}")
+        print(f"👋 [{_stamp()}] 同步守护进程已退出")
+
+
+def parse_intervals(values) -> dict:
+    intervals = {}
+    for item in values or ():
+        name, sep, seconds = item.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f"--interval 格式应为 实体=秒数: {item}")
+        intervals[name.strip()] = float(seconds)
+    return intervals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='金蝶同步常驻进程')
+    parser.add_argument('--only', action='append', metavar='ENTITY', help='只调度指定实体，可重复')
+    parser.add_argument('--interval', action='append', metavar='ENTITY=SECONDS', help='覆盖实体的基准周期，可重复')
+    parser.add_argument('--no-adapt', dest='adaptive', action='store_false', help='固定周期，不按变化速率调整')
+    parser.add_argument('--target-changes', type=int, default=DEFAULT_TARGET_CHANGES, metavar='N',
+                        help=f'自适应时每次同步期望取到的变化行数（默认 {DEFAULT_TARGET_CHANGES}）')
+    parser.add_argument('--parallel', type=int, default=1, metavar='N', help='同时执行的实体数（默认 1）')
+    parser.add_argument('--fan-out', type=int, default=1, metavar='N', help='单个表单并发拉取的页数（默认 1，逐页）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, metavar='N', help=f'每批写入行数（默认 {DEFAULT_BATCH_SIZE}）')
+    parser.add_argument('--bulk-load', action='store_true', help='批量装载：先写暂存表再一次性合并')
+    parser.add_argument('--inventory-by-warehouse', dest='breakdowns', action='store_true',
+                        help='库存同时按仓库汇总写入 inventory_by_warehouse')
+    parser.add_argument('--metrics-file', metavar='FILE', help='每次同步后导出指标（.prom 为 Prometheus textfile，否则 JSON）')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'元数据缓存目录（默认 {DEFAULT_CACHE_DIR}）')
+    add_sink_arguments(parser)
+    add_metadata_arguments(parser)
+    add_rate_arguments(parser)
+    add_dimension_arguments(parser)
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        intervals = parse_intervals(args.interval)
+        daemon = SyncDaemon(parallel=args.parallel, fan_out=args.fan_out, batch_size=args.batch_size,
+                            bulk_load=args.bulk_load, metrics_file=args.metrics_file, sink=sink_from_args(args),
+                            metadata=metadata_from_args(args), breakdowns=args.breakdowns,
+                            limiter=controller_from_args(args), lookups=dimension_cache_from_args(args),
+                            pipeline_depth=args.pipeline_depth)
+        daemon.register(args.only, intervals, args.adaptive, args.target_changes)
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        parser.error(str(e))
+    daemon.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,300 +6,105 @@
 python sync_kingdee.py --all          # 同步所有数据
 python sync_kingdee.py --mo           # 只同步工单
 python sync_kingdee.py --material     # 只同步物料
+python sync_kingdee.py --all --parallel 3 --fan-out 4   # 3 个实体并发，每个表单 4 页并发拉取
+python sync_kingdee.py --all --full   # 忽略增量水位，全量同步
+python sync_kingdee.py --all --resume # 从上次中断的断点继续（已完成的实体跳过）
+python sync_kingdee.py --all --parallel 3 --fan-out 4 --max-rps 5   # 白天：最多每秒 5 次查询
 """
 
-import requests
-import json
+import time
 import argparse
-from datetime import datetime, timedelta
-from config_sso import BASE_URL, DBID, USERNAME, APPID, APP_SECRET, LCID
-from database import (
-    init_db, upsert_material, upsert_customer, upsert_mo, 
-    upsert_inventory, upsert_po, upsert_bom, log_sync
-)
+from database import init_db
+from batch_writer import DEFAULT_BATCH_SIZE
+from bom_explosion import refresh_bom_explosion
+from dimension_cache import add_dimension_arguments, dimension_cache_from_args
+from form_metadata import add_metadata_arguments, metadata_from_args
+from kingdee_client import KingdeeClient
+from mes_sink import add_sink_arguments, sink_from_args
+from pipeline import add_pipeline_arguments
+from rate_control import add_rate_arguments, controller_from_args
+from response_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DEFAULT_TTL, ResponseCache
 
 
-class KingdeeSync:
-    """金蝶云数据同步"""
+class KingdeeSync(KingdeeClient):
+    """金蝶云数据同步（会话、查询和执行框架见 kingdee_client.KingdeeClient）"""
     
-    def __init__(self):
-        self.session = requests.Session()
-        self.base_url = BASE_URL
-        self.is_logged_in = False
-    
-    def login(self) -> bool:
-        """WebAPI 登录"""
-        if self.is_logged_in:
-            return True
-        
-        login_url = f"{self.base_url}/Kingdee.BOS.WebApi.ServicesStub.AuthService.LoginByAppSecret.common.kdsvc"
-        
-        login_body = {
-            "format": 1,
-            "useragent": "ApiClient",
-            "rid": "1",
-            "parameters": json.dumps([DBID, USERNAME, APPID, APP_SECRET, LCID]),
-            "timestamp": "0",
-            "v": "1.0"
-        }
-        
-        headers = {"Content-Type": "application/json"}
-        
-        try:
-            response = self.session.post(login_url, headers=headers, data=json.dumps(login_body), timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            if result.get("LoginResultType") == 1:
-                self.is_logged_in = True
-                print(f"✅ 登录成功 - 用户: {result.get('Context', {}).get('UserName')}")
-                return True
-            else:
-                print(f"❌ 登录失败: {result.get('Message', '未知错误')}")
-                return False
-        except Exception as e:
-            print(f"❌ 登录异常: {e}")
-            return False
-    
-    def query_entity(self, form_id: str, field_keys: str, filter_string: str = "", limit: int = 100) -> list:
-        """查询实体数据"""
-        query_url = f"{self.base_url}/Kingdee.BOS.WebApi.ServicesStub.DynamicFormService.ExecuteBillQuery.common.kdsvc"
-        
-        payload = {
-            "data": {
-                "FormId": form_id,
-                "FieldKeys": field_keys,
-                "FilterString": filter_string,
-                "OrderString": "",
-                "TopRowCount": 0,
-                "StartRow": 0,
-                "Limit": limit,
-                "SubSystemId": ""
-            }
-        }
-        
-        headers = {"Content-Type": "application/json"}
-        
-        try:
-            response = self.session.post(query_url, headers=headers, data=json.dumps(payload), timeout=60)
-            response.raise_for_status()
-            
-            result = response.json()
-            
-            if isinstance(result, list):
-                return result
-            elif isinstance(result, dict) and "Result" in result:
-                return result["Result"]
-            else:
-                return []
-        except Exception as e:
-            print(f"❌ 查询失败 ({form_id}): {e}")
-            return []
-    
-    def sync_materials(self, limit: int = 500):
+    def sync_materials(self, page_size: int = 500):
         """同步物料主数据"""
-        print("\n📦 开始同步物料主数据...")
-        
-        field_keys = "FNumber,FName,FCategoryID.FName,FBaseUnitId.FName"
-        
-        rows = self.query_entity("BD_Material", field_keys, limit=limit)
-        
-        count = 0
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 4:
-                continue
-            
-            material = {
-                'material_id': row[0] or f"MAT_{count}",
-                'material_name': row[1] or '未知物料',
-                'category': row[2] or '未分类',
-                'unit': row[3] or 'PCS'
-            }
-            
-            upsert_material(material)
-            count += 1
-        
-        log_sync('materials', count, 'success')
-        print(f"✅ 物料同步完成: {count} 条")
-        return count
+        return self._sync_spec('materials', page_size)
     
-    def sync_customers(self, limit: int = 200):
+    def sync_customers(self, page_size: int = 500):
         """同步客户主数据"""
-        print("\n👥 开始同步客户主数据...")
-        
-        field_keys = "FNumber,FName"
-        
-        rows = self.query_entity("BD_Customer", field_keys, limit=limit)
-        
-        count = 0
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 2:
-                continue
-            
-            customer = {
-                'customer_id': row[0] or f"CUST_{count}",
-                'customer_name': row[1] or '未知客户',
-                'tier': 'Tier 2'  # 默认
-            }
-            
-            upsert_customer(customer)
-            count += 1
-        
-        log_sync('customers', count, 'success')
-        print(f"✅ 客户同步完成: {count} 条")
-        return count
+        return self._sync_spec('customers', page_size)
     
-    def sync_manufacturing_orders(self, limit: int = 100):
-        """同步工单"""
-        print("\n🏭 开始同步工单...")
-        
-        # 最近 3 个月的工单
-        three_months_ago = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
-        filter_string = f"FDate >= '{three_months_ago}'"
-        
-        field_keys = "FBillNo,FSrcBillNo,FMaterialId.FNumber,FMaterialId.FName,FQty,FPlanFinishDate,FDocumentStatus"
-        
-        rows = self.query_entity("PRD_MO", field_keys, filter_string, limit)
-        
-        count = 0
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 7:
-                continue
-            
-            # 解析单据状态
-            status_map = {'A': 'Plan', 'B': 'Released', 'C': 'InProgress', 'D': 'Completed', 'Z': 'Closed'}
-            status = status_map.get(row[6], 'Plan')
-            
-            # 从物料编号中获取（如果有的话）
-            material_id = row[2] or ''
-            
-            mo = {
-                'mo_no': row[0],
-                'so_no': row[1] or '',
-                'material_id': material_id,
-                'customer_id': '',  # 需要从销售订单关联
-                'qty_plan': float(row[4]) if row[4] else 0,
-                'status': status,
-                'promise_date': row[5] or ''
-            }
-            
-            upsert_mo(mo)
-            count += 1
-        
-        log_sync('manufacturing_orders', count, 'success')
-        print(f"✅ 工单同步完成: {count} 条")
-        return count
+    def sync_manufacturing_orders(self, page_size: int = 500):
+        """同步工单（最近 3 个月，有水位时只取其后修改过的）"""
+        return self._sync_spec('manufacturing_orders', page_size)
     
-    def sync_inventory(self, limit: int = 500):
-        """同步库存"""
-        print("\n📊 开始同步库存...")
-        
-        field_keys = "FMaterialId.FNumber,FBaseQty"
-        
-        rows = self.query_entity("STK_Inventory", field_keys, limit=limit)
-        
-        count = 0
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 2:
-                continue
-            
-            material_id = row[0] or ''
-            qty = float(row[1]) if row[1] else 0
-            
-            if material_id:
-                upsert_inventory(material_id, qty)
-                count += 1
-        
-        log_sync('inventory', count, 'success')
-        print(f"✅ 库存同步完成: {count} 条")
-        return count
+    def sync_inventory(self, page_size: int = 500):
+        """同步库存（各仓库/仓位/批次按物料合计，每个物料写一行）"""
+        return self._sync_spec('inventory', page_size)
     
-    def sync_purchase_orders(self, limit: int = 200):
-        """同步采购订单"""
-        print("\n🛒 开始同步采购订单...")
-        
-        # 最近 3 个月且未完成的采购订单
-        three_months_ago = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
-        filter_string = f"FDate >= '{three_months_ago}'"
-        
-        field_keys = "FBillNo,FMaterialId.FNumber,FQty,FDeliveryDate,FConfirmDate"
-        
-        rows = self.query_entity("PUR_PurchaseOrder", field_keys, filter_string, limit)
-        
-        count = 0
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 5:
-                continue
-            
-            po = {
-                'po_no': row[0],
-                'po_line_no': 1,
-                'material_id': row[1] or '',
-                'qty_ordered': float(row[2]) if row[2] else 0,
-                'qty_remaining': float(row[2]) if row[2] else 0,
-                'promised_date': row[3] or '',
-                'is_confirmed': 1 if row[4] else 0
-            }
-            
-            upsert_po(po)
-            count += 1
-        
-        log_sync('purchase_orders', count, 'success')
-        print(f"✅ 采购订单同步完成: {count} 条")
-        return count
+    def sync_purchase_orders(self, page_size: int = 500):
+        """同步采购订单（最近 3 个月，有水位时只取其后修改过的）"""
+        return self._sync_spec('purchase_orders', page_size)
     
-    def sync_bom(self, limit: int = 1000):
-        """同步 BOM"""
-        print("\n🔧 开始同步 BOM...")
-        
-        field_keys = "FMaterialId.FNumber,FChildMaterialId.FNumber,FBOMChildQty"
-        
-        rows = self.query_entity("PRD_PPBOM", field_keys, limit=limit)
-        
-        count = 0
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 3:
-                continue
-            
-            parent_id = row[0] or ''
-            child_id = row[1] or ''
-            qty = float(row[2]) if row[2] else 1.0
-            
-            if parent_id and child_id:
-                upsert_bom(parent_id, child_id, qty)
-                count += 1
-        
-        log_sync('bom', count, 'success')
-        print(f"✅ BOM 同步完成: {count} 条")
+    def sync_bom(self, page_size: int = 1000):
+        """同步 BOM，并增量刷新多层展开表（只重新展开边有变化的父项及其上层）"""
+        count = self._sync_spec('bom', page_size)
+        with self.db_lock:
+            result = refresh_bom_explosion(db_path=self.db_path)
+        if result['roots']:
+            print(f"   🌲 多层展开: 重新展开 {result['roots']} 个父项，{result['rows']} 行")
         return count
     
-    def sync_all(self):
-        """同步所有数据"""
+    def sync_all(self, parallel: int = 1):
+        """同步所有数据，返回 [(实体, 条数, 耗时秒)]；登录或元数据校验失败时返回 None"""
         if not self.login():
             print("❌ 登录失败，无法同步")
             return
         
+        tasks = [
+            ('materials', self.sync_materials),
+            ('customers', self.sync_customers),
+            ('manufacturing_orders', self.sync_manufacturing_orders),
+            ('inventory', self.sync_inventory),
+            ('purchase_orders', self.sync_purchase_orders),
+            ('bom', self.sync_bom),
+        ]
+        if not self.check_metadata([name for name, _ in tasks]):
+            return
+        self.start_run([name for name, _ in tasks])
+        
         print("\n" + "="*60)
-        print("🚀 开始全量数据同步")
+        print(f"🚀 开始全量数据同步（并发: {max(parallel, 1)}）")
         print("="*60)
         
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
-        total = 0
-        total += self.sync_materials()
-        total += self.sync_customers()
-        total += self.sync_manufacturing_orders()
-        total += self.sync_inventory()
-        total += self.sync_purchase_orders()
-        total += self.sync_bom()
+        results = self._run_entities(tasks, parallel)
+        total = sum(count or 0 for _, count, _ in results)
         
-        duration = (datetime.now() - start_time).seconds
+        duration = time.perf_counter() - start_time
         
         print("\n" + "="*60)
-        print(f"✅ 同步完成！")
+        print("✅ 同步完成！")
+        for name, count, elapsed in results:
+            status = f"{count} 条" if count is not None else "失败"
+            print(f"   {name:<22} {status:>10}  {elapsed:.2f} 秒")
+            metrics = self.metrics.get(name)
+            if metrics is not None:
+                print(f"   {'':<22} ⏱️  {metrics.summary()}")
         print(f"   总记录数: {total}")
-        print(f"   耗时: {duration} 秒")
+        print(f"   耗时: {duration:.2f} 秒")
+        if self.cache is not None:
+            print(f"   {self.cache.summary()}")
+        if self.sink is not None:
+            print(f"   {self.sink.summary()}")
+        print(f"   {self.limiter.summary()}")
+        print(f"   {self.lookups.summary()}")
         print("="*60)
+        return results
 
 
 def main():
@@ -309,9 +114,29 @@ def main():
     parser.add_argument('--customer', action='store_true', help='同步客户')
     parser.add_argument('--mo', action='store_true', help='同步工单')
     parser.add_argument('--inventory', action='store_true', help='同步库存')
+    parser.add_argument('--inventory-by-warehouse', dest='breakdowns', action='store_true',
+                        help='库存同时按仓库汇总写入 inventory_by_warehouse')
     parser.add_argument('--po', action='store_true', help='同步采购订单')
     parser.add_argument('--bom', action='store_true', help='同步 BOM')
     parser.add_argument('--init-db', action='store_true', help='初始化数据库')
+    parser.add_argument('--parallel', type=int, default=1, metavar='N', help='并发同步的实体数（默认 1，串行）')
+    parser.add_argument('--fan-out', type=int, default=1, metavar='N', help='单个表单并发拉取的页数（默认 1，逐页）')
+    parser.add_argument('--full', action='store_true', help='忽略增量水位，全量同步')
+    parser.add_argument('--resume', action='store_true', help='从上次中断的运行的断点继续，已完成的实体跳过')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='用异步客户端拉取（需要 aiohttp）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, metavar='N', help=f'每批写入行数（默认 {DEFAULT_BATCH_SIZE}）')
+    parser.add_argument('--bulk-load', action='store_true', help='批量装载：先写暂存表再一次性合并（配合 --full 时删除已消失的行）')
+    parser.add_argument('--cache', action='store_true', help='缓存查询响应到本地磁盘')
+    parser.add_argument('--replay', action='store_true', help='只从本地缓存回放，不访问金蝶（建议配合 --full）')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'缓存目录（默认 {DEFAULT_CACHE_DIR}）')
+    parser.add_argument('--cache-ttl', type=int, default=DEFAULT_TTL, metavar='SECONDS', help='缓存有效期，0 表示不过期')
+    parser.add_argument('--metrics-file', metavar='FILE', help='导出本次运行的分阶段指标（.prom 为 Prometheus textfile，否则 JSON）')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), metavar='MB', help='缓存总大小上限')
+    add_sink_arguments(parser)
+    add_metadata_arguments(parser)
+    add_rate_arguments(parser)
+    add_dimension_arguments(parser)
+    add_pipeline_arguments(parser)
     
     args = parser.parse_args()
     
@@ -321,27 +146,48 @@ def main():
         init_db()
         print("✅ 数据库初始化完成\n")
     
-    syncer = KingdeeSync()
+    cache = None
+    if args.cache or args.replay:
+        cache = ResponseCache(args.cache_dir, args.cache_ttl, args.cache_max_mb * 1024 * 1024, replay=args.replay)
     
-    if args.all or (not any([args.material, args.customer, args.mo, args.inventory, args.po, args.bom])):
-        syncer.sync_all()
-    else:
-        if not syncer.login():
-            print("❌ 登录失败")
-            return
-        
-        if args.material:
-            syncer.sync_materials()
-        if args.customer:
-            syncer.sync_customers()
-        if args.mo:
-            syncer.sync_manufacturing_orders()
-        if args.inventory:
-            syncer.sync_inventory()
-        if args.po:
-            syncer.sync_purchase_orders()
-        if args.bom:
-            syncer.sync_bom()
+    sink = sink_from_args(args)
+    syncer = KingdeeSync(fan_out=args.fan_out, full=args.full, batch_size=args.batch_size, cache=cache,
+                         use_async=args.use_async, bulk_load=args.bulk_load, sink=sink,
+                         metadata=metadata_from_args(args), breakdowns=args.breakdowns, resume=args.resume,
+                         limiter=controller_from_args(args), lookups=dimension_cache_from_args(args),
+                         pipeline_depth=args.pipeline_depth)
+    
+    # 登录失败、校验失败或某个实体失败时也要关闭 MES 推送并导出指标
+    try:
+        if args.all or (not any([args.material, args.customer, args.mo, args.inventory, args.po, args.bom])):
+            syncer.sync_all(parallel=args.parallel)
+        else:
+            if not syncer.login():
+                print("❌ 登录失败")
+                return
+            
+            # 单独选择的实体同样经 _run_entities 执行：异常记为失败写入 sync_log，不中断其余实体
+            tasks = [(name, func) for name, func, flag in (
+                ('materials', syncer.sync_materials, args.material),
+                ('customers', syncer.sync_customers, args.customer),
+                ('manufacturing_orders', syncer.sync_manufacturing_orders, args.mo),
+                ('inventory', syncer.sync_inventory, args.inventory),
+                ('purchase_orders', syncer.sync_purchase_orders, args.po),
+                ('bom', syncer.sync_bom, args.bom),
+            ) if flag]
+            selected = [name for name, _ in tasks]
+            if not syncer.check_metadata(selected):
+                return
+            syncer.start_run(selected)
+            syncer._run_entities(tasks, args.parallel)
+    finally:
+        syncer.close()
+        if sink is not None:
+            sink.close()
+        
+        if args.metrics_file:
+            syncer.metrics.export(args.metrics_file)
+            print(f"📈 指标已导出: {args.metrics_file}")
 
 
 if __name__ == '__main__':
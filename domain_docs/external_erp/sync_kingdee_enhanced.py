@@ -6,163 +6,51 @@
 
 import sys
 import io
-import requests
-import json
+import time
 import argparse
-from datetime import datetime, timedelta
-from config_sso import BASE_URL, DBID, USERNAME, APPID, APP_SECRET, LCID
-from database import (
-    init_db, upsert_material, upsert_customer, upsert_mo, 
-    upsert_inventory, upsert_po, upsert_bom, log_sync, get_db
-)
+from account_sets import AccountSet
+from batch_writer import DEFAULT_BATCH_SIZE, DERIVED_COLUMNS, TABLE_SCHEMAS
+from dimension_cache import DimensionCache, add_dimension_arguments, dimension_cache_from_args
+from form_metadata import MetadataCache, add_metadata_arguments, metadata_from_args
+from kingdee_client import KingdeeClient
+from mes_sink import MesSink, add_sink_arguments, sink_from_args
+from pipeline import DEFAULT_DEPTH, add_pipeline_arguments
+from rate_control import AdaptiveConcurrency, add_rate_arguments, controller_from_args
+from response_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DEFAULT_TTL, ResponseCache
+from sync_state import connect
 
-# 设置UTF-8输出
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
 
-
-class KingdeeEnhancedSync:
-    """金蝶云增强同步 - 获取完整字段"""
-    
-    def __init__(self):
-        self.session = requests.Session()
-        self.base_url = BASE_URL
-        self.is_logged_in = False
+class KingdeeEnhancedSync(KingdeeClient):
+    """金蝶云增强同步 - 获取完整字段（会话、查询和执行框架见 kingdee_client.KingdeeClient）"""
     
-    def login(self) -> bool:
-        """WebAPI 登录"""
-        if self.is_logged_in:
-            return True
-        
-        login_url = f"{self.base_url}/Kingdee.BOS.WebApi.ServicesStub.AuthService.LoginByAppSecret.common.kdsvc"
-        
-        login_body = {
-            "format": 1,
-            "useragent": "ApiClient",
-            "rid": "1",
-            "parameters": json.dumps([DBID, USERNAME, APPID, APP_SECRET, LCID]),
-            "timestamp": "0",
-            "v": "1.0"
-        }
-        
-        headers = {"Content-Type": "application/json"}
-        
-        try:
-            response = self.session.post(login_url, headers=headers, data=json.dumps(login_body), timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            if result.get("LoginResultType") == 1:
-                self.is_logged_in = True
-                print(f"✅ 登录成功 - 用户: {result.get('Context', {}).get('UserName')}")
-                return True
-            else:
-                print(f"❌ 登录失败: {result.get('Message', '未知错误')}")
-                return False
-        except Exception as e:
-            print(f"❌ 登录异常: {e}")
-            return False
+    def __init__(self, full: bool = False, batch_size: int = DEFAULT_BATCH_SIZE,
+                 cache: ResponseCache = None, bulk_load: bool = False, sink: MesSink = None,
+                 metadata: MetadataCache = None, resume: bool = False, limiter: AdaptiveConcurrency = None,
+                 lookups: DimensionCache = None, pipeline_depth: int = DEFAULT_DEPTH, account: AccountSet = None,
+                 db_path: str = None):
+        super().__init__(full=full, batch_size=batch_size, cache=cache, bulk_load=bulk_load, sink=sink,
+                         metadata=metadata, resume=resume, limiter=limiter, lookups=lookups,
+                         pipeline_depth=pipeline_depth, account=account, db_path=db_path)
     
-    def query_entity_enhanced(self, form_id: str, field_keys: str, filter_string: str = "", limit: int = 200) -> list:
-        """增强查询 - 获取更多字段"""
-        query_url = f"{self.base_url}/Kingdee.BOS.WebApi.ServicesStub.DynamicFormService.ExecuteBillQuery.common.kdsvc"
-        
-        payload = {
-            "data": {
-                "FormId": form_id,
-                "FieldKeys": field_keys,
-                "FilterString": filter_string,
-                "OrderString": "",
-                "TopRowCount": 0,
-                "StartRow": 0,
-                "Limit": limit,
-                "SubSystemId": ""
-            }
-        }
-        
-        headers = {"Content-Type": "application/json"}
-        
-        try:
-            response = self.session.post(query_url, headers=headers, data=json.dumps(payload), timeout=60)
-            response.raise_for_status()
-            
-            result = response.json()
-            
-            if isinstance(result, list):
-                return result
-            elif isinstance(result, dict) and "Result" in result:
-                return result["Result"]
-            else:
-                return []
-        except Exception as e:
-            print(f"❌ 查询失败 ({form_id}): {e}")
-            return []
+    # 保留原有的方法名
+    query_entity_enhanced = KingdeeClient.query_entity
+    iter_entity_enhanced = KingdeeClient.iter_entity
     
-    def sync_sales_orders_enhanced(self, limit: int = 2000):
-        """同步销售订单 - 完整版（含成本、毛利）- 支持多行订单"""
-        print("\n💰 同步销售订单（增强版）...")
+    def sync_sales_orders_enhanced(self, page_size: int = 2000):
+        """同步销售订单 - 完整版（含成本、毛利）- 支持多行订单
         
-        three_months_ago = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
-        filter_string = f"FDate >= '{three_months_ago}'"
-        
-        # 完整字段列表
-        field_keys = "FBillNo,FDate,FCustId.FNumber,FCustId.FName,FMaterialId.FNumber,FMaterialId.FName,FQty,FPrice,FAmount,FDeliveryDate,FDocumentStatus"
-        
-        rows = self.query_entity_enhanced("SAL_SaleOrder", field_keys, filter_string, limit)
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        count = 0
-        
-        # 跟踪每个订单的行号
+        行号取金蝶分录内码（FSaleOrderEntry_FEntryID），不随返回顺序变化；
+        金蝶已删除的分录按单据比对后删除（见 entity_specs.sync_entity）。
+        """
+        # 统计每个订单的分录数
         order_line_counters = {}
         
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 11:
-                continue
-            
-            try:
-                so_no = row[0]
-                
-                # 为每个订单自动递增行号
-                if so_no not in order_line_counters:
-                    order_line_counters[so_no] = 1
-                else:
-                    order_line_counters[so_no] += 1
-                
-                line_no = order_line_counters[so_no]
-                
-                # 解析单据状态
-                status_map = {'A': 'Plan', 'B': 'Released', 'C': 'InProgress', 'D': 'Completed', 'Z': 'Closed'}
-                status = status_map.get(row[10], 'Plan')
-                
-                # 插入销售订单
-                cursor.execute('''
-                    REPLACE INTO sales_orders (
-                        so_no, so_line_no, customer_id, customer_name, 
-                        material_id, material_name, qty_ordered, qty_remaining,
-                        unit_price, revenue, promise_date, updated_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    so_no,  # so_no
-                    line_no,  # so_line_no - 自动递增
-                    row[2] or '',  # customer_id
-                    row[3] or '',  # customer_name
-                    row[4] or '',  # material_id
-                    row[5] or '',  # material_name
-                    float(row[6]) if row[6] else 0,  # qty_ordered
-                    float(row[6]) if row[6] else 0,  # qty_remaining
-                    float(row[7]) if row[7] else 0,  # unit_price
-                    float(row[8]) if row[8] else 0,  # revenue
-                    row[9] or '',  # promise_date
-                    datetime.now()
-                ))
-                count += 1
-            except Exception as e:
-                print(f"  ⚠️  处理行失败: {e}")
-                continue
+        def count_lines(values):
+            so_no = values[0]
+            order_line_counters[so_no] = order_line_counters.get(so_no, 0) + 1
+            return values
         
-        conn.commit()
-        conn.close()
+        count = self._sync_spec('sales_orders_enhanced', page_size, count_lines)
         
         # 统计多行订单
         multi_line_orders = {k: v for k, v in order_line_counters.items() if v > 1}
@@ -172,220 +60,181 @@ class KingdeeEnhancedSync:
                 print(f"    - {so_no}: {line_count} 行")
             if len(multi_line_orders) > 5:
                 print(f"    ... 还有 {len(multi_line_orders) - 5} 个")
-        
-        log_sync('sales_orders_enhanced', count, 'success')
-        print(f"✅ 销售订单同步完成: {count} 条（{len(order_line_counters)} 个订单）")
+        print(f"   （{len(order_line_counters)} 个订单）")
         return count
     
-    def sync_suppliers_enhanced(self, limit: int = 100):
+    def sync_suppliers_enhanced(self, page_size: int = 500):
         """同步供应商 - 完整版"""
-        print("\n🏢 同步供应商（增强版）...")
-        
-        field_keys = "FNumber,FName"
-        
-        rows = self.query_entity_enhanced("BD_Supplier", field_keys, "", limit)
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        count = 0
-        
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 2:
-                continue
-            
-            try:
-                cursor.execute('''
-                    REPLACE INTO suppliers (
-                        supplier_id, supplier_name, lead_time_days, 
-                        otd_rate_3m, otd_rate_12m, expedite_premium,
-                        updated_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    row[0] or f"SUP_{count}",
-                    row[1] or '未知供应商',
-                    30,  # 默认提前期
-                    0.95,  # 默认 OTD
-                    0.95,
-                    0.15,  # 默认加急溢价 15%
-                    datetime.now()
-                ))
-                count += 1
-            except Exception as e:
-                print(f"  ⚠️  处理行失败: {e}")
-                continue
-        
-        conn.commit()
-        conn.close()
-        
-        log_sync('suppliers_enhanced', count, 'success')
-        print(f"✅ 供应商同步完成: {count} 条")
-        return count
+        return self._sync_spec('suppliers_enhanced', page_size)
     
-    def sync_workcenters_enhanced(self, limit: int = 50):
+    def sync_workcenters_enhanced(self, page_size: int = 500):
         """同步工作中心 - 完整版"""
-        print("\n🏭 同步工作中心（增强版）...")
-        
-        # 金蝶可能使用 BD_WorkCenter 或 PRD_WorkCenter
-        field_keys = "FNumber,FName"
-        
-        rows = self.query_entity_enhanced("BD_WorkCenter", field_keys, "", limit)
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        count = 0
-        
-        for row in rows:
-            if not isinstance(row, list) or len(row) < 2:
-                continue
-            
-            try:
-                cursor.execute('''
-                    REPLACE INTO workcenters (
-                        workcenter_id, workcenter_name, workcenter_type,
-                        daily_capacity_hours, shift_count, oee_avg, rty_avg,
-                        updated_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    row[0] or f"WC_{count}",
-                    row[1] or '未知工作中心',
-                    'General',  # 默认类型
-                    160,  # 默认产能（2班制*8小时*10人）
-                    2,  # 默认2班制
-                    0.85,  # 默认 OEE
-                    0.92,  # 默认 RTY
-                    datetime.now()
-                ))
-                count += 1
-            except Exception as e:
-                print(f"  ⚠️  处理行失败: {e}")
-                continue
-        
-        conn.commit()
-        conn.close()
-        
-        log_sync('workcenters_enhanced', count, 'success')
-        print(f"✅ 工作中心同步完成: {count} 条")
-        return count
+        return self._sync_spec('workcenters_enhanced', page_size)
     
     def enhance_existing_data(self):
-        """增强现有数据 - 补充新字段"""
-        print("\n🔄 增强现有数据...")
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # 1. 从采购订单中提取供应商信息并填充到 purchase_orders
-        print("  📝 更新采购订单的供应商信息...")
-        # 这里暂时设置默认值，实际应该从金蝶重新查询
-        cursor.execute('''
-            UPDATE purchase_orders 
-            SET supplier_id = 'DEFAULT_SUPPLIER',
-                supplier_name = '默认供应商',
-                unit_price = CASE WHEN qty_ordered > 0 THEN amount / qty_ordered ELSE 0 END,
-                is_confirmed = 1
-            WHERE supplier_id IS NULL OR supplier_id = ''
-        ''')
-        updated = cursor.rowcount
-        print(f"    ✅ 更新了 {updated} 条采购订单")
+        """增强现有数据 - 回填派生字段
         
-        # 2. 计算库存的可用数量
-        print("  📊 更新库存可用数量...")
-        cursor.execute('''
-            UPDATE inventory 
-            SET qty_available = qty_on_hand - COALESCE(qty_allocated, 0)
-            WHERE qty_available IS NULL OR qty_available = 0
-        ''')
-        updated = cursor.rowcount
-        print(f"    ✅ 更新了 {updated} 条库存")
-        
-        # 3. 设置客户权重（根据 tier）
-        print("  👥 更新客户权重...")
-        cursor.execute('''
-            UPDATE customers 
-            SET tier_weight = CASE 
-                WHEN tier = 'Tier 1' THEN 1.5
-                WHEN tier = 'Tier 2' THEN 1.2
-                ELSE 1.0
-            END
-            WHERE tier_weight IS NULL OR tier_weight = 0
-        ''')
-        updated = cursor.rowcount
-        print(f"    ✅ 更新了 {updated} 个客户")
+        同步写入时已在批内按主键重算变化行的派生列（batch_writer.DERIVED_COLUMNS），
+        这里只回填仍缺派生值的历史行；回填条件建有部分索引，只扫描命中的行，不再全表扫描。
+        """
+        print("\n🔄 增强现有数据...")
         
-        # 4. 设置物料提前期（默认值）
-        print("  📦 更新物料提前期...")
-        cursor.execute('''
-            UPDATE materials 
-            SET lead_time_days = 30
-            WHERE lead_time_days IS NULL OR lead_time_days = 0
-        ''')
-        updated = cursor.rowcount
-        print(f"    ✅ 更新了 {updated} 个物料")
+        labels = {
+            'purchase_orders': ('📝', '采购订单的供应商信息', '条采购订单'),
+            'inventory': ('📊', '库存可用数量', '条库存'),
+            'customers': ('👥', '客户权重', '个客户'),
+            'materials': ('📦', '物料提前期', '个物料'),
+        }
         
-        conn.commit()
-        conn.close()
+        with self.db_lock:
+            conn = connect(self.db_path)
+            try:
+                cursor = conn.cursor()
+                for table, derived in DERIVED_COLUMNS.items():
+                    icon, label, unit = labels[table]
+                    print(f"  {icon} 更新{label}...")
+                    key_columns, _ = TABLE_SCHEMAS[table]
+                    updated = 0
+                    for n, (assignments, _, backfill) in enumerate(derived, 1):
+                        index = f"idx_{table}_derive_{n}"
+                        # 回填条件改过时旧的部分索引条件对不上，查询用不到它，删掉重建
+                        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (index,))
+                        existing = cursor.fetchone()
+                        if existing and not existing[0].endswith(f"WHERE {backfill}"):
+                            cursor.execute(f"DROP INDEX {index}")
+                        cursor.execute(
+                            f"CREATE INDEX IF NOT EXISTS {index} "
+                            f"ON {table} ({', '.join(key_columns)}) WHERE {backfill}"
+                        )
+                        cursor.execute(f"UPDATE {table} SET {assignments} WHERE {backfill}")
+                        updated += cursor.rowcount
+                    print(f"    ✅ 更新了 {updated} {unit}")
+                conn.commit()
+            finally:
+                conn.close()
         
         print("  ✅ 数据增强完成")
     
-    def sync_all_enhanced(self):
-        """增强同步所有数据"""
+    def sync_all_enhanced(self, parallel: int = 1):
+        """增强同步所有数据，返回 [(实体, 条数, 耗时秒)]；登录或元数据校验失败时返回 None"""
         if not self.login():
             print("❌ 登录失败，无法同步")
             return
         
+        tasks = [
+            ('sales_orders_enhanced', self.sync_sales_orders_enhanced),
+            ('suppliers_enhanced', self.sync_suppliers_enhanced),
+            ('workcenters_enhanced', self.sync_workcenters_enhanced),
+        ]
+        if not self.check_metadata([name for name, _ in tasks]):
+            return
+        self.start_run([name for name, _ in tasks])
+        
         print("\n" + "="*60)
-        print("🚀 开始增强数据同步")
+        print(f"🚀 开始增强数据同步（并发: {max(parallel, 1)}）")
         print("="*60)
         
-        start_time = datetime.now()
-        
-        total = 0
+        start_time = time.perf_counter()
         
         # 同步新表
-        total += self.sync_sales_orders_enhanced()
-        total += self.sync_suppliers_enhanced()
-        total += self.sync_workcenters_enhanced()
+        results = self._run_entities(tasks, parallel)
+        total = sum(count or 0 for _, count, _ in results)
         
         # 增强现有数据
         self.enhance_existing_data()
         
-        duration = (datetime.now() - start_time).seconds
+        duration = time.perf_counter() - start_time
         
         print("\n" + "="*60)
-        print(f"✅ 增强同步完成！")
+        print("✅ 增强同步完成！")
+        for name, count, elapsed in results:
+            status = f"{count} 条" if count is not None else "失败"
+            print(f"   {name:<22} {status:>10}  {elapsed:.2f} 秒")
+            metrics = self.metrics.get(name)
+            if metrics is not None:
+                print(f"   {'':<22} ⏱️  {metrics.summary()}")
         print(f"   新增记录数: {total}")
-        print(f"   耗时: {duration} 秒")
+        print(f"   耗时: {duration:.2f} 秒")
+        if self.cache is not None:
+            print(f"   {self.cache.summary()}")
+        if self.sink is not None:
+            print(f"   {self.sink.summary()}")
+        print(f"   {self.limiter.summary()}")
+        print(f"   {self.lookups.summary()}")
         print("="*60)
+        return results
 
 
 def main():
+    # 设置UTF-8输出（只在作为脚本运行时，被 sync_daemon 等导入时不替换调用方的 stdout）
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    
     parser = argparse.ArgumentParser(description='金蝶云增强数据同步')
     parser.add_argument('--all', action='store_true', help='同步所有数据')
     parser.add_argument('--sales-orders', action='store_true', help='同步销售订单')
     parser.add_argument('--suppliers', action='store_true', help='同步供应商')
     parser.add_argument('--workcenters', action='store_true', help='同步工作中心')
     parser.add_argument('--enhance', action='store_true', help='仅增强现有数据')
+    parser.add_argument('--parallel', type=int, default=1, metavar='N', help='并发同步的实体数（默认 1，串行）')
+    parser.add_argument('--full', action='store_true', help='忽略增量水位，全量同步')
+    parser.add_argument('--resume', action='store_true', help='从上次中断的运行的断点继续，已完成的实体跳过')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, metavar='N', help=f'每批写入行数（默认 {DEFAULT_BATCH_SIZE}）')
+    parser.add_argument('--bulk-load', action='store_true', help='批量装载：先写暂存表再一次性合并（配合 --full 时删除已消失的行）')
+    parser.add_argument('--cache', action='store_true', help='缓存查询响应到本地磁盘')
+    parser.add_argument('--replay', action='store_true', help='只从本地缓存回放，不访问金蝶（建议配合 --full）')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'缓存目录（默认 {DEFAULT_CACHE_DIR}）')
+    parser.add_argument('--cache-ttl', type=int, default=DEFAULT_TTL, metavar='SECONDS', help='缓存有效期，0 表示不过期')
+    parser.add_argument('--metrics-file', metavar='FILE', help='导出本次运行的分阶段指标（.prom 为 Prometheus textfile，否则 JSON）')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), metavar='MB', help='缓存总大小上限')
+    add_sink_arguments(parser)
+    add_metadata_arguments(parser)
+    add_rate_arguments(parser)
+    add_dimension_arguments(parser)
+    add_pipeline_arguments(parser)
     
     args = parser.parse_args()
     
-    syncer = KingdeeEnhancedSync()
+    cache = None
+    if args.cache or args.replay:
+        cache = ResponseCache(args.cache_dir, args.cache_ttl, args.cache_max_mb * 1024 * 1024, replay=args.replay)
     
-    if args.all or (not any([args.sales_orders, args.suppliers, args.workcenters, args.enhance])):
-        syncer.sync_all_enhanced()
-    else:
-        if not syncer.login():
-            print("❌ 登录失败")
-            return
-        
-        if args.sales_orders:
-            syncer.sync_sales_orders_enhanced()
-        if args.suppliers:
-            syncer.sync_suppliers_enhanced()
-        if args.workcenters:
-            syncer.sync_workcenters_enhanced()
-        if args.enhance:
-            syncer.enhance_existing_data()
-
+    sink = sink_from_args(args)
+    syncer = KingdeeEnhancedSync(full=args.full, batch_size=args.batch_size, cache=cache, bulk_load=args.bulk_load,
+                                 sink=sink, metadata=metadata_from_args(args), resume=args.resume,
+                                 limiter=controller_from_args(args), lookups=dimension_cache_from_args(args),
+                                 pipeline_depth=args.pipeline_depth)
+    
+    # 登录失败、校验失败或某个实体失败时也要关闭 MES 推送并导出指标
+    try:
+        if args.all or (not any([args.sales_orders, args.suppliers, args.workcenters, args.enhance])):
+            syncer.sync_all_enhanced(parallel=args.parallel)
+        else:
+            if not syncer.login():
+                print("❌ 登录失败")
+                return
+            
+            # 单独选择的实体同样经 _run_entities 执行：异常记为失败写入 sync_log，不中断其余实体
+            tasks = [(name, func) for name, func, flag in (
+                ('sales_orders_enhanced', syncer.sync_sales_orders_enhanced, args.sales_orders),
+                ('suppliers_enhanced', syncer.sync_suppliers_enhanced, args.suppliers),
+                ('workcenters_enhanced', syncer.sync_workcenters_enhanced, args.workcenters),
+            ) if flag]
+            selected = [name for name, _ in tasks]
+            if not syncer.check_metadata(selected):
+                return
+            syncer.start_run(selected)
+            syncer._run_entities(tasks, args.parallel)
+            
+            if args.enhance:
+                syncer.enhance_existing_data()
+    finally:
+        syncer.close()
+        if sink is not None:
+            sink.close()
+        
+        if args.metrics_file:
+            syncer.metrics.export(args.metrics_file)
+            print(f"📈 指标已导出: {args.metrics_file}")
 
 if __name__ == '__main__':
     main()
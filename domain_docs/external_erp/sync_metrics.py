@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+同步分阶段计时和计数
+
+每个实体一份 EntityMetrics，按阶段累计耗时：
+- http: 发出请求到收到响应（流式解析时只到响应头）
+- decode: 读取响应体并解析 JSON（流式解析时两者交错，合并计入）
+- transform: 金蝶行 -> 写入元组（解码、类型转换、补行号）
+- write: 比对哈希并 executemany 写入（在 db_lock 内计时，不含等锁）
+- commit: 提交事务
+另有 pages / rows / retries（连接池重试）/ relogins / errors 计数、
+changed（新增 + 更新 + 删除的行数，守护进程据此调整同步频率）和每页明细。
+
+运行级别另记查询并发控制（rate_control.AdaptiveConcurrency）的快照：当前/平均并发上限、降速次数等。
+
+结果写进 sync_log_detail 的 JSON，并可导出为 JSON 或 Prometheus textfile（.prom）。
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+
+PHASES = ('http', 'decode', 'transform', 'write', 'commit')
+COUNTERS = ('pages', 'rows', 'retries', 'relogins', 'errors', 'changed')
+
+# 每个实体最多保留的每页明细条数（超出只累计不记明细）
+MAX_PAGE_SAMPLES = 10000
+
+
+def retries_of(response) -> int:
+    """requests 响应经过的连接池重试次数（urllib3 Retry.history）"""
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    return len(getattr(retries, 'history', None) or ())
+
+
+class EntityMetrics:
+    """单个实体的计时和计数，可被多个拉取线程同时更新"""
+
+    def __init__(self, entity: str, form_id: str = ''):
+        self.entity = entity
+        self.form_id = form_id
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.page_samples = []
+        self.status = 'running'
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def count(self, counter: str, n: int = 1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def page(self, start_row: int, rows: int, http: float, decode: float, retries: int = 0):
+        """记录一页：累计 http/decode 耗时和计数，并保留明细"""
+        with self._lock:
+            self.phases['http'] += http
+            self.phases['decode'] += decode
+            self.counters['pages'] += 1
+            self.counters['rows'] += rows
+            self.counters['retries'] += retries
+            if len(self.page_samples) < MAX_PAGE_SAMPLES:
+                self.page_samples.append({
+                    'start_row': start_row, 'rows': rows,
+                    'http_ms': round(http * 1000, 1), 'decode_ms': round(decode * 1000, 1),
+                    'retries': retries,
+                })
+
+    def finish(self, status: str):
+        self.status = status
+        self.elapsed = time.perf_counter() - self.started
+
+    def as_dict(self, pages: bool = False) -> dict:
+        with self._lock:
+            data = {
+                'status': self.status,
+                'elapsed': round(self.elapsed, 3),
+                'phases': {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+                **self.counters,
+            }
+            if pages:
+                data['page_samples'] = list(self.page_samples)
+        return data
+
+    def summary(self) -> str:
+        parts = " / ".join(f"{phase} {self.phases[phase]:.2f}s" for phase in PHASES)
+        text = f"{parts}（{self.counters['pages']} 页"
+        for counter, label in (('retries', '重试'), ('relogins', '重新登录'), ('errors', '错误')):
+            if self.counters[counter]:
+                text += f"，{label} {self.counters[counter]}"
+        return text + "）"
+
+
+class SyncMetrics:
+    """一次同步运行的全部实体指标"""
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.entities = {}
+        self._by_form = {}
+        self._lock = threading.Lock()
+        # 查询并发控制（有 snapshot() 的对象），由客户端挂上
+        self.concurrency = None
+
+    def entity(self, name: str, form_id: str = '', alternate_forms: tuple = ()) -> EntityMetrics:
+        """开始统计一个实体（同名实体重新开始计时）；form_id 和备选表单的查询都计入它"""
+        metrics = EntityMetrics(name, form_id)
+        with self._lock:
+            self.entities[name] = metrics
+            for form in (form_id,) + tuple(alternate_forms):
+                if form:
+                    self._by_form[form] = metrics
+        return metrics
+
+    def get(self, name: str) -> Optional[EntityMetrics]:
+        return self.entities.get(name)
+
+    def for_form(self, form_id: str, caller: Optional[EntityMetrics] = None) -> EntityMetrics:
+        """拉取层只知道表单 ID：caller（发起查询的实体，如解析名称时查主数据）优先，其次是登记了该表单的实体
+
+        都没有时（单独的查询）返回不登记、不导出的指标，不会多出一个一直处于 running 的实体。
+        """
+        if caller is not None:
+            return caller
+        with self._lock:
+            metrics = self._by_form.get(form_id)
+        return metrics if metrics is not None else EntityMetrics(form_id, form_id)
+
+    def as_dict(self, pages: bool = False) -> dict:
+        data = {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'entities': {name: m.as_dict(pages) for name, m in self.entities.items()},
+        }
+        if self.concurrency is not None:
+            data['concurrency'] = self.concurrency.snapshot()
+        return data
+
+    def export(self, path: str):
+        """按扩展名导出：.prom 为 Prometheus textfile，其他为 JSON（含每页明细）"""
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.as_dict(pages=True), ensure_ascii=False, indent=2)
+        # 先写临时文件再替换，textfile collector 不会读到半个文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def metric(name: str, help_text: str, samples: list):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        entities = list(self.entities.values())
+        metric('kingdee_sync_phase_seconds', 'Seconds spent per sync phase in the last run',
+               [({'entity': m.entity, 'phase': phase}, round(m.phases[phase], 6))
+                for m in entities for phase in PHASES])
+        metric('kingdee_sync_duration_seconds', 'Wall time of the last entity sync',
+               [({'entity': m.entity}, round(m.elapsed, 6)) for m in entities])
+        for counter in COUNTERS:
+            metric(f'kingdee_sync_{counter}', f'{counter} in the last run',
+                   [({'entity': m.entity}, m.counters[counter]) for m in entities])
+        metric('kingdee_sync_success', '1 if the last entity sync succeeded',
+               [({'entity': m.entity}, 1 if m.status == 'success' else 0) for m in entities])
+        metric('kingdee_sync_last_run_timestamp_seconds', 'Start time of the last run',
+               [({}, int(self.started_at.timestamp()))])
+        if self.concurrency is not None:
+            for key, value in self.concurrency.snapshot().items():
+                metric(f'kingdee_sync_concurrency_{key}', f'Adaptive query concurrency: {key}', [({}, value)])
+        return "\n".join(lines) + "\n"
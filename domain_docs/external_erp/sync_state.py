@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+同步状态存储（与 log_sync 写在同一个库里）
+
+- sync_watermark: 每个实体的增量水位，即已同步数据中金蝶 FModifyDate 的最大值。
+  下次同步把水位写进 FilterString，只拉取之后修改过的行。
+- sync_log_detail: log_sync 的结构化补充，按 JSON 记录新增/更新/未变/缺失等明细。
+- sync_checkpoint: 每个实体最近一次运行的断点（运行 ID、过滤条件、已提交的源行数、当时的最大
+  FModifyDate），与数据批次在同一个事务里提交。--resume 时沿用中断运行的过滤条件从断点继续，
+  该运行里已完成的实体直接跳过。
+- 本地库：各函数的 db_path 为 None 时经 database.get_db 连接默认库；多账套分区库、压测临时库
+  由调用方显式传入路径（connect），prepare_database 按默认库的表结构在该路径建表。
+"""
+
+import json
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import Optional
+import database
+from database import get_db, log_sync
+
+
+# 带水位的实体统一按修改时间升序分页：中途失败时已见到的最大值不会越过未拉取的行
+WATERMARK_ORDER = "FModifyDate ASC,FID ASC"
+
+
+def _ensure_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_watermark (
+            entity TEXT PRIMARY KEY,
+            modify_date TEXT NOT NULL,
+            updated_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_log_detail (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            status TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            details TEXT,
+            logged_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_checkpoint (
+            entity TEXT PRIMARY KEY,
+            run_id TEXT NOT NULL,
+            filter_string TEXT NOT NULL,
+            order_string TEXT NOT NULL,
+            page_size INTEGER NOT NULL,
+            start_row INTEGER NOT NULL,
+            high_water TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+
+def connect(db_path: Optional[str] = None):
+    """连接本地库：给了 db_path 时直接打开该 SQLite 文件，否则用 database.get_db 的默认库"""
+    if db_path:
+        return sqlite3.connect(db_path, timeout=30)
+    return get_db()
+
+
+def prepare_database(db_path: str) -> str:
+    """在 db_path 处建出默认库（database.init_db）的全部表和索引，只复制结构不复制数据；返回 db_path
+
+    database.get_db 只连默认库，分区库和临时库的表结构从默认库的 sqlite_master 取，已有的表不动。
+    """
+    database.init_db()
+    source = get_db()
+    try:
+        schema = source.execute(
+            "SELECT type, name, sql FROM sqlite_master "
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY type = 'index', rowid"
+        ).fetchall()
+    finally:
+        source.close()
+
+    conn = connect(db_path)
+    try:
+        existing = {row[0] for row in conn.execute('SELECT name FROM sqlite_master')}
+        for _, name, sql in schema:
+            if name not in existing:
+                conn.execute(sql)
+        _ensure_tables(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return db_path
+
+
+def normalize_modify_date(value) -> str:
+    """金蝶日期 '2024-05-01T08:30:00.123' -> '2024-05-01 08:30:00'（截掉毫秒，配合 >= 不会漏行）"""
+    if not value:
+        return ''
+    return str(value).replace('T', ' ')[:19]
+
+
+def get_watermark(entity: str, db_path: Optional[str] = None) -> Optional[str]:
+    """读取实体水位，没有则返回 None"""
+    conn = connect(db_path)
+    try:
+        _ensure_tables(conn)
+        row = conn.execute('SELECT modify_date FROM sync_watermark WHERE entity = ?', (entity,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def save_watermark(entity: str, modify_date: str, db_path: Optional[str] = None):
+    """推进实体水位（只前进不后退）"""
+    modify_date = normalize_modify_date(modify_date)
+    if not modify_date:
+        return
+    conn = connect(db_path)
+    try:
+        _ensure_tables(conn)
+        conn.execute('''
+            INSERT INTO sync_watermark (entity, modify_date, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(entity) DO UPDATE SET
+                modify_date = MAX(modify_date, excluded.modify_date),
+                updated_at = excluded.updated_at
+        ''', (entity, modify_date, datetime.now()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def delta_filter(entity: str, base_filter: str = "", full: bool = False, db_path: Optional[str] = None) -> str:
+    """在 base_filter 基础上叠加水位条件；full=True 或尚无水位时原样返回（全量）"""
+    watermark = None if full else get_watermark(entity, db_path)
+    if not watermark:
+        return base_filter
+
+    print(f"  ⏱️  增量同步: FModifyDate >= '{watermark}'")
+    condition = f"FModifyDate >= '{watermark}'"
+    return f"{base_filter} AND {condition}" if base_filter else condition
+
+
+def log_sync_result(entity: str, count: int, status: str, details: Optional[dict] = None,
+                    db_path: Optional[str] = None):
+    """写 log_sync，并把明细（如 BatchWriter.result()）记到 sync_log_detail
+
+    database.log_sync 只写默认库；给了 db_path 时结果（含无明细的）只记到该库的 sync_log_detail。
+    """
+    if not db_path:
+        log_sync(entity, count, status)
+        if not details:
+            return
+    conn = connect(db_path)
+    try:
+        _ensure_tables(conn)
+        conn.execute(
+            'INSERT INTO sync_log_detail (entity, status, row_count, details, logged_at) VALUES (?, ?, ?, ?, ?)',
+            (entity, status, count, json.dumps(details, ensure_ascii=False), datetime.now())
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+CHECKPOINT_RUNNING = 'running'
+CHECKPOINT_DONE = 'done'
+
+
+class Checkpoint:
+    """一个实体在一次运行里的断点
+
+    start_row 是已提交的源行数（即续传时的 StartRow），page = start_row // page_size；
+    filter_string / order_string 是该运行实际使用的查询条件，续传时原样沿用，
+    不会因为水位或"最近 N 天"的日期变化而错位。
+    """
+
+    COLUMNS = ('entity', 'run_id', 'filter_string', 'order_string', 'page_size', 'start_row',
+               'high_water', 'row_count', 'status')
+
+    def __init__(self, entity: str, run_id: str, filter_string: str = '', order_string: str = '',
+                 page_size: int = 0, start_row: int = 0, high_water: str = '', row_count: int = 0,
+                 status: str = CHECKPOINT_RUNNING):
+        self.entity = entity
+        self.run_id = run_id
+        self.filter_string = filter_string
+        self.order_string = order_string
+        self.page_size = page_size
+        self.start_row = start_row
+        self.high_water = high_water
+        self.row_count = row_count
+        self.status = status
+
+    @property
+    def page(self) -> int:
+        return self.start_row // self.page_size if self.page_size else 0
+
+    @property
+    def done(self) -> bool:
+        return self.status == CHECKPOINT_DONE
+
+    def save(self, conn):
+        """在调用方的事务里写入（不提交），与同一批数据一起提交或回滚"""
+        _ensure_tables(conn)
+        values = [getattr(self, col) for col in self.COLUMNS]
+        conn.execute(f'''
+            INSERT INTO sync_checkpoint ({', '.join(self.COLUMNS)}, updated_at)
+            VALUES ({', '.join('?' * len(self.COLUMNS))}, ?)
+            ON CONFLICT(entity) DO UPDATE SET
+                {', '.join(f"{col} = excluded.{col}" for col in self.COLUMNS[1:])},
+                updated_at = excluded.updated_at
+        ''', (*values, datetime.now()))
+
+
+def new_run_id() -> str:
+    return f"{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+def load_checkpoint(entity: str, db_path: Optional[str] = None) -> Optional[Checkpoint]:
+    conn = connect(db_path)
+    try:
+        _ensure_tables(conn)
+        row = conn.execute(
+            f"SELECT {', '.join(Checkpoint.COLUMNS)} FROM sync_checkpoint WHERE entity = ?", (entity,)
+        ).fetchone()
+        return Checkpoint(*row) if row else None
+    finally:
+        conn.close()
+
+
+def save_checkpoint(checkpoint: Checkpoint, db_path: Optional[str] = None):
+    """单独提交一个断点（运行开始、实体完成时）"""
+    conn = connect(db_path)
+    try:
+        checkpoint.save(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def interrupted_run(entities, db_path: Optional[str] = None) -> Optional[str]:
+    """这些实体最近一次运行的 ID；该运行里全部实体都已完成时返回 None（没有可续传的）"""
+    entities = list(entities)
+    if not entities:
+        return None
+    placeholders = ', '.join('?' * len(entities))
+    conn = connect(db_path)
+    try:
+        _ensure_tables(conn)
+        row = conn.execute(
+            f"SELECT run_id FROM sync_checkpoint WHERE entity IN ({placeholders}) ORDER BY updated_at DESC LIMIT 1",
+            entities,
+        ).fetchone()
+        if row is None:
+            return None
+        done = conn.execute(
+            f"SELECT COUNT(*) FROM sync_checkpoint WHERE entity IN ({placeholders}) AND run_id = ? AND status = ?",
+            (*entities, row[0], CHECKPOINT_DONE),
+        ).fetchone()[0]
+        return None if done == len(entities) else row[0]
+    finally:
+        conn.close()
+
+
+def begin_run(entities, resume: bool = False, db_path: Optional[str] = None) -> str:
+    """返回本次运行的 ID：resume 且有中断的运行时沿用其 ID，否则新开一个"""
+    if resume:
+        run_id = interrupted_run(entities, db_path)
+        if run_id is not None:
+            print(f"⏯️  续传中断的运行 {run_id}")
+            return run_id
+        print("ℹ️  没有中断的运行可续传，从头开始")
+    return new_run_id()
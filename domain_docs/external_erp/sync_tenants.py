@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+多账套同步：每个账套（工厂的 DBID）一个工作进程，结束时汇总各账套的结果
+
+- 账套列表见 account_sets.py（JSON 文件，每个账套一个 name）
+- 每个账套在独立进程里运行（spawn 启动，不继承父进程状态）：自己登录、自己的会话和连接池、
+  自己的自适应并发和名称缓存；--max-rps 等限速参数按账套各自生效
+- 输出按账套分区：<output-dir>/<name>/ 下是该账套的 SQLite 库、同步日志、指标和缓存目录，
+  账套之间不共用任何文件（水位、断点、同步日志 sync_log_detail 都在各自的库里）；
+  库路径显式传给客户端，表结构取自默认库（sync_state.prepare_database）
+- 某个账套登录失败、同步出错甚至进程崩溃都不影响其他账套，只在汇总里记为失败
+- 汇总打印到屏幕并写入 <output-dir>/report.json（或 --report）；有账套未完全成功时退出码为 1
+
+使用方法:
+python sync_tenants.py --accounts accounts.json                    # 每个账套一个进程，同步所有数据
+python sync_tenants.py --accounts accounts.json --processes 4 --enhanced
+python sync_tenants.py --accounts accounts.json --only plant-sz --only plant-wx --parallel 3 --fan-out 2
+python sync_tenants.py --accounts accounts.json --resume           # 各账套从自己的断点继续
+
+注意：MES 推送（--mes-url）在这里不可用，各账套的数据只写各自的分区库。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import datetime
+
+from account_sets import AccountSet, load_account_sets
+from batch_writer import DEFAULT_BATCH_SIZE
+from dimension_cache import add_dimension_arguments, dimension_cache_from_args
+from form_metadata import add_metadata_arguments, metadata_from_args
+from pipeline import add_pipeline_arguments
+from rate_control import add_rate_arguments, controller_from_args
+from response_cache import DEFAULT_MAX_BYTES, DEFAULT_TTL, ResponseCache
+from sync_kingdee import KingdeeSync
+from sync_kingdee_enhanced import KingdeeEnhancedSync
+from sync_state import prepare_database
+
+
+DEFAULT_OUTPUT_DIR = 'tenants'
+REPORT_FILE = 'report.json'
+# 分区目录下的文件
+DATABASE_FILE = 'kingdee.db'
+LOG_FILE = 'sync.log'
+METRICS_FILE = 'metrics.json'
+CACHE_DIR = 'cache'
+
+
+def _entity_results(results, client: str) -> dict:
+    return {name: {'client': client, 'rows': count or 0, 'seconds': round(elapsed, 3),
+                   'status': 'success' if count is not None else 'failed'}
+            for name, count, elapsed in results}
+
+
+def _run(account: AccountSet, args, partition: str, report: dict, db_path: str):
+    cache_dir = os.path.join(partition, CACHE_DIR)
+    options = argparse.Namespace(**{**vars(args), 'cache_dir': cache_dir})
+    cache = None
+    if args.cache:
+        cache = ResponseCache(cache_dir, args.cache_ttl, args.cache_max_mb * 1024 * 1024)
+
+    syncer = KingdeeSync(fan_out=args.fan_out, full=args.full, batch_size=args.batch_size, cache=cache,
+                         use_async=args.use_async, bulk_load=args.bulk_load, metadata=metadata_from_args(options),
+                         breakdowns=args.breakdowns, resume=args.resume, limiter=controller_from_args(args),
+                         lookups=dimension_cache_from_args(args, db_path), pipeline_depth=args.pipeline_depth,
+                         account=account, db_path=db_path)
+    clients = [('sync_kingdee', syncer, syncer.sync_all)]
+    if args.enhanced:
+        # 同一账套的两个客户端共用限速和名称缓存
+        enhanced = KingdeeEnhancedSync(full=args.full, batch_size=args.batch_size, cache=cache,
+                                       bulk_load=args.bulk_load, metadata=metadata_from_args(options),
+                                       resume=args.resume, limiter=syncer.limiter, lookups=syncer.lookups,
+                                       pipeline_depth=args.pipeline_depth, account=account, db_path=db_path)
+        clients.append(('sync_kingdee_enhanced', enhanced, enhanced.sync_all_enhanced))
+
+    metrics = {}
+    try:
+        for name, client, sync_all in clients:
+            results = sync_all(parallel=args.parallel)
+            if results is None:
+                report['error'] = f"{name}: 登录或元数据校验失败"
+                return
+            report['entities'].update(_entity_results(results, name))
+            metrics[name] = client.metrics.as_dict()
+    finally:
+        for _, client, _ in clients:
+            client.close()
+    report['concurrency'] = syncer.limiter.snapshot()
+    report['lookups'] = syncer.lookups.summary()
+
+    with open(report['metrics'], 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+
+
+def sync_tenant(account: AccountSet, args) -> dict:
+    """工作进程入口：同步一个账套，输出写到它的分区，返回该账套的汇总"""
+    partition = os.path.join(args.output_dir, account.name)
+    os.makedirs(partition, exist_ok=True)
+    report = {
+        'tenant': account.name, 'dbid': account.dbid, 'base_url': account.base_url, 'status': 'failed',
+        'rows': 0, 'seconds': 0.0, 'entities': {}, 'error': None,
+        'database': os.path.join(partition, DATABASE_FILE),
+        'log': os.path.join(partition, LOG_FILE),
+        'metrics': os.path.join(partition, METRICS_FILE),
+    }
+    started = time.perf_counter()
+    with open(report['log'], 'a', encoding='utf-8', buffering=1) as log, redirect_stdout(log), redirect_stderr(log):
+        print(f"\n🏭 {datetime.now().isoformat(timespec='seconds')} 账套 {account.name}"
+              f"（DBID {account.dbid}，进程 {os.getpid()}）")
+        try:
+            _run(account, args, partition, report, prepare_database(report['database']))
+        except Exception as e:
+            traceback.print_exc()
+            report['error'] = str(e)
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['rows'] = sum(entity['rows'] for entity in report['entities'].values())
+    if report['error'] is None:
+        failed = [name for name, entity in report['entities'].items() if entity['status'] != 'success']
+        report['status'] = 'partial' if failed else 'success'
+    return report
+
+
+def _crashed(account: AccountSet, error: BaseException) -> dict:
+    """工作进程异常退出（被杀、内存不足等）时的汇总"""
+    return {'tenant': account.name, 'dbid': account.dbid, 'base_url': account.base_url, 'status': 'failed',
+            'rows': 0, 'seconds': 0.0, 'entities': {}, 'error': f"工作进程异常: {error!r}"}
+
+
+def run_tenants(accounts: list, args) -> list:
+    """每个账套一个工作进程（最多 args.processes 个同时运行），按账套列表顺序返回汇总"""
+    processes = max(1, min(args.processes or len(accounts), len(accounts)))
+    print(f"🚀 同步 {len(accounts)} 个账套（{processes} 个进程），输出目录 {args.output_dir}")
+    reports = {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        futures = {pool.submit(sync_tenant, account, args): account for account in accounts}
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                report = _crashed(account, e)
+            reports[account.name] = report
+            mark = {'success': '✅', 'partial': '⚠️ '}.get(report['status'], '❌')
+            line = f"{mark} {account.name}: {report['rows']} 条，{report['seconds']:.2f} 秒"
+            if report['error']:
+                line += f" - {report['error']}"
+            print(line)
+    return [reports[account.name] for account in accounts]
+
+
+def print_report(reports: list, duration: float):
+    print("\n" + "=" * 78)
+    print(f"{'账套':<16}{'DBID':<18}{'状态':<9}{'记录数':>10}{'耗时 秒':>10}  失败实体")
+    print("-" * 78)
+    for r in reports:
+        failed = [name for name, entity in r['entities'].items() if entity['status'] != 'success']
+        print(f"{r['tenant']:<16}{str(r['dbid']):<18}{r['status']:<9}{r['rows']:>10}{r['seconds']:>10.2f}  "
+              f"{', '.join(failed) or ('-' if r['error'] is None else '（未完成）')}")
+    succeeded = sum(r['status'] == 'success' for r in reports)
+    print("-" * 78)
+    print(f"成功 {succeeded}/{len(reports)} 个账套，共 {sum(r['rows'] for r in reports)} 条，总耗时 {duration:.2f} 秒")
+    print("=" * 78)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='金蝶多账套同步')
+    parser.add_argument('--accounts', required=True, metavar='FILE', help='账套列表（JSON，见 account_sets.py）')
+    parser.add_argument('--only', action='append', metavar='NAME', help='只同步指定账套，可重复')
+    parser.add_argument('--processes', type=int, metavar='N', help='同时运行的账套进程数（默认每个账套一个）')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help=f'按账套分区的输出目录（默认 {DEFAULT_OUTPUT_DIR}）')
+    parser.add_argument('--report', metavar='FILE', help=f'汇总 JSON 的路径（默认 <output-dir>/{REPORT_FILE}）')
+    parser.add_argument('--enhanced', action='store_true', help='同时执行增强同步（销售订单、供应商、工作中心）')
+    parser.add_argument('--parallel', type=int, default=1, metavar='N', help='每个账套并发同步的实体数（默认 1）')
+    parser.add_argument('--fan-out', type=int, default=1, metavar='N', help='单个表单并发拉取的页数（默认 1，逐页）')
+    parser.add_argument('--full', action='store_true', help='忽略增量水位，全量同步')
+    parser.add_argument('--resume', action='store_true', help='各账套从上次中断的运行的断点继续')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='用异步客户端拉取（需要 aiohttp）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, metavar='N', help=f'每批写入行数（默认 {DEFAULT_BATCH_SIZE}）')
+    parser.add_argument('--bulk-load', action='store_true', help='批量装载：先写暂存表再一次性合并')
+    parser.add_argument('--inventory-by-warehouse', dest='breakdowns', action='store_true',
+                        help='库存同时按仓库汇总写入 inventory_by_warehouse')
+    parser.add_argument('--cache', action='store_true', help='缓存查询响应（各账套在自己分区的 cache 目录）')
+    parser.add_argument('--cache-ttl', type=int, default=DEFAULT_TTL, metavar='SECONDS', help='缓存有效期，0 表示不过期')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), metavar='MB',
+                        help='每个账套的缓存总大小上限')
+    add_metadata_arguments(parser)
+    add_rate_arguments(parser)
+    add_dimension_arguments(parser)
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        accounts = load_account_sets(args.accounts, args.only)
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    reports = run_tenants(accounts, args)
+    duration = time.perf_counter() - started
+    print_report(reports, duration)
+
+    report_path = args.report or os.path.join(args.output_dir, REPORT_FILE)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({'finished_at': datetime.now().isoformat(timespec='seconds'), 'seconds': round(duration, 3),
+                   'tenants': reports}, f, ensure_ascii=False, indent=2)
+    print(f"💾 汇总已写入 {report_path}")
+
+    if any(r['status'] != 'success' for r in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
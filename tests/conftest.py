@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+domain_docs/external_erp 金蝶同步脚本的测试夹具
+
+同步脚本依赖部署环境里的 config_sso（金蝶连接配置）和 database（本地 SQLite 库），
+这两个模块不在仓库里。这里装入只供测试用的替身：
+- config_sso 指向不存在的地址，测试里的客户端都显式传入 FakeKingdeeServer 的账套
+- database 与部署的一样只连一个固定的默认库（DB_PATH，由 kingdee_db 夹具指向临时文件），
+  init_db 建出同步写入的业务表和 sync_log；分区库由测试显式传路径（sync_state.prepare_database）
+"""
+
+import os
+import sqlite3
+import sys
+import types
+from datetime import datetime
+
+import pytest
+
+EXTERNAL_ERP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'domain_docs', 'external_erp')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS materials (
+    material_id TEXT PRIMARY KEY, material_name TEXT, category TEXT, unit TEXT,
+    lead_time_days INTEGER, updated_at TEXT);
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id TEXT PRIMARY KEY, customer_name TEXT, tier TEXT, tier_weight REAL, updated_at TEXT);
+CREATE TABLE IF NOT EXISTS manufacturing_orders (
+    mo_no TEXT PRIMARY KEY, so_no TEXT, material_id TEXT, customer_id TEXT, qty_plan REAL,
+    status TEXT, promise_date TEXT, updated_at TEXT);
+CREATE TABLE IF NOT EXISTS inventory (
+    material_id TEXT PRIMARY KEY, qty_on_hand REAL, qty_allocated REAL, qty_available REAL, updated_at TEXT);
+CREATE TABLE IF NOT EXISTS purchase_orders (
+    po_no TEXT, po_line_no INTEGER, material_id TEXT, qty_ordered REAL, qty_remaining REAL,
+    promised_date TEXT, is_confirmed INTEGER, supplier_id TEXT, supplier_name TEXT, unit_price REAL,
+    amount REAL, updated_at TEXT, PRIMARY KEY (po_no, po_line_no));
+CREATE TABLE IF NOT EXISTS bom (
+    parent_id TEXT, child_id TEXT, qty REAL, updated_at TEXT, PRIMARY KEY (parent_id, child_id));
+CREATE TABLE IF NOT EXISTS sales_orders (
+    so_no TEXT, so_line_no INTEGER, customer_id TEXT, customer_name TEXT, material_id TEXT,
+    material_name TEXT, qty_ordered REAL, qty_remaining REAL, unit_price REAL, revenue REAL,
+    promise_date TEXT, updated_at TEXT, PRIMARY KEY (so_no, so_line_no));
+CREATE TABLE IF NOT EXISTS suppliers (
+    supplier_id TEXT PRIMARY KEY, supplier_name TEXT, lead_time_days INTEGER, otd_rate_3m REAL,
+    otd_rate_12m REAL, expedite_premium REAL, updated_at TEXT);
+CREATE TABLE IF NOT EXISTS workcenters (
+    workcenter_id TEXT PRIMARY KEY, workcenter_name TEXT, workcenter_type TEXT,
+    daily_capacity_hours REAL, shift_count INTEGER, oee_avg REAL, rty_avg REAL, updated_at TEXT);
+CREATE TABLE IF NOT EXISTS sync_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, entity TEXT, count INTEGER, status TEXT, synced_at TEXT);
+'''
+
+
+def _config_sso():
+    module = types.ModuleType('config_sso')
+    module.BASE_URL = 'http://127.0.0.1:9/k3cloud'
+    module.DBID = 'test'
+    module.USERNAME = 'tester'
+    module.APPID = 'test-app'
+    module.APP_SECRET = 'test-secret'
+    module.LCID = 2052
+    return module
+
+
+def _database():
+    module = types.ModuleType('database')
+    module.DB_PATH = None
+
+    def get_db():
+        if not module.DB_PATH:
+            raise RuntimeError('测试里必须经 kingdee_db 夹具指定默认库')
+        return sqlite3.connect(module.DB_PATH)
+
+    def init_db():
+        conn = get_db()
+        try:
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def log_sync(entity, count, status):
+        conn = get_db()
+        try:
+            conn.execute('INSERT INTO sync_log (entity, count, status, synced_at) VALUES (?, ?, ?, ?)',
+                         (entity, count, status, datetime.now().isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    module.get_db = get_db
+    module.init_db = init_db
+    module.log_sync = log_sync
+    return module
+
+
+sys.modules['config_sso'] = _config_sso()
+sys.modules['database'] = _database()
+if EXTERNAL_ERP_DIR not in sys.path:
+    sys.path.insert(0, EXTERNAL_ERP_DIR)
+
+
+@pytest.fixture
+def kingdee_db(tmp_path, monkeypatch):
+    """把默认库指向临时文件并建表，返回库文件路径"""
+    database = sys.modules['database']
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'kingdee.db'))
+    database.init_db()
+    return database.DB_PATH
+
+
+@pytest.fixture
+def fake_kingdee():
+    """后台线程里的金蝶替身，每个表单 1000 行"""
+    from fake_kingdee import FakeKingdeeServer
+
+    server = FakeKingdeeServer(default_rows=1000).start()
+    try:
+        yield server
+    finally:
+        server.stop()
+
+
+@pytest.fixture
+def fake_mes():
+    from fake_mes import FakeMesServer
+
+    server = FakeMesServer().start()
+    try:
+        yield server
+    finally:
+        server.stop()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""batch_writer：内容哈希跳过未变行、按单据比对删除金蝶已删除的分录、派生列回填"""
+
+from account_sets import AccountSet
+from batch_writer import BatchWriter, delete_missing_lines_in, sorted_key_diff
+from database import get_db
+from sync_kingdee_enhanced import KingdeeEnhancedSync
+
+
+def _rows(sql, *params):
+    conn = get_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def test_sorted_key_diff():
+    assert sorted_key_diff([1, 3, 5, 7], [2, 3, 6, 7, 8]) == ([1, 5], [2, 6, 8])
+    assert sorted_key_diff([], [1, 2]) == ([], [1, 2])
+    assert sorted_key_diff([('A', 1), ('A', 2)], []) == ([('A', 1), ('A', 2)], [])
+    assert sorted_key_diff([1, 2], [1, 2]) == ([], [])
+
+
+def test_batch_writer_skips_unchanged_rows(kingdee_db):
+    rows = [(f"M{i:03d}", f"物料{i}", '原材料', 'PCS') for i in range(5)]
+    with BatchWriter('materials', batch_size=2) as writer:
+        for row in rows:
+            writer.add(row)
+    assert writer.written == 5
+    assert writer.result() == {'inserted': 5, 'updated': 0, 'unchanged': 0}
+
+    # 只有一行内容变化；批内重复的主键以后到的为准，只算一行
+    changed = rows[:2] + [('M002', '物料2-改', '原材料', 'PCS'), ('M002', '物料2-改', '原材料', 'KG')] + rows[3:]
+    with BatchWriter('materials', batch_size=10, track_missing=True) as writer:
+        for row in changed:
+            writer.add(row)
+    assert writer.written == 5
+    assert writer.result() == {'inserted': 0, 'updated': 1, 'unchanged': 4, 'missing': 0}
+    assert _rows('SELECT material_name, unit FROM materials WHERE material_id = ?', 'M002') == [('物料2-改', 'KG')]
+
+
+def test_batch_writer_reports_missing_rows(kingdee_db):
+    with BatchWriter('materials') as writer:
+        for i in range(4):
+            writer.add((f"M{i}", f"物料{i}", '原材料', 'PCS'))
+    with BatchWriter('materials', track_missing=True) as writer:
+        writer.add(('M0', '物料0', '原材料', 'PCS'))
+    assert writer.result()['missing'] == 3
+
+
+def test_delete_missing_lines_in(kingdee_db):
+    lines = [('PO1', 1, 'M1', 5, 5, '2026-01-01', 0), ('PO1', 2, 'M2', 5, 5, '2026-01-01', 0),
+             ('PO1', 3, 'M3', 5, 5, '2026-01-01', 0), ('PO2', 1, 'M1', 1, 1, '2026-01-01', 0)]
+    with BatchWriter('purchase_orders') as writer:
+        for line in lines:
+            writer.add(line)
+
+    conn = get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # 金蝶上 PO1 删掉了第 2 行；PO2 本次没有出现，不受影响
+        removed = delete_missing_lines_in(conn, 'purchase_orders', 'po_no', [('PO1', 1), ('PO1', 3)])
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert removed == 1
+    assert _rows('SELECT po_no, po_line_no FROM purchase_orders ORDER BY 1, 2') == [('PO1', 1), ('PO1', 3), ('PO2', 1)]
+    # 内容哈希一并删除：金蝶再出现这一行时按新增写入
+    assert _rows("SELECT COUNT(*) FROM sync_row_hash WHERE table_name = 'purchase_orders'") == [(3,)]
+    with BatchWriter('purchase_orders') as writer:
+        writer.add(lines[1])
+    assert writer.result()['inserted'] == 1
+
+
+def test_backfill_keeps_real_zero_inventory(kingdee_db, capsys):
+    conn = get_db()
+    try:
+        # 旧版回填条件建的部分索引
+        conn.execute("CREATE INDEX idx_inventory_derive_1 ON inventory (material_id) "
+                     "WHERE qty_available IS NULL OR qty_available = 0")
+        conn.executemany("INSERT INTO inventory (material_id, qty_on_hand, qty_allocated, qty_available) "
+                         "VALUES (?, ?, ?, ?)", [('M1', 5, 5, 0), ('M2', 3, None, None)])
+        conn.commit()
+    finally:
+        conn.close()
+
+    KingdeeEnhancedSync(account=AccountSet('test', 'DB_A'), db_path=kingdee_db).enhance_existing_data()
+    assert '更新了 1 条库存' in capsys.readouterr().out
+    assert _rows('SELECT material_id, qty_available FROM inventory ORDER BY 1') == [('M1', 0), ('M2', 3)]
+    assert _rows("SELECT sql FROM sqlite_master WHERE name = 'idx_inventory_derive_1'")[0][0].endswith(
+        'WHERE qty_available IS NULL')
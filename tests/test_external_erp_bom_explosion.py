@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""bom_explosion：循环引用检测、多层展开和增量刷新"""
+
+from bom_explosion import _Exploder, component_requirements, find_cycle_edges, refresh_bom_explosion
+from database import get_db
+
+
+def _set_bom(edges):
+    conn = get_db()
+    try:
+        conn.execute('DELETE FROM bom')
+        conn.executemany('INSERT INTO bom (parent_id, child_id, qty) VALUES (?, ?, ?)', edges)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _rows(sql):
+    conn = get_db()
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_find_cycle_edges():
+    graph = {'A': [('B', 1)], 'B': [('C', 2)], 'C': [('A', 1), ('D', 1)], 'D': []}
+    assert find_cycle_edges(graph) == {('C', 'A'): 'A -> B -> C -> A'}
+    assert find_cycle_edges({'A': [('A', 1)]}) == {('A', 'A'): 'A -> A'}
+    assert find_cycle_edges({'A': [('B', 1), ('C', 1)], 'B': [('C', 1)], 'C': []}) == {}
+
+
+def test_explode_sums_paths_and_breaks_cycles():
+    graph = {'A': [('B', 2), ('C', 1)], 'B': [('C', 3)], 'C': [('A', 1)]}
+    exploder = _Exploder(graph, find_cycle_edges(graph))
+    # C 经 A->C 需要 1 个，经 A->B->C 需要 2*3 个；层级取最深
+    assert exploder.explode('A') == {'B': (2, 1), 'C': (7, 2)}
+
+
+def test_explode_deep_chain_without_recursion():
+    depth = 1500
+    graph = {f"N{i}": [(f"N{i + 1}", 1)] for i in range(depth)}
+    result = _Exploder(graph, ()).explode('N0')
+    assert len(result) == depth
+    assert result[f"N{depth}"] == (1, depth)
+
+
+def test_refresh_records_cycles_and_updates_incrementally(kingdee_db):
+    _set_bom([('A', 'B', 2), ('B', 'C', 3), ('C', 'B', 1), ('X', 'Y', 1)])
+    assert refresh_bom_explosion() == {'roots': 4, 'rows': 4, 'cycles': 1}
+    assert _rows('SELECT parent_id, child_id, path FROM bom_cycle') == [('C', 'B', 'B -> C -> B')]
+    assert component_requirements('A', 10) == [('B', 20, 1), ('C', 60, 2)]
+
+    # 没有变化时不展开
+    assert refresh_bom_explosion() == {'roots': 0, 'rows': 0, 'cycles': 0}
+
+    # 只有 C 的子项变了：重新展开 C 及其祖先，X 不动；环断开后不再记录
+    _set_bom([('A', 'B', 2), ('B', 'C', 3), ('C', 'D', 4), ('X', 'Y', 1)])
+    assert refresh_bom_explosion()['roots'] == 3
+    assert _rows('SELECT COUNT(*) FROM bom_cycle') == [(0,)]
+    assert component_requirements('A') == [('B', 2, 1), ('C', 6, 2), ('D', 24, 3)]
+    assert component_requirements('X') == [('Y', 1, 1)]
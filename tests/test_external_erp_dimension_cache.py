@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""dimension_cache：有界 LRU 淘汰，以及 内存 -> 本地库 -> 金蝶 的逐级解析"""
+
+from database import get_db
+from dimension_cache import REMOTE_CHUNK, DimensionCache
+
+
+def test_evicts_least_recently_used():
+    cache = DimensionCache(max_entries=REMOTE_CHUNK)
+    for i in range(REMOTE_CHUNK):
+        cache.put('materials', f"M{i}", f"物料{i}")
+    # 读过的条目移到队尾，不会先被淘汰
+    assert cache.get('materials', 'M0') == '物料0'
+
+    cache.put('materials', 'NEW', '新物料')
+    assert cache.stats['evicted'] == 1
+    assert cache.get('materials', 'M0') == '物料0'
+    assert cache.get('materials', 'M1') is None
+    assert cache.get('materials', 'NEW') == '新物料'
+
+
+def test_dimensions_are_bounded_separately():
+    cache = DimensionCache(max_entries=REMOTE_CHUNK)
+    cache.put('customers', 'C1', '客户1')
+    for i in range(REMOTE_CHUNK + 10):
+        cache.put('materials', f"M{i}", f"物料{i}")
+    assert cache.stats['evicted'] == 10
+    assert cache.get('customers', 'C1') == '客户1'
+
+
+def test_expired_entries_are_dropped():
+    cache = DimensionCache(ttl=-1)
+    cache.put('materials', 'M1', '物料1')
+    assert cache.get('materials', 'M1') is None
+
+
+def test_resolve_reads_local_then_remote_once(kingdee_db):
+    conn = get_db()
+    try:
+        conn.execute("INSERT INTO materials (material_id, material_name) VALUES ('M1', '本地物料')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    queries = []
+
+    def fetch(form_id, field_keys, filter_string, limit, metrics=None):
+        queries.append((form_id, filter_string))
+        return [['M2', '金蝶物料'], ['M2', '另一组织的名称']]
+
+    cache = DimensionCache(fetch=fetch)
+    expected = {'M1': '本地物料', 'M2': '金蝶物料', 'M3': ''}
+    assert cache.resolve('materials', ['M1', 'M2', 'M3']) == expected
+    assert queries == [('BD_Material', "FNumber IN ('M2','M3')")]
+
+    # 查不到的编码也缓存（空名称），再次解析不访问本地库和金蝶
+    assert cache.resolve('materials', ['M1', 'M2', 'M3']) == expected
+    assert len(queries) == 1
+    assert cache.stats['unresolved'] == 1
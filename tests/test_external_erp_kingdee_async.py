@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""kingdee_async：一次运行共用一个后台事件循环和会话，沿用同步客户端的登录"""
+
+import threading
+
+import pytest
+
+from account_sets import AccountSet
+from kingdee_async import ASYNC_AVAILABLE, BackgroundAsyncClient
+from sync_kingdee import KingdeeSync
+
+pytestmark = pytest.mark.skipif(not ASYNC_AVAILABLE, reason='需要 aiohttp')
+
+
+def _async_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'kingdee-async']
+
+
+def test_one_async_client_per_run_reuses_login(kingdee_db, fake_kingdee):
+    syncer = KingdeeSync(batch_size=100, fan_out=4, use_async=True,
+                         account=AccountSet('test', 'DB_A', base_url=fake_kingdee.url))
+    try:
+        assert syncer.login()
+        assert syncer.sync_materials(page_size=100) == 1000
+        client = syncer.async_client()
+        assert syncer.sync_customers(page_size=100) == 1000
+        assert syncer.async_client() is client
+        # 只有同步客户端登录过一次，异步客户端沿用它的会话 cookie
+        assert fake_kingdee.stats['login'] == 1
+        assert len(_async_threads()) == 1
+    finally:
+        syncer.close()
+    assert _async_threads() == []
+
+
+def test_early_exit_cancels_fetch_but_keeps_session(fake_kingdee):
+    client = BackgroundAsyncClient(base_url=fake_kingdee.url, account=AccountSet('test', 'DB_A'))
+    try:
+        rows = client.iter_rows('BD_Material', 'FNumber,FName', page_size=100, concurrency=4)
+        assert len([next(rows) for _ in range(150)]) == 150
+        rows.close()
+
+        # 同一个会话接着拉别的表单，不再登录
+        assert len(list(client.iter_rows('BD_Customer', 'FNumber,FName', page_size=100, concurrency=4))) == 1000
+        assert fake_kingdee.stats['login'] == 1
+    finally:
+        client.close()
+    assert client.loop.is_closed()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""pipeline：三段流水线出错时在拉取线程里关闭整条源迭代器链；默认流水线下的端到端失败和重跑"""
+
+import threading
+
+import pytest
+
+from account_sets import AccountSet
+from pipeline import Pipeline
+from sync_kingdee import KingdeeSync
+
+
+def _source(events, size):
+    """模拟拉取生成器：记录在哪个线程里创建（首次迭代）和关闭"""
+    events['started'] = threading.current_thread().name
+    try:
+        for i in range(size):
+            yield i
+    finally:
+        events['closed'] = threading.current_thread().name
+
+
+def test_failing_transform_closes_source_on_fetch_thread():
+    events = {}
+
+    def transform(chunk):
+        if chunk[0] >= 20:
+            raise ValueError('boom')
+        return chunk
+
+    pipeline = Pipeline(_source(events, 1000), transform, chunk_size=10, depth=1, name='t')
+    with pytest.raises(ValueError, match='boom'):
+        with pipeline as chunks:
+            for _ in chunks:
+                pass
+    assert events == {'started': 't-fetch', 'closed': 't-fetch'}
+
+
+def test_writer_exit_closes_source_on_fetch_thread():
+    events = {}
+    pipeline = Pipeline(_source(events, 1000), list, chunk_size=10, depth=1, name='t')
+    with pipeline as chunks:
+        next(chunks)
+    assert events == {'started': 't-fetch', 'closed': 't-fetch'}
+
+
+def test_failed_sync_returns_limiter_slots(kingdee_db, fake_kingdee):
+    syncer = KingdeeSync(batch_size=100, account=AccountSet('test', 'DB_A', base_url=fake_kingdee.url))
+    assert syncer.pipeline_depth > 0
+    assert syncer.login()
+    seen = []
+
+    def fail_at_row_700(values):
+        seen.append(values)
+        if len(seen) == 700:
+            raise ValueError('转换失败')
+        return values
+
+    with pytest.raises(ValueError, match='转换失败'):
+        syncer._sync_spec('materials', 100, fail_at_row_700)
+    assert syncer.limiter.in_flight == 0
+
+    # 默认上限为 1：名额没归还时下一次同步会一直等
+    result = []
+    worker = threading.Thread(target=lambda: result.append(syncer.sync_materials(page_size=100)), daemon=True)
+    worker.start()
+    worker.join(30)
+    assert result == [1000]
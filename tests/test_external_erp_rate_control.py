@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""rate_control：AIMD 在途上限和全局令牌桶"""
+
+import threading
+
+from rate_control import NEUTRAL, OK, SLOW, THROTTLED, AdaptiveConcurrency, TokenBucket
+
+
+def test_additive_increase_only_when_saturated():
+    controller = AdaptiveConcurrency(max_limit=8, initial=2, latency_target=0)
+    started = controller.acquire()
+    controller.release(started, 0.01, OK)
+    # 上限没用满时成功不加
+    assert controller.limit == 2
+
+    first, second = controller.acquire(), controller.acquire()
+    controller.release(first, 0.01, OK)
+    assert controller.limit == 2.5
+    controller.release(second, 0.01, OK)
+    assert controller.limit == 2.5
+
+
+def test_multiplicative_decrease_once_per_round():
+    controller = AdaptiveConcurrency(max_limit=8, initial=8)
+    starts = [controller.acquire() for _ in range(3)]
+    controller.release(starts[0], 0.01, THROTTLED)
+    assert controller.limit == 4
+    # 降速前发出的请求再报限流不重复降
+    controller.release(starts[1], 0.01, THROTTLED)
+    controller.release(starts[2], 0.01, NEUTRAL)
+    assert controller.limit == 4
+    assert controller.stats['decreases'] == 1
+
+    # 新一轮的请求变慢按 slow_backoff 降
+    started = controller.acquire()
+    controller.release(started, controller.latency_target + 1, OK)
+    assert controller.limit == 4 * 0.8
+    assert controller.stats[SLOW] == 1
+
+
+def test_limit_stays_within_bounds():
+    controller = AdaptiveConcurrency(max_limit=4, min_limit=1, initial=1)
+    for _ in range(5):
+        started = controller.acquire()
+        controller.release(started, 0.01, THROTTLED)
+    assert controller.limit == 1
+
+    for _ in range(50):
+        starts = [controller.acquire() for _ in range(int(controller.limit))]
+        for started in starts:
+            controller.release(started, 0.01, OK)
+    assert controller.limit == 4
+
+
+def test_acquire_waits_for_a_slot_but_nested_requests_do_not():
+    controller = AdaptiveConcurrency(max_limit=1, initial=1)
+    started = controller.acquire()
+    # 占着名额的线程再发起嵌套请求不排队
+    nested = controller.acquire()
+    controller.release(nested, 0.01, OK)
+
+    acquired = threading.Event()
+
+    def other():
+        controller.release(controller.acquire(), 0.01, OK)
+        acquired.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    assert not acquired.wait(0.2)
+    controller.release(started, 0.01, OK)
+    assert acquired.wait(5)
+    thread.join()
+    assert controller.stats['peak_in_flight'] == 2
+
+
+def test_token_bucket_reserve_queues_callers():
+    bucket = TokenBucket(rate=10, burst=1)
+    assert bucket.reserve() == 0
+    waits = [bucket.reserve() for _ in range(3)]
+    assert waits == sorted(waits)
+    assert 0.05 < waits[0] <= 0.1
+    assert 0.25 < waits[-1] <= 0.3
+
+
+def test_reserve_rate_counts_requests_without_holding_a_slot():
+    controller = AdaptiveConcurrency(max_limit=1, initial=1, max_rps=1000)
+    assert controller.reserve_rate() == 0
+    assert controller.in_flight == 0
+    assert controller.stats['requests'] == 1
+
+
+def test_release_from_another_thread_frees_the_slot():
+    controller = AdaptiveConcurrency(max_limit=1, initial=1)
+    request = controller.request()
+    request.__enter__()
+
+    # 流式读取的生成器可能在别的线程里被关闭，名额照样归还，嵌套计数记回占名额的线程
+    closer = threading.Thread(target=request.__exit__, args=(None, None, None))
+    closer.start()
+    closer.join()
+    assert controller.in_flight == 0
+    assert controller.held() == [0]
+
+    other = threading.Thread(target=lambda: controller.release(controller.acquire(), 0.01, OK))
+    other.start()
+    other.join(5)
+    assert not other.is_alive()
+    assert controller.stats['requests'] == 2
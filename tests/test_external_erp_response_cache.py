@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""response_cache：按写入时间过期、LRU 淘汰、按账套区分的键，以及回放未命中报错"""
+
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+from account_sets import AccountSet
+from kingdee_api import KingdeeApiError
+from response_cache import ResponseCache
+from sync_kingdee import KingdeeSync
+
+QUERY = {'FormId': 'BD_Material', 'FieldKeys': 'FNumber,FName', 'StartRow': 0, 'Limit': 100}
+
+
+def _age(cache, key, seconds):
+    """把缓存条目的写入时间往前拨"""
+    path = cache._path(key)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        entry = json.load(f)
+    entry['written_at'] -= seconds
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(entry, f)
+
+
+def test_key_includes_scope():
+    key = ResponseCache.key(QUERY, 'http://erp/k3cloud|DB_A')
+    assert key == ResponseCache.key(dict(QUERY), 'http://erp/k3cloud|DB_A')
+    assert key != ResponseCache.key(QUERY, 'http://erp/k3cloud|DB_B')
+    assert key != ResponseCache.key(dict(QUERY, StartRow=100), 'http://erp/k3cloud|DB_A')
+
+
+def test_ttl_counts_from_write_time(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=60)
+    key = ResponseCache.key(QUERY)
+    cache.put(key, [['M1', '物料1']])
+    assert cache.get(key) == [['M1', '物料1']]
+
+    # 读取不续命：写入 61 秒后过期并删除文件，即使刚刚读过
+    _age(cache, key, 61)
+    assert cache.get(key) is None
+    assert not os.path.exists(cache._path(key))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_replay_ignores_ttl_and_never_writes(tmp_path):
+    ResponseCache(str(tmp_path), ttl=60).put(ResponseCache.key(QUERY), [['M1', '物料1']])
+    replay = ResponseCache(str(tmp_path), ttl=60, replay=True)
+    _age(replay, ResponseCache.key(QUERY), 3600)
+    assert replay.get(ResponseCache.key(QUERY)) == [['M1', '物料1']]
+
+    other = ResponseCache.key(dict(QUERY, StartRow=100))
+    replay.put(other, [])
+    assert replay.get(other) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=0)
+    keys = [ResponseCache.key(dict(QUERY, StartRow=i * 100)) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, [[f"M{n}", 'x' * 200] for n in range(50)])
+        os.utime(cache._path(key), (time.time() - 100 + i, time.time()))
+    # 最早写入的读过一次，变成最近使用
+    assert cache.get(keys[0]) is not None
+
+    cache.max_bytes = cache._total_bytes - 1
+    cache._evict()
+    assert os.path.exists(cache._path(keys[0]))
+    assert not os.path.exists(cache._path(keys[1]))
+
+
+def test_replay_miss_raises_instead_of_returning_empty_page(tmp_path):
+    cache = ResponseCache(str(tmp_path), replay=True)
+    client = KingdeeSync(cache=cache, account=AccountSet('test', 'DB_A', base_url='http://127.0.0.1:9/k3cloud'))
+    assert client.login()
+    with pytest.raises(KingdeeApiError, match='回放缓存未命中'):
+        client.query_entity('BD_Material', 'FNumber,FName', limit=100)
+
+
+def test_client_cache_is_scoped_by_account(tmp_path, fake_kingdee):
+    cache = ResponseCache(str(tmp_path))
+    first = KingdeeSync(cache=cache, account=AccountSet('a', 'DB_A', base_url=fake_kingdee.url))
+    assert first.login()
+    rows = first.query_entity('BD_Material', 'FNumber,FName', limit=10)
+    assert len(rows) == 10
+    assert first.query_entity('BD_Material', 'FNumber,FName', limit=10) == rows
+    assert fake_kingdee.stats['query'] == 1
+
+    # 同一查询换一个账套不命中
+    second = KingdeeSync(cache=cache, account=AccountSet('b', 'DB_B', base_url=fake_kingdee.url))
+    assert second.login()
+    second.query_entity('BD_Material', 'FNumber,FName', limit=10)
+    assert fake_kingdee.stats['query'] == 2
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""端到端：KingdeeSync 对接 fake_kingdee 的断点续传，经 mes_sink 推送到 fake_mes，BOM 边的删除检测，以及分区库"""
+
+import threading
+
+import pytest
+
+from account_sets import AccountSet
+from entity_specs import ENTITY_SPECS, sync_entity
+from fake_kingdee import error_response
+from kingdee_api import KingdeeApiError
+from mes_sink import MesSink, _work_order
+from sync_kingdee import KingdeeSync
+from sync_state import CHECKPOINT_DONE, connect, get_watermark, load_checkpoint, prepare_database
+
+
+def _rows(sql, db_path=None):
+    conn = connect(db_path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def _count(table, db_path=None):
+    return _rows(f'SELECT COUNT(*) FROM {table}', db_path)[0][0]
+
+
+def _syncer(server, **options):
+    return KingdeeSync(batch_size=100, pipeline_depth=0, account=AccountSet('test', 'DB_A', base_url=server.url),
+                       **options)
+
+
+def test_resume_continues_from_checkpoint(kingdee_db, fake_kingdee, monkeypatch):
+    query = fake_kingdee._query
+    failures = []
+
+    # 流水线按 500 行一块转换写入：第二块拉到 StartRow=600 时中断，第一块已提交
+    def fail_once_at_row_600(session_id, data, active):
+        if data.get('FormId') == 'BD_Material' and int(data.get('StartRow') or 0) == 600 and not failures:
+            failures.append(data['StartRow'])
+            return 200, error_response('模拟金蝶中断')
+        return query(session_id, data, active)
+
+    monkeypatch.setattr(fake_kingdee, '_query', fail_once_at_row_600)
+
+    syncer = _syncer(fake_kingdee)
+    assert syncer.login()
+    syncer.start_run(['materials'])
+    with pytest.raises(KingdeeApiError):
+        syncer.sync_materials(page_size=100)
+    checkpoint = load_checkpoint('materials')
+    assert (checkpoint.run_id, checkpoint.start_row, checkpoint.row_count) == (syncer.run_id, 500, 500)
+    assert not checkpoint.done
+    assert _count('materials') == 500
+
+    # 续传沿用中断运行的 ID，从 StartRow=500 拉取剩下的 500 行
+    rows_before = fake_kingdee.stats['rows']
+    resumed = _syncer(fake_kingdee, resume=True)
+    assert resumed.login()
+    resumed.start_run(['materials'])
+    assert resumed.run_id == syncer.run_id
+    assert resumed.sync_materials(page_size=100) == 1000
+    assert fake_kingdee.stats['rows'] - rows_before == 500
+    assert _count('materials') == 1000
+    assert load_checkpoint('materials').status == CHECKPOINT_DONE
+
+    # 该运行的实体已全部完成，没有可续传的：开新运行
+    again = _syncer(fake_kingdee, resume=True)
+    again.start_run(['materials'])
+    assert again.run_id != syncer.run_id
+
+
+def test_completed_entity_is_skipped_within_the_same_run(kingdee_db, fake_kingdee):
+    syncer = _syncer(fake_kingdee)
+    assert syncer.login()
+    syncer.start_run(['materials', 'customers'])
+    assert syncer.sync_materials(page_size=250) == 1000
+
+    # customers 还没同步，这个运行仍算中断；续传时 materials 跳过
+    resumed = _syncer(fake_kingdee, resume=True)
+    resumed.start_run(['materials', 'customers'])
+    assert resumed.run_id == syncer.run_id
+    queries = fake_kingdee.stats['query']
+    assert resumed.sync_materials(page_size=250) == 1000
+    assert fake_kingdee.stats['query'] == queries
+
+
+def test_mes_sink_pushes_mapped_entities_and_logs_skipped(kingdee_db, fake_kingdee, fake_mes, capsys):
+    sink = MesSink(fake_mes.url, batch_size=300)
+    try:
+        syncer = _syncer(fake_kingdee, full=True, sink=sink)
+        assert syncer.login()
+        assert syncer.sync_materials(page_size=250) == 1000
+        assert syncer.sync_customers(page_size=250) == 1000
+        syncer.sync_customers(page_size=250)
+
+        snapshot = fake_mes.snapshot()
+        assert snapshot['records'] == {'MATERIAL': 1000}
+        assert snapshot['batches'] == 4
+        # 跳过的实体只提示一次，并列进汇总
+        assert capsys.readouterr().out.count('MES 不接收 customers') == 1
+        assert sink.summary().endswith('未推送: customers')
+
+        # 同一批数据重推：服务端按 Idempotency-Key 判重
+        assert _syncer(fake_kingdee, full=True, sink=sink).sync_materials(page_size=250) == 1000
+        assert fake_mes.snapshot()['duplicates'] == 4
+        assert sink.stats['duplicates'] == 4
+    finally:
+        sink.close()
+
+
+def test_partition_database_is_passed_explicitly(kingdee_db, fake_kingdee, tmp_path):
+    partition = prepare_database(str(tmp_path / 'plant-a.db'))
+    syncer = KingdeeSync(batch_size=100, account=AccountSet('plant-a', 'DB_A', base_url=fake_kingdee.url),
+                         db_path=partition)
+    assert syncer.sync_all() is not None
+
+    # 数据、水位、断点和日志都只在分区库里，默认库（database.get_db）不受影响
+    assert _count('materials', partition) == 1000
+    assert get_watermark('materials', partition)
+    assert load_checkpoint('materials', partition).done
+    assert _rows("SELECT COUNT(*) FROM sync_log_detail WHERE entity = 'materials'", partition) == [(1,)]
+    assert _count('materials') == 0
+    assert _count('sync_log') == 0
+    assert get_watermark('materials') is None
+
+
+def test_work_order_status_is_sent_as_kingdee_code():
+    row = {'mo_no': 'MO1', 'material_id': 'M1', 'qty_plan': 5, 'status': 'Released', 'so_no': 'SO1',
+           'promise_date': '2026-01-31'}
+    assert _work_order(row)['status'] == '2'
+    assert _work_order(dict(row, status='Unknown'))['status'] == 'Unknown'
+
+
+def _bom_rows(edges):
+    """[(父项, 子项)] -> 按 bom 声明字段顺序的金蝶行"""
+    fields = ENTITY_SPECS['bom'].field_keys_list
+
+    def iter_rows(form_id, field_keys, filter_string, page_size, order_string, start_row=0):
+        for parent, child in edges:
+            row = {'FMaterialId.FNumber': parent, 'FChildMaterialId.FNumber': child, 'FBOMChildQty': 1,
+                   'FModifyDate': '2026-01-01T00:00:00'}
+            yield [row.get(field) for field in fields]
+    return iter_rows
+
+
+def _sync_bom(edges, full):
+    return sync_entity(ENTITY_SPECS['bom'], _bom_rows(edges), threading.Lock(), full=full, batch_size=3)
+
+
+def test_delta_bom_keeps_edges_spread_across_batches_and_bills(kingdee_db):
+    _sync_bom([('X', 'c1'), ('X', 'c2'), ('X', 'c3'), ('Y', 'c9')], full=True)
+
+    # 增量只拉修改过的用料清单：X 的子项分散在不相邻的单据和不同的写入批里，都要保留
+    assert get_watermark('bom')
+    assert _sync_bom([('X', 'c1'), ('X', 'c2'), ('Y', 'c9'), ('X', 'c3')], full=False) == 4
+    assert _rows('SELECT parent_id, child_id FROM bom ORDER BY 1, 2') == \
+        [('X', 'c1'), ('X', 'c2'), ('X', 'c3'), ('Y', 'c9')]
+
+    # 增量里缺的边不删
+    _sync_bom([('X', 'c3')], full=False)
+    assert _count('bom') == 4
+
+
+def test_full_bom_snapshot_deletes_vanished_edges(kingdee_db):
+    _sync_bom([('X', 'c1'), ('X', 'c2'), ('X', 'c3'), ('Y', 'c9')], full=True)
+
+    # 全量快照里 X→c2 没有出现：金蝶已删掉
+    _sync_bom([('X', 'c1'), ('Y', 'c9'), ('X', 'c3')], full=True)
+    assert _rows('SELECT parent_id, child_id FROM bom ORDER BY 1, 2') == [('X', 'c1'), ('X', 'c3'), ('Y', 'c9')]
+    assert _rows("SELECT COUNT(*) FROM sync_row_hash WHERE table_name = 'bom'") == [(3,)]
+
+    # 快照为空视为异常，不清空本地
+    _sync_bom([], full=True)
+    assert _count('bom') == 3
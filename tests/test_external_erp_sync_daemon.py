@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""sync_daemon：基础和增强实体经同一个客户端调度，共用一次登录、会话和并发控制"""
+
+import kingdee_client
+from account_sets import AccountSet
+from sync_daemon import SyncDaemon
+
+
+def test_scheduled_jobs_share_one_client(kingdee_db, fake_kingdee, monkeypatch):
+    monkeypatch.setattr(kingdee_client, 'default_account',
+                        lambda: AccountSet('test', 'DB_A', base_url=fake_kingdee.url))
+    daemon = SyncDaemon(parallel=2, pipeline_depth=0)
+    daemon.register(['materials', 'suppliers_enhanced'])
+    try:
+        assert daemon._login()
+        results = {name: schedule.run() for name, schedule in daemon.schedules.items()}
+    finally:
+        daemon.client.close()
+
+    assert results['materials'][0] == 1000
+    assert results['suppliers_enhanced'][0] == 1000
+    assert fake_kingdee.stats['login'] == 1
+    assert daemon.client.limiter is daemon.limiter
+    assert daemon.client.metrics.get('suppliers_enhanced') is not None
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""sync_metrics：按表单归属实体（含备选表单），未登记的表单不多出导出的实体"""
+
+from account_sets import AccountSet
+from sync_kingdee_enhanced import KingdeeEnhancedSync
+from sync_metrics import SyncMetrics
+
+
+def test_for_form_maps_alternate_forms_and_caller():
+    metrics = SyncMetrics()
+    workcenters = metrics.entity('workcenters_enhanced', 'BD_WorkCenter', ('BD_WorkCenter', 'PRD_WorkCenter'))
+    assert metrics.for_form('PRD_WorkCenter') is workcenters
+
+    # 发起查询的实体优先：解析名称时查的主数据表单计入它
+    assert metrics.for_form('BD_Material', workcenters) is workcenters
+
+    # 未登记又没有调用方的表单不登记成实体，不会导出一个一直 running 的序列
+    metrics.for_form('BD_Unknown').page(0, 10, 0.1, 0.0)
+    assert list(metrics.entities) == ['workcenters_enhanced']
+    assert 'BD_Unknown' not in metrics.to_prometheus()
+
+
+def test_name_lookups_count_towards_the_syncing_entity(kingdee_db, fake_kingdee):
+    syncer = KingdeeEnhancedSync(batch_size=500, pipeline_depth=0,
+                                 account=AccountSet('test', 'DB_A', base_url=fake_kingdee.url))
+    try:
+        assert syncer.login()
+        assert syncer.sync_sales_orders_enhanced(page_size=500) > 0
+    finally:
+        syncer.close()
+
+    # 物料、客户名称查的是 BD_Material / BD_Customer，请求计入销售订单
+    assert list(syncer.metrics.entities) == ['sales_orders_enhanced']
+    assert syncer.lookups.stats['remote_queries'] > 0
+    orders = syncer.metrics.get('sales_orders_enhanced')
+    assert orders.counters['pages'] == fake_kingdee.stats['query']